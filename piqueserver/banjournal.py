@@ -0,0 +1,156 @@
+"""
+Keeps the ban list on disk without rewriting it for every change.
+
+The bans are stored in the bans file (``bans.txt``) in the usual JSON list
+format, plus a journal next to it (``bans.txt.journal``) with one JSON record
+per line for every ban added or removed since the bans file was last written.
+A ban therefore only costs appending a line.
+
+Once the journal grows long, or when `FeatureProtocol.save_bans` is called,
+the journal is compacted: it is moved aside to ``bans.txt.compacting``, a new
+journal is started, and the full list is written to the bans file in a
+thread. The moved journal is deleted once the bans file has been replaced.
+If the server stops before that, the moved journal is replayed on the next
+start. Replaying records that are already in the bans file is harmless, as
+every record sets or deletes a single network.
+"""
+
+import json
+import os
+
+from twisted.internet import threads
+from twisted.logger import Logger
+
+from piqueserver.networkdict import make_ban_list
+
+log = Logger()
+
+
+class BanJournal:
+    # the number of journal records after which the journal is compacted
+    compact_after = 1000
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.journal_filename = filename + '.journal'
+        self.compacting_filename = filename + '.compacting'
+        self.records = 0
+        # the Deferred of the compaction in progress
+        self.compacting = None
+        self.compact_again = False
+        self._file = None
+
+    def read_bans(self, bans):
+        """read the bans file into bans. Raises the same errors as opening
+        and parsing the file"""
+        with open(self.filename, 'r') as f:
+            bans.read_list(json.load(f))
+
+    def replay(self, bans):
+        """apply the journal records to bans, and return how many there
+        were"""
+        count = 0
+        for filename in (self.compacting_filename, self.journal_filename):
+            try:
+                with open(filename, 'r') as f:
+                    lines = f.readlines()
+            except FileNotFoundError:
+                continue
+            for line in lines:
+                try:
+                    self._apply(bans, json.loads(line))
+                except (ValueError, KeyError, IndexError) as e:
+                    # most likely a line cut short by a crash
+                    log.warn('Skipping invalid ban journal record {line!r}: '
+                             '{exception!r}', line=line, exception=e)
+                count += 1
+        self.records = count
+        return count
+
+    def _apply(self, bans, record):
+        if record[0] == 'add':
+            bans.read_list([record[1:]])
+        elif record[0] == 'remove':
+            try:
+                del bans[record[1]]
+            except KeyError:
+                pass
+        else:
+            raise ValueError('unknown record type')
+
+    def _write(self, record):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.journal_filename) or '.',
+                        exist_ok=True)
+            self._file = open(self.journal_filename, 'a')
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        self.records += 1
+
+    def add(self, network, value):
+        """record the ban value, i.e. (name, reason, expiry time), of
+        network"""
+        self._write(['add', value[0], network] + list(value[1:]))
+
+    def remove(self, network):
+        """record that the ban of network was removed"""
+        self._write(['remove', network])
+
+    def needs_compaction(self):
+        return self.records >= self.compact_after
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def compact(self, bans):
+        """write bans to the bans file in a thread and start a new journal.
+        Returns a Deferred that fires when the bans file is written."""
+        if self.compacting is not None:
+            # the bans may have changed since the running compaction took
+            # its copy
+            self.compact_again = True
+            return self.compacting
+        items = list(bans.networks.items())
+        self.close()
+        if os.path.exists(self.journal_filename):
+            if os.path.exists(self.compacting_filename):
+                # an earlier compaction failed, keep its records until one
+                # succeeds
+                with open(self.journal_filename, 'r') as src, \
+                        open(self.compacting_filename, 'a') as dst:
+                    dst.write(src.read())
+                os.remove(self.journal_filename)
+            else:
+                os.replace(self.journal_filename, self.compacting_filename)
+        self.records = 0
+        self.compacting = threads.deferToThread(self._write_bans, items)
+        self.compacting.addCallbacks(self._compacted, self._failed)
+        self.compacting.addBoth(self._done, bans)
+        return self.compacting
+
+    def _write_bans(self, items):
+        temp_filename = self.filename + '.tmp'
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        with open(temp_filename, 'w') as f:
+            json.dump(make_ban_list(items), f, indent=2)
+        os.replace(temp_filename, self.filename)
+        try:
+            os.remove(self.compacting_filename)
+        except FileNotFoundError:
+            pass
+        return len(items)
+
+    def _compacted(self, count):
+        log.debug("compacted ban journal, {count} bans", count=count)
+
+    def _failed(self, failure):
+        log.failure("Could not write bans file ({path})", failure,
+                    path=self.filename)
+
+    def _done(self, _, bans):
+        self.compacting = None
+        if self.compact_again:
+            self.compact_again = False
+            self.compact(bans)
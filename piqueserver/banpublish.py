@@ -16,6 +16,7 @@
 # along with pyspades.  If not, see <http://www.gnu.org/licenses/>.
 
 import json
+from collections import OrderedDict
 
 from twisted.internet import reactor
 from twisted.web import server
@@ -36,17 +37,53 @@ class PublishResource(Resource):
 
 
 class PublishServer:
+    """
+    Serves the ban list as JSON. The protocol reports single bans with `add`
+    and `remove`, and the JSON is only rebuilt when it is requested after a
+    change, or after one of the published bans expired.
+    """
 
     def __init__(self, protocol, port):
         self.protocol = protocol
+        # network -> (reason, expiry time)
+        self.bans = OrderedDict()
+        self._json = None
+        self._expires = None
         publish_resource = PublishResource(self)
         site = server.Site(publish_resource)
         protocol.listenTCP(port, site)
         self.update()
 
     def update(self):
-        bans = []
-        for network, (_name, reason, timestamp) in self.protocol.bans.iteritems():
-            if timestamp is None or reactor.seconds() < timestamp:
-                bans.append({"ip": network, "reason": reason})
-        self.json_bans = json.dumps(bans)
+        """rebuild the published bans from the protocol's ban list"""
+        self.bans = OrderedDict(
+            (network, (reason, timestamp))
+            for network, (_name, reason, timestamp)
+            in self.protocol.bans.iteritems())
+        self._json = None
+
+    def add(self, network, reason, timestamp):
+        self.bans[network] = (reason, timestamp)
+        self._json = None
+
+    def remove(self, network):
+        if self.bans.pop(network, None) is not None:
+            self._json = None
+
+    @property
+    def json_bans(self):
+        now = reactor.seconds()
+        if (self._json is None or
+                (self._expires is not None and now >= self._expires)):
+            bans = []
+            expires = None
+            for network, (reason, timestamp) in self.bans.items():
+                if timestamp is None:
+                    bans.append({"ip": network, "reason": reason})
+                elif now < timestamp:
+                    bans.append({"ip": network, "reason": reason})
+                    if expires is None or timestamp < expires:
+                        expires = timestamp
+            self._json = json.dumps(bans).encode()
+            self._expires = expires
+        return self._json
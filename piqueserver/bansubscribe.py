@@ -87,7 +87,4 @@ class BanManager:
     def get_ban(self, ip):
         if self.bans is None:
             return None
-        try:
-            return self.bans[ip]
-        except KeyError:
-            return None
+        return self.bans.get(ip)
@@ -36,7 +36,7 @@ def change_planned_map(connection, *pre_maps):
 
     planned_map = maps[0]
     try:
-        protocol.planned_map = check_rotation([planned_map])[0]
+        protocol.set_planned_map(check_rotation([planned_map])[0])
         protocol.broadcast_chat('%s changed next map to %s' %
                                 (name, planned_map), irc=True)
     except MapNotFound:
@@ -122,7 +122,7 @@ def load_map(connection, map):
     protocol = connection.protocol
 
     try:
-        protocol.planned_map = check_rotation([map])[0]
+        protocol.set_planned_map(check_rotation([map])[0])
         protocol.advance_rotation()
     except MapNotFound:
         return 'Map %s not found' % (map)
@@ -1,9 +1,12 @@
+import os
 import random
 import sys
+import time
 
 from twisted.logger import Logger
 
 from piqueserver.commands import command, join_arguments
+from piqueserver.config import config
 
 log = Logger()
 
@@ -77,3 +80,36 @@ def toggle_master(connection):
     protocol.irc_say("* %s " % connection.name + message)
     if connection in connection.protocol.players.values():
         return "You " + message
+
+
+@command('profile', admin_only=True)
+def profile(connection, action='top'):
+    """
+    Profile how long each script takes in the event hooks it overrides
+    /profile <start|stop|top|dump>
+    "dump" writes a flamegraph of the results to the logs directory
+    """
+    profiler = connection.protocol.hook_profiler
+    if action == 'start':
+        profiler.start()
+        return 'Hook profiler started'
+    elif action == 'stop':
+        profiler.stop()
+        return 'Hook profiler stopped after %.0f s' % profiler.get_elapsed()
+    elif action == 'top':
+        top = profiler.get_top()
+        if not top:
+            return 'No hooks profiled, start with /profile start'
+        elapsed = max(profiler.get_elapsed(), 1e-9)
+        return ', '.join('%s %.1f%% (%s calls)' % (
+            label, taken / elapsed * 100, calls)
+            for label, calls, taken in top)
+    elif action == 'dump':
+        filename = os.path.join(
+            config.config_dir, 'logs',
+            time.strftime('hooks-%Y%m%d-%H%M%S.folded'))
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        profiler.dump(filename)
+        log.info("hook profile written to {filename}", filename=filename)
+        return 'Hook profile written to %s' % filename
+    raise ValueError('unknown action, use start, stop, top or dump')
@@ -42,8 +42,9 @@ there is one spawn location for blue and two spawn locations for green::
 
 import random
 import math
-from pyspades.contained import BlockAction, SetColor, BlockLine
+from pyspades.contained import BlockAction
 from pyspades import world
+from pyspades.mapedit import minimize_block_line
 from pyspades.constants import DESTROY_BLOCK, TEAM_CHANGE_KILL, CTF_MODE
 from twisted.internet import reactor
 from piqueserver.commands import command, admin
@@ -94,71 +95,6 @@ def make_color(r, g, b, a=255):
     a = float(a)
     return b | (g << 8) | (r << 16) | (int((a / 255.0) * 128.0) << 24)
 
-# Algorithm for minimizing the number of blocks sent for the gates using
-# a block line. Probably won't find the optimal solution for shapes that are not
-# rectangular prisms but it's better than nothing.
-# d = changing indice
-# c1 = first constant indice
-# c2 = second constant indice
-
-
-def partition(points, d, c1, c2):
-    row = {}
-    row_list = []
-    for point in points:
-        pc1 = point[c1]
-        pc2 = point[c2]
-        if pc1 not in row:
-            row[pc1] = {}
-        dic1 = row[pc1]
-        if pc2 not in dic1:
-            dic1[pc2] = []
-            row_list.append(dic1[pc2])
-        dic2 = dic1[pc2]
-        dic2.append(point)
-
-    row_list_sorted = [sorted(div, key=lambda k: k[d]) for div in row_list]
-
-    # row_list_sorted is a list containing lists of points that all have the same
-    # point[c1] and point[c2] values and are sorted in increasing order
-    # according to point[d]
-    start_block = None
-    final_blocks = []
-    for block_list in row_list_sorted:
-        counter = 0
-        for i, block in enumerate(block_list):
-            counter += 1
-            if start_block is None:
-                start_block = block
-            if i + 1 == len(block_list):
-                next_block = None
-            else:
-                next_block = block_list[i + 1]
-            # Current AoS version seems to have an upper limit of 65 blocks for
-            # a block line
-            if counter == 65 or next_block is None or block[d] + \
-                    1 != next_block[d]:
-                final_blocks.append([start_block, block])
-                start_block = None
-                counter = 0
-    return final_blocks
-
-
-def minimize_block_line(points):
-    x = partition(points, 0, 1, 2)
-    y = partition(points, 1, 0, 2)
-    z = partition(points, 2, 0, 1)
-    xlen = len(x)
-    ylen = len(y)
-    zlen = len(z)
-    if xlen <= ylen and xlen <= zlen:
-        return x
-    if ylen <= xlen and ylen <= zlen:
-        return y
-    if zlen <= xlen and zlen <= ylen:
-        return z
-    return x
-
 
 def get_team_alive_count(team):
     count = 0
@@ -195,24 +131,11 @@ class Gate:
         self.blocks = minimize_block_line(self.blocks)
 
     def build_gate(self):
-        map_ = self.protocol_obj.map
-        block_line = BlockLine()
-        set_color = SetColor()
-        set_color.value = make_color(*self.color)
-        set_color.player_id = block_line.player_id = 32
-        self.protocol_obj.broadcast_contained(set_color, save=True)
-        for block_line_ in self.blocks:
-            start_block, end_block = block_line_
-            points = world.cube_line(*(start_block + end_block))
-            if not points:
-                continue
-            for point in points:
-                x, y, z = point
-                if not map_.get_solid(x, y, z):
-                    map_.set_point(x, y, z, self.color)
-            block_line.x1, block_line.y1, block_line.z1 = start_block
-            block_line.x2, block_line.y2, block_line.z2 = end_block
-            self.protocol_obj.broadcast_contained(block_line, save=True)
+        points = []
+        for start_block, end_block in self.blocks:
+            points.extend(world.cube_line(*(start_block + end_block)))
+        # the gates must be closed before the round starts
+        self.protocol_obj.map_edits.build(points, self.color, paced=False)
 
     def destroy_gate(self):
         map_ = self.protocol_obj.map
@@ -16,16 +16,21 @@
 # along with pyspades.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import hashlib
 import importlib
 import math
 import random
+import tempfile
 import time
+from collections import OrderedDict
 from typing import List, Optional, Union
 
+from twisted.internet.defer import CancelledError
 from twisted.logger import Logger
 
 from pyspades.vxl import VXLData
 from piqueserver.config import config
+from piqueserver.version import __version__
 
 log = Logger()
 
@@ -60,20 +65,126 @@ def check_rotation(maps: List[Union[str, 'RotationInfo']], load_dir:
     return infos
 
 
+class GeneratedMapCache:
+    """
+    Keeps the maps made by map generator scripts on disk, so a seed that
+    comes up again is loaded instead of generated.
+
+    Maps are stored as VXL files named after a hash of the generator script,
+    the seed and the server version, so editing the script or upgrading the
+    server generates them again. Once the files take up more than max_size
+    bytes, the least recently used ones are deleted. Safe to use from several
+    threads.
+    """
+    # bump when the way maps are stored changes
+    format_version = 1
+
+    def __init__(self, directory: str, max_size: int) -> None:
+        self.directory = directory
+        self.max_size = max_size
+
+    def get_filename(self, script_filename: str, name: str, seed: int) -> str:
+        key = hashlib.sha256()
+        with open(script_filename, 'rb') as fp:
+            key.update(fp.read())
+        key.update('\0{}\0{}\0{}\0{}'.format(
+            name, seed, __version__, self.format_version).encode('utf-8'))
+        return os.path.join(self.directory, key.hexdigest() + '.vxl')
+
+    def load(self, filename: str) -> Optional[VXLData]:
+        """return the cached map, or None if there is none"""
+        try:
+            with open(filename, 'rb') as fp:
+                data = VXLData(fp)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            log.warn("Discarding broken cached map {path}: {exception!r}",
+                     path=filename, exception=e)
+            self._remove(filename)
+            return None
+        try:
+            # the modification time is the last use
+            os.utime(filename)
+        except OSError:
+            pass
+        return data
+
+    def store(self, filename: str, data: VXLData) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        # a temp file of its own, as another thread may be storing the same
+        # map
+        fd, temp_filename = tempfile.mkstemp(suffix='.tmp',
+                                             dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(data.generate())
+            os.replace(temp_filename, filename)
+        except BaseException:
+            self._remove(temp_filename)
+            raise
+        self.evict()
+
+    def evict(self) -> None:
+        """delete the least recently used maps until the rest fit"""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith('.vxl'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            self._remove(path)
+            total -= size
+
+    def _remove(self, filename):
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+
+
 class Map:
     # pylint: disable=too-many-instance-attributes
 
-    def __init__(self, rot_info: 'RotationInfo', load_dir: str) -> None:
+    def __init__(self, rot_info: 'RotationInfo', load_dir: str,
+                 cache: Optional[GeneratedMapCache] = None) -> None:
         self.load_information(rot_info, load_dir)
 
         # we want to count how long a map load or generate takes
         start_time = time.monotonic()
+        self.seed = None
         if self.gen_script:
-            seed = rot_info.get_seed()
+            seed = self.seed = rot_info.get_seed()
             self.name = '{} #{}'.format(rot_info.name, seed)
-            log.info("Generating map '{mapname}'...", mapname=self.name)
             random.seed(seed)
-            self.data = self.gen_script(rot_info.name, seed)
+            self.data = None
+            if cache is not None:
+                cache_filename = cache.get_filename(
+                    rot_info.get_meta_filename(load_dir), rot_info.name, seed)
+                self.data = cache.load(cache_filename)
+            if self.data is not None:
+                log.info("Found map '{mapname}' in the cache",
+                         mapname=self.name)
+            else:
+                log.info("Generating map '{mapname}'...", mapname=self.name)
+                self.data = self.gen_script(rot_info.name, seed)
+                if cache is not None:
+                    try:
+                        cache.store(cache_filename, self.data)
+                    except OSError as e:
+                        log.warn("Could not cache map '{mapname}': "
+                                 "{exception!r}", mapname=self.name,
+                                 exception=e)
         else:
             log.info("Loading map '{mapname}'...", mapname=self.name)
             self.load_vxl(rot_info)
@@ -121,6 +232,13 @@ class Map:
         self.on_block_destroy = getattr(info, 'on_block_destroy', None)
         self.is_indestructable = getattr(info, 'is_indestructable', None)
 
+    def get_rotation_name(self) -> str:
+        """return the rotation name that loads this map again, with the seed
+        of generated maps"""
+        if self.seed is None:
+            return self.rot_info.full_name
+        return '{}#{}'.format(self.rot_info.name, self.seed)
+
     def apply_script(self, protocol, connection, config):
         if self.script is not None:
             protocol, connection = self.script(protocol, connection, config)
@@ -135,6 +253,73 @@ class Map:
         fp.close()
 
 
+class MapCache:
+    """
+    Loads maps ahead of time, so the next map of the rotation is ready when
+    the round ends.
+
+    load is called with a `RotationInfo` and returns a Deferred that fires
+    with the `Map`. At most size maps are kept, loaded or still loading; the
+    ones prefetched longest ago are dropped first. Loading happens in a
+    thread that can't be interrupted, so cancelling a map only discards it
+    once it is done.
+    """
+
+    def __init__(self, load, size: int = 1) -> None:
+        self.load = load
+        self.size = size
+        # full name -> Deferred firing with the Map, or None if it failed
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def prefetch(self, rot_info: 'RotationInfo') -> None:
+        """start loading rot_info, unless it is already"""
+        key = rot_info.full_name
+        if self.size <= 0 or key in self.entries:
+            return
+        log.info("Prefetching map '{name}'", name=key)
+        d = self.load(rot_info)
+        d.addErrback(self._failed, key)
+        self.entries[key] = d
+        while len(self.entries) > self.size:
+            _, old = self.entries.popitem(last=False)
+            old.cancel()
+
+    def _failed(self, failure, key):
+        if not failure.check(CancelledError):
+            log.warn("Prefetching map '{name}' failed: {error}", name=key,
+                     error=failure.getErrorMessage())
+        return None
+
+    def cancel(self, rot_info: Optional['RotationInfo'] = None) -> None:
+        """drop the prefetched rot_info, or every map if it is None"""
+        if rot_info is None:
+            entries = list(self.entries.values())
+            self.entries.clear()
+        else:
+            entry = self.entries.pop(rot_info.full_name, None)
+            entries = [entry] if entry is not None else []
+        for d in entries:
+            d.cancel()
+
+    async def get(self, rot_info: 'RotationInfo') -> 'Map':
+        """return the map of rot_info, prefetched or loaded now"""
+        key = rot_info.full_name
+        d = self.entries.pop(key, None)
+        if d is not None:
+            ready = d.called
+            the_map = await d
+            if the_map is not None:
+                self.hits += 1
+                log.info("Map prefetch hit for '{name}' ({state})", name=key,
+                         state='ready' if ready else 'still loading')
+                return the_map
+        self.misses += 1
+        log.info("Map prefetch miss for '{name}'", name=key)
+        return await self.load(rot_info)
+
+
 class RotationInfo:
     seed = None
 
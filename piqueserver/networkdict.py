@@ -1,91 +1,182 @@
-from ipaddress import ip_network, ip_address
+from ipaddress import ip_network, IPv6Address
 from collections import OrderedDict
+from socket import inet_ntop, inet_pton, AF_INET, AF_INET6
+
+ADDRESS_BITS = {4: 32, 6: 128}
+
+_MISSING = object()
+
 
 def get_cidr(network):
     if network.prefixlen == 32:
         return str(network.network_address)
     return str(network)
 
+
+def parse_network(key, strict=False):
+    """return (version, network address as int, prefix length) of an address
+    or CIDR network, e.g. (4, 0x7f000000, 8) for '127.0.0.0/8'"""
+    key = str(key)
+    if '/' not in key:
+        # plain addresses are by far the most common keys, and much cheaper
+        # to parse without ipaddress
+        try:
+            return 4, int.from_bytes(inet_pton(AF_INET, key), 'big'), 32
+        except (OSError, ValueError):
+            pass
+        try:
+            return 6, int.from_bytes(inet_pton(AF_INET6, key), 'big'), 128
+        except (OSError, ValueError):
+            pass
+    network = ip_network(key, strict=strict)
+    return network.version, int(network.network_address), network.prefixlen
+
+
+def format_network(version, address, prefixlen):
+    """the inverse of parse_network, formatted like get_cidr"""
+    if version == 4:
+        text = inet_ntop(AF_INET, address.to_bytes(4, 'big'))
+        if prefixlen == 32:
+            return text
+    else:
+        text = str(IPv6Address(address))
+    return '{}/{}'.format(text, prefixlen)
+
+
+def make_ban_list(networks):
+    """return the (key, value) items of `NetworkDict.networks` as entries of
+    the bans file, i.e. [name, ip, reason, time]"""
+    values = []
+    for network, value in networks:
+        values.append([value[0], format_network(*network)] + list(value[1:]))
+    return values
+
 # Note: Network objects cannot have any host bits set without strict=False.
 # More info: https://docs.python.org/3/howto/ipaddress.html#defining-networks
 
 
 class NetworkDict:
+    """
+    Maps IPv4 and IPv6 networks to values. Looking up an address returns the
+    value of the most specific network that contains it.
+
+    Networks are kept in one table per IP version and prefix length, keyed by
+    the prefix bits of the network as an int. A lookup shifts the address
+    down to each prefix length in use, longest first, so it costs one dict
+    lookup per distinct prefix length instead of building an ip_network for
+    every supernet. Ban lists only use a handful of prefix lengths.
+
+    The insertion order is kept in `networks` for iterating and `pop`. Like
+    before, a /0 network can be stored, but doesn't match any address.
+    """
+
     def __init__(self):
+        # (version, address, prefix length) -> value
         self.networks = OrderedDict()
+        # version -> {prefix length: {prefix: value}}
+        self.tables = {4: {}, 6: {}}
+        # version -> the prefix lengths in use, longest first
+        self.prefixes = {4: [], 6: []}
 
     def read_list(self, values):
+        networks = self.networks
         for index, item in enumerate(values):
             if len(item) < 4:
                 raise ValueError("Invalid ban entry. index: {} item: {}\nEntry format needs to be [name, ip, reason, time]".format(index, item))
-            self[item[1]] = [item[0]] + item[2:]
+            key = parse_network(item[1])
+            value = [item[0]] + item[2:]
+            networks[key] = value
+            self._insert(key, value)
 
     def make_list(self):
-        values = []
-        for network, value in self.iteritems():
-            values.append([value[0]] + [network] + list(value[1:]))
-        return values
+        return make_ban_list(self.networks.items())
+
+    def _insert(self, key, value):
+        version, address, prefixlen = key
+        tables = self.tables[version]
+        table = tables.get(prefixlen)
+        if table is None:
+            table = tables[prefixlen] = {}
+            if prefixlen > 0:
+                prefixes = self.prefixes[version]
+                prefixes.append(prefixlen)
+                prefixes.sort(reverse=True)
+        table[address >> (ADDRESS_BITS[version] - prefixlen)] = value
+
+    def _discard(self, key):
+        version, address, prefixlen = key
+        tables = self.tables[version]
+        table = tables[prefixlen]
+        del table[address >> (ADDRESS_BITS[version] - prefixlen)]
+        if not table:
+            del tables[prefixlen]
+            if prefixlen > 0:
+                self.prefixes[version].remove(prefixlen)
 
     def remove(self, key):
-        """remove a key from the networkdict and return the removed items"""
-        ip = ip_network(str(key), strict=False)
+        """remove the network of key and every network containing it, and
+        return the removed items, most specific first"""
+        version, address, prefixlen = parse_network(key)
+        bits = ADDRESS_BITS[version]
         results = []
-        # There are 32 possible networks for each IP address in CIDR. This is
-        # small enough that we can just loop through all of them to get an
-        # unelegant constant time lookup for IP addresses.
-        #
-        # This loop could be sped up by a lot by using a (ip, mask) int tuple
-        # instead of constantly creating new IPNetwork objects with .supernet()
-        #
-        # When in doubt, use brute force - Ken Thompson
-        for _ in range(0, 32):
-            try:
-                elem = self.networks.pop(ip)
-            except KeyError:
-                pass
-            else:
-                results.append([ip, elem])
-            ip = ip.supernet()
+        for length in list(self.prefixes[version]):
+            if length > prefixlen:
+                continue
+            mask = ~((1 << (bits - length)) - 1)
+            network = (version, address & mask, length)
+            if network not in self.networks:
+                continue
+            results.append([ip_network(format_network(*network)),
+                            self.networks.pop(network)])
+            self._discard(network)
         return results
 
     def __setitem__(self, key, value):
-        self.networks[ip_network(str(key), strict=False)] = value
+        key = parse_network(key)
+        self.networks[key] = value
+        self._insert(key, value)
 
     def __getitem__(self, key):
         return self.get_entry(key)
 
     def get_entry(self, key):
-        ip = ip_network(str(key))
-        # See comment for remove()
-        for _ in range(0, 32):
-            try:
-                return self.networks[ip]
-            except KeyError:
-                pass
-            ip = ip.supernet()
-        raise KeyError(key)
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        """return the value of the most specific network containing key, or
+        default if there is none"""
+        version, address, prefixlen = parse_network(key, strict=True)
+        tables = self.tables[version]
+        bits = ADDRESS_BITS[version]
+        for length in self.prefixes[version]:
+            if length <= prefixlen:
+                value = tables[length].get(address >> (bits - length),
+                                           _MISSING)
+                if value is not _MISSING:
+                    return value
+        return default
 
     def __len__(self):
         return len(self.networks)
 
     def __delitem__(self, key):
-        ip = ip_network(str(key), strict=False)
-        self.networks.pop(ip)
+        key = parse_network(key)
+        del self.networks[key]
+        self._discard(key)
 
-    def pop(self, *arg, **kw):
-        if not arg or not kw:
-            network, value = self.networks.popitem()
-        else:
-            network, value = self.networks.pop(*arg, **kw)
-        return get_cidr(network), value
+    def pop(self):
+        """remove the most recently added network and return its CIDR and
+        value"""
+        key, value = self.networks.popitem()
+        self._discard(key)
+        return format_network(*key), value
 
     def iteritems(self):
         for network, value in self.networks.items():
-            yield get_cidr(network), value
+            yield format_network(*network), value
 
     def __contains__(self, key):
-        try:
-            self.get_entry(key)
-            return True
-        except KeyError:
-            return False
+        return self.get(key, _MISSING) is not _MISSING
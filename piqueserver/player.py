@@ -12,6 +12,7 @@ from pyspades.constants import (ERROR_BANNED, DESTROY_BLOCK, SPADE_DESTROY,
 from pyspades.server import ServerConnection
 from pyspades.common import escape_control_codes, prettify_timespan
 from pyspades.types import AttributeSet, RateLimiter
+from pyspades.voxelset import VoxelSet
 
 # TODO: move these where they belong
 from pyspades.team import Team
@@ -56,12 +57,12 @@ class FeatureConnection(ServerConnection):
         protocol = self.protocol
         client_ip = self.address[0]
 
-        if client_ip in self.protocol.bans:
-            name, reason, timestamp = self.protocol.bans[client_ip]
+        ban = self.protocol.bans.get(client_ip)
+        if ban is not None:
+            name, reason, timestamp = ban
 
             if timestamp is not None and reactor.seconds() >= timestamp:
                 protocol.remove_ban(client_ip)
-                protocol.save_bans()
             else:
                 log.info('banned user {name} ({client_ip}) attempted to join',
                          name=name,
@@ -157,7 +158,7 @@ class FeatureConnection(ServerConnection):
             self.refill()
         if self.god_build:
             if self.protocol.god_blocks is None:
-                self.protocol.god_blocks = set()
+                self.protocol.god_blocks = VoxelSet()
             self.protocol.god_blocks.update(points)
         elif self.protocol.user_blocks is not None:
             self.protocol.user_blocks.update(points)
@@ -167,10 +168,10 @@ class FeatureConnection(ServerConnection):
             self.refill()
         if self.god_build:
             if self.protocol.god_blocks is None:
-                self.protocol.god_blocks = set()
-            self.protocol.god_blocks.add((x, y, z))
+                self.protocol.god_blocks = VoxelSet()
+            self.protocol.god_blocks.add_point(x, y, z)
         elif self.protocol.user_blocks is not None:
-            self.protocol.user_blocks.add((x, y, z))
+            self.protocol.user_blocks.add_point(x, y, z)
 
     def on_block_destroy(self, x: int, y: int, z: int, mode: int) -> bool:
         map_on_block_destroy = self.protocol.map_info.on_block_destroy
@@ -193,17 +194,15 @@ class FeatureConnection(ServerConnection):
                         is_indestructable(x, y, z - 1)):
                     return False
             elif mode == GRENADE_DESTROY:
-                for nade_x in range(x - 1, x + 2):
-                    for nade_y in range(y - 1, y + 2):
-                        for nade_z in range(z - 1, z + 2):
-                            if is_indestructable(nade_x, nade_y, nade_z):
-                                return False
+                if self.protocol.is_region_indestructable(
+                        x - 1, y - 1, z - 1, x + 2, y + 2, z + 2):
+                    return False
 
     def on_block_removed(self, x: int, y: int, z: int) -> None:
         if self.protocol.user_blocks is not None:
-            self.protocol.user_blocks.discard((x, y, z))
+            self.protocol.user_blocks.discard_point(x, y, z)
         if self.protocol.god_blocks is not None:
-            self.protocol.god_blocks.discard((x, y, z))
+            self.protocol.god_blocks.discard_point(x, y, z)
 
     def on_hit(self, hit_amount: float, player: 'FeatureConnection',
                _type: int, grenade: Grenade) -> HookValue:
@@ -0,0 +1,153 @@
+"""
+Attributes the time spent in event hooks to the scripts that override them.
+
+Scripts are applied by subclassing the protocol and connection classes, so an
+event like ``on_position_update`` walks down a chain of overrides, one per
+script. While the profiler runs, every ``on_*`` method in that chain is
+replaced with a timing wrapper, and the self time of each override is summed
+per call stack. Stopping the profiler puts the original methods back, so it
+costs nothing while it is off.
+
+The results can be written in the folded stack format used by flamegraph.pl
+and speedscope, one line per stack::
+
+    on_world_update;squad:SquadProtocol.on_world_update;... 1234
+
+where the count is the self time in microseconds.
+"""
+
+import functools
+import inspect
+import time
+
+SCRIPT_NAMESPACE = 'piqueserver._script_namespace.'
+GAME_MODE_NAMESPACE = 'piqueserver._gamemode_namespace.'
+
+
+def get_label(cls, name):
+    """return a readable label for the method name of cls, e.g.
+    ``afk:AfkConnection.on_position_update``"""
+    module = cls.__module__
+    for namespace in (SCRIPT_NAMESPACE, GAME_MODE_NAMESPACE):
+        if module.startswith(namespace):
+            module = module[len(namespace):]
+            break
+    # scripts define their classes inside apply_script
+    qualname = cls.__qualname__.rpartition('<locals>.')[2]
+    return '{}:{}.{}'.format(module, qualname, name)
+
+
+class HookProfiler:
+    """
+    Instruments the ``on_*`` methods of a set of classes and everything they
+    inherit from.
+    """
+
+    def __init__(self, classes, clock=time.perf_counter):
+        self.classes = classes
+        self.clock = clock
+        self.running = False
+        self.started = None
+        self.duration = 0.0
+        # (event, label, ...) -> [calls, self time]
+        self.stacks = {}
+        self._stack = []
+        self._originals = []
+
+    def start(self):
+        """start profiling, discarding the previous results"""
+        if self.running:
+            return
+        self.stacks = {}
+        self._stack = []
+        self.duration = 0.0
+        seen = set()
+        for base in self.classes:
+            for cls in base.__mro__:
+                if cls is object or cls in seen:
+                    continue
+                seen.add(cls)
+                for name, value in list(vars(cls).items()):
+                    if (not name.startswith('on_') or
+                            not inspect.isfunction(value) or
+                            inspect.iscoroutinefunction(value)):
+                        continue
+                    self._originals.append((cls, name, value))
+                    setattr(cls, name,
+                            self._wrap(value, name, get_label(cls, name)))
+        self.started = self.clock()
+        self.running = True
+
+    def stop(self):
+        """stop profiling and restore the original methods"""
+        if not self.running:
+            return
+        for cls, name, value in reversed(self._originals):
+            setattr(cls, name, value)
+        self._originals = []
+        self.duration = self.clock() - self.started
+        self.running = False
+
+    def _wrap(self, func, event, label):
+        clock = self.clock
+        stack = self._stack
+        stacks = self.stacks
+
+        @functools.wraps(func)
+        def wrapper(*arg, **kw):
+            if stack:
+                path = stack[-1][0] + (label,)
+            else:
+                path = (event, label)
+            frame = [path, 0.0]
+            stack.append(frame)
+            start = clock()
+            try:
+                return func(*arg, **kw)
+            finally:
+                taken = clock() - start
+                stack.pop()
+                if stack:
+                    stack[-1][1] += taken
+                entry = stacks.get(path)
+                if entry is None:
+                    stacks[path] = [1, taken - frame[1]]
+                else:
+                    entry[0] += 1
+                    entry[1] += taken - frame[1]
+        return wrapper
+
+    def get_elapsed(self):
+        """return how long the profiler ran, or has been running"""
+        if self.running:
+            return self.clock() - self.started
+        return self.duration
+
+    def get_top(self, count=5):
+        """return the (label, calls, self time) of the overrides with the most
+        self time, summed over every stack they appear in"""
+        totals = {}
+        for path, (calls, taken) in self.stacks.items():
+            entry = totals.setdefault(path[-1], [0, 0.0])
+            entry[0] += calls
+            entry[1] += taken
+        top = sorted(totals.items(), key=lambda item: item[1][1],
+                     reverse=True)
+        return [(label, calls, taken)
+                for label, (calls, taken) in top[:count]]
+
+    def get_folded(self):
+        """return the results as lines in the folded stack format, with the
+        self time in microseconds"""
+        lines = []
+        for path, (_, taken) in sorted(self.stacks.items()):
+            micros = int(round(taken * 1e6))
+            if micros > 0:
+                lines.append('{} {}'.format(';'.join(path), micros))
+        return lines
+
+    def dump(self, filename):
+        """write the results to filename in the folded stack format"""
+        with open(filename, 'w') as fp:
+            for line in self.get_folded():
+                fp.write(line + '\n')
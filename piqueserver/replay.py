@@ -0,0 +1,239 @@
+"""
+usage: python -m piqueserver.replay [-h] [-c CONFIG_FILE]
+                                    [-j JSON_PARAMETERS] [-d CONFIG_DIR]
+                                    [--realtime] [--seed SEED]
+                                    capture
+
+Replays a capture into a headless server and reports how long the phases of
+its ticks took.
+
+Captures are recorded by servers with ``enabled = true`` in the
+``[capture]`` section of the config. The replay runs the config, scripts and
+game mode it is given, so use the ones the capture was recorded with. The
+server gets no sockets: its enet host is a `pyspades.capture.ReplayHost`, and
+the status server, IRC, SSH, ban publishing and subscriptions, the master
+server and the capture are turned off. Bans are read, but written to a
+temporary copy.
+
+Time only moves as the capture says, so timers, world steps and maps run as
+they did when recorded. Randomness is seeded, which makes replays of a
+capture run the same, but not necessarily the same as the recorded server
+did, e.g. when it comes to spawn locations.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# the replay runs on the default reactor, which is never started: the replay
+# fires the timers itself
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.logger import (FilteringLogObserver, LogLevel,
+                            LogLevelFilterPredicate, Logger, globalLogBeginner,
+                            textFileLogObserver)
+
+from piqueserver import server
+from piqueserver.config import config
+from piqueserver.map import Map, RotationInfo
+from piqueserver.run import load_config
+from pyspades.capture import (CaptureReader, CaptureReplay, ReplayClock,
+                              ReplayHost)
+from pyspades.types import TickStats
+
+log = Logger()
+
+
+def make_replay_protocol(protocol_class):
+    """return protocol_class changed to run without a network, on the time of
+    a replay, with the maps loaded when the capture says"""
+    class ReplayProtocol(protocol_class):
+        def __init__(self, *arg, **kw):
+            # (RotationInfo, Deferred) of the maps waiting for the capture to
+            # load them
+            self.pending_maps = []
+            protocol_class.__init__(self, *arg, **kw)
+
+        def create_host(self, address):
+            return ReplayHost(address)
+
+        def get_time(self):
+            return reactor.seconds()
+
+        async def update(self):
+            # the replay runs the ticks
+            pass
+
+        def make_map(self, rot_info):
+            d = Deferred(self._cancel_map)
+            self.pending_maps.append((rot_info, d))
+            return d
+
+        def _cancel_map(self, d):
+            self.pending_maps = [(rot_info, pending)
+                                 for rot_info, pending in self.pending_maps
+                                 if pending is not d]
+
+        def load_replay_map(self, name):
+            """load the map the capture changes to, in place of the one of the
+            same name the server is waiting for"""
+            rot_info = RotationInfo(name)
+            for index, (wanted, d) in enumerate(self.pending_maps):
+                if wanted.name == rot_info.name:
+                    del self.pending_maps[index]
+                    break
+            else:
+                log.warn("capture changes to map '{name}', which the replay "
+                         "did not load", name=name)
+                return
+            d.callback(Map(rot_info, os.path.join(config.config_dir, 'maps'),
+                           self.generated_map_cache))
+
+    return ReplayProtocol
+
+
+class ReplayExecutor(ThreadPoolExecutor):
+    """
+    The default executor of the event loop in a replay. The replay waits for
+    its jobs before every tick, so work handed to threads, like compressing
+    the map for downloads, is done by the next tick however fast the replay
+    runs.
+    """
+
+    def __init__(self):
+        ThreadPoolExecutor.__init__(self)
+        self.pending = set()
+
+    def submit(self, *arg, **kw):
+        future = ThreadPoolExecutor.submit(self, *arg, **kw)
+        self.pending.add(future)
+        return future
+
+    def wait(self):
+        wait(self.pending)
+        self.pending.clear()
+
+
+class MapReplay(CaptureReplay):
+    def __init__(self, protocol, reader, clock, realtime, executor):
+        CaptureReplay.__init__(self, protocol, reader, clock, realtime)
+        self.executor = executor
+
+    def on_map(self, name):
+        self.protocol.load_replay_map(name)
+
+    def run_tick(self, tick_time):
+        self.executor.wait()
+        CaptureReplay.run_tick(self, tick_time)
+
+
+def print_report(replay):
+    protocol = replay.protocol
+    host = protocol.host
+    stats = protocol.tick_stats
+    wall_time = replay.wall_time
+    print('replayed {} ticks ({:.1f} s of capture) in {:.2f} s, {:.1f}x real '
+          'time'.format(replay.ticks, replay.duration, wall_time,
+                        replay.duration / wall_time if wall_time else 0.0))
+    print('events: {} connects, {} disconnects, {} packets ({:.1f} KiB), {} '
+          'dropped'.format(replay.connects, replay.disconnects,
+                           replay.packets, host.totalReceivedData / 1024,
+                           host.dropped_packets))
+    print('sent: {} packets ({:.1f} KiB)'.format(
+        host.totalSentPackets, host.totalSentData / 1024))
+    print('world: {} steps, {} dropped, {} ticks over budget'.format(
+        stats.steps, stats.dropped_steps, stats.overruns))
+    timings = dict(stats.timings)
+    timings['timers'] = replay.timer_timings
+    print('{:<14}{:>10}{:>10}{:>10}{:>10}'.format(
+        'phase', 'p50 ms', 'p99 ms', 'max ms', 'total s'))
+    for name in ('timers',) + stats.phases:
+        window = timings[name]
+        phase = window.get_stats()
+        print('{:<14}{:>10.3f}{:>10.3f}{:>10.3f}{:>10.3f}'.format(
+            name, phase['p50'], phase['p99'], phase['max'], window.total()))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='piqueserver.replay',
+        description='Replays a capture into a headless server and reports '
+        'the timings of its ticks')
+    parser.add_argument('capture', help='the capture file to replay')
+    parser.add_argument('-c', '--config-file', default=None,
+                        help='specify the config file - default is '
+                        '"config.toml" in the config dir')
+    parser.add_argument('-j', '--json-parameters',
+                        help='add extra settings in json format')
+    parser.add_argument('-d', '--config-dir', default=config.config_dir,
+                        help='specify the directory which contains maps, '
+                        'scripts, etc - default is %s' % config.config_dir)
+    parser.add_argument('--realtime', action='store_true',
+                        help='replay at the speed of the capture instead of '
+                        'as fast as possible')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args()
+
+    config.config_dir = args.config_dir
+    status = load_config(args.config_file, args.json_parameters)
+    if status is not None:
+        return status
+
+    bans_dir = tempfile.mkdtemp(prefix='piqueserver-replay-')
+    bans_file = os.path.join(bans_dir, 'bans.txt')
+    live_bans_file = os.path.join(config.config_dir, server.bans_file.get())
+    for suffix in ('', '.journal'):
+        if os.path.exists(live_bans_file + suffix):
+            shutil.copy(live_bans_file + suffix, bans_file + suffix)
+    config.update_from_dict({
+        'master': False,
+        'ip_getter': '',
+        'release_notifications': False,
+        'ssh': {'enabled': False},
+        'irc': {'enabled': False},
+        'status_server': {'enabled': False},
+        'bans': {'file': bans_file, 'publish': False, 'urls': []},
+        'logging': {'logfile': ''},
+        'capture': {'enabled': False},
+    })
+
+    # the report goes to stdout, and warnings of the server to stderr
+    globalLogBeginner.beginLoggingTo([FilteringLogObserver(
+        textFileLogObserver(sys.stderr),
+        [LogLevelFilterPredicate(LogLevel.warn)])], redirectStandardIO=False)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    executor = ReplayExecutor()
+    loop.set_default_executor(executor)
+    clock = ReplayClock(reactor, reactor.seconds())
+    clock.install()
+    random.seed(args.seed)
+
+    with open(args.capture, 'rb') as fobj:
+        reader = CaptureReader(fobj)
+        print('Replaying capture of {} from {!r}'.format(
+            time.strftime('%c', time.localtime(reader.start_time)),
+            args.capture))
+        protocol_class = make_replay_protocol(server.get_protocol_class())
+        interface = server.network_interface.get().encode('utf-8')
+        protocol = protocol_class(interface, config.get_dict())
+        loop.run_until_complete(protocol.update_loop)
+        # the whole capture is kept, instead of a rolling window
+        protocol.tick_stats = TickStats(size=None)
+        replay = MapReplay(protocol, reader, clock, args.realtime, executor)
+        replay.run()
+    executor.shutdown()
+    print_report(replay)
+    shutil.rmtree(bans_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
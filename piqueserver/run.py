@@ -122,6 +122,55 @@ def update_geoip(target_dir):
     return 0
 
 
+def load_config(config_file=None, json_parameters=None):
+    """
+    Finds and loads the config into piqueserver.config.config, then applies
+    the overrides in json_parameters. Returns an error code if the config
+    could not be loaded.
+    """
+    from piqueserver.config import config, TOML_FORMAT, JSON_FORMAT
+
+    # find and load the config
+    # search order:
+    # - --config-file (must have toml or json file extension)
+    # - --config-dir/config.toml
+    # - --config-dir/config.json
+    # - ~/.config/piqueserver/config.toml
+    # - ~/.config/piqueserver/config.json
+    format_ = None
+    if config_file is None:
+        for format__, ext in ((TOML_FORMAT, 'toml'), (JSON_FORMAT, 'json')):
+            config_file = os.path.join(config.config_dir,
+                                       'config.{}'.format(ext))
+            format_ = format__
+            if os.path.exists(config_file):
+                break
+    else:
+        ext = os.path.splitext(config_file)[1]
+        if ext == '.json':
+            format_ = JSON_FORMAT
+        elif ext == '.toml':
+            format_ = TOML_FORMAT
+        else:
+            raise ValueError(
+                'Unsupported config file format! Must have json or toml extension.'
+            )
+
+    config.config_file = config_file
+    print('Loading config from {!r}'.format(config_file))
+    try:
+        with open(config_file) as fobj:
+            config.load_from_file(fobj, format_=format_)
+    except FileNotFoundError as e:
+        print("Could not open Config file")
+        print(e)
+        return e.errno
+
+    # update config with cli overrides
+    if json_parameters:
+        config.update_from_dict(json.loads(json_parameters))
+
+
 def main():
     # We need to install the asyncio reactor before we add any imports like
     # `twisted.internet.*` which install the default reactor.  We keep it here
@@ -137,7 +186,7 @@ def main():
     from twisted.internet import asyncioreactor
     asyncioreactor.install(asyncio.get_event_loop())
 
-    from piqueserver.config import config, TOML_FORMAT, JSON_FORMAT
+    from piqueserver.config import config
 
     description = '%s is an open-source Python server implementation ' \
                   'for the voxel-based game "Ace of Spades".' % PKG_NAME
@@ -213,46 +262,9 @@ def main():
     # the need for the --config-dir argument and the config file is then a
     # single source of configuration
 
-    # find and load the config
-    # search order:
-    # - --config-file (must have toml or json file extension)
-    # - --config-dir/config.toml
-    # - --config-dir/config.json
-    # - ~/.config/piqueserver/config.toml
-    # - ~/.config/piqueserver/config.json
-    format_ = None
-    if args.config_file is None:
-        for format__, ext in ((TOML_FORMAT, 'toml'), (JSON_FORMAT, 'json')):
-            config_file = os.path.join(config.config_dir,
-                                       'config.{}'.format(ext))
-            format_ = format__
-            if os.path.exists(config_file):
-                break
-    else:
-        config_file = args.config_file
-        ext = os.path.splitext(config_file)[1]
-        if ext == '.json':
-            format_ = JSON_FORMAT
-        elif ext == '.toml':
-            format_ = TOML_FORMAT
-        else:
-            raise ValueError(
-                'Unsupported config file format! Must have json or toml extension.'
-            )
-
-    config.config_file = config_file
-    print('Loading config from {!r}'.format(config_file))
-    try:
-        with open(config_file) as fobj:
-            config.load_from_file(fobj, format_=format_)
-    except FileNotFoundError as e:
-        print("Could not open Config file")
-        print(e)
-        return e.errno
-
-    # update config with cli overrides
-    if args.json_parameters:
-        config.update_from_dict(json.loads(args.json_parameters))
+    status = load_config(args.config_file, args.json_parameters)
+    if status is not None:
+        return status
 
     from piqueserver import server
     server.run()
@@ -104,7 +104,6 @@ HEAD_RADIUS = 0.7
 FOG_DISTANCE = 135.0
 
 # Don't touch any of this stuff
-FOG_DISTANCE2 = FOG_DISTANCE**2
 NEAR_MISS_COS = cos(NEAR_MISS_ANGLE * (pi / 180.0))
 HEADSHOT_SNAP_ANGLE_COS = cos(HEADSHOT_SNAP_ANGLE * (pi / 180.0))
 SHOTGUN_HITS_PER_FIRE = 8
@@ -113,11 +112,6 @@ aimbot_pattern = re.compile(".*(aim|bot|ha(ck|x)|cheat).*", re.IGNORECASE)
 aimbot_config = config.section("aimbot")
 collect_data = aimbot_config.option("collect_data", False)
 config_dir = config.config_dir
-def point_distance2(c1, c2):
-    if c1.world_object is not None and c2.world_object is not None:
-        p1 = c1.world_object.position
-        p2 = c2.world_object.position
-        return (p1.x - p2.x)**2 + (p1.y - p2.y)**2 + (p1.z - p2.z)**2
 
 
 def dot3d(v1, v2):
@@ -307,9 +301,12 @@ def apply_script(protocol, connection, config):
 
             if shoot and not self.bullet_loop.running:
                 self.possible_targets = []
-                for enemy in self.team.other.get_players():
-                    if point_distance2(self, enemy) <= FOG_DISTANCE2:
-                        self.possible_targets.append(enemy)
+                if self.world_object is not None:
+                    position = self.world_object.position
+                    for enemy in self.protocol.get_players_in_radius(
+                            position.x, position.y, position.z, FOG_DISTANCE):
+                        if enemy.team is self.team.other:
+                            self.possible_targets.append(enemy)
                 self.bullet_loop_start(self.weapon_object.delay)
             elif not shoot:
                 self.bullet_loop_stop()
@@ -24,6 +24,7 @@ Options
 from twisted.internet.reactor import seconds
 from pyspades.collision import distance_3d_vector
 from pyspades.common import prettify_timespan
+from pyspades.voxelset import VoxelMap
 from piqueserver.commands import command, admin, get_player
 from piqueserver.config import config
 
@@ -120,27 +121,28 @@ def apply_script(protocol, connection, config):
 
         def on_block_build(self, x, y, z):
             if self.protocol.block_info is None:
-                self.protocol.block_info = {}
-            self.protocol.block_info[(x, y, z)] = (self.name, self.team.id)
+                self.protocol.block_info = VoxelMap()
+            self.protocol.block_info.set_point(
+                x, y, z, (self.name, self.team.id))
             connection.on_block_build(self, x, y, z)
 
         def on_line_build(self, points):
             if self.protocol.block_info is None:
-                self.protocol.block_info = {}
-            name_team = (self.name, self.team.id)
-            for point in points:
-                self.protocol.block_info[point] = name_team
+                self.protocol.block_info = VoxelMap()
+            self.protocol.block_info.set_points(
+                points, (self.name, self.team.id))
             connection.on_line_build(self, points)
 
-        def on_block_removed(self, x, y, z):
+        def on_blocks_removed(self, points):
             if self.protocol.block_info is None:
-                self.protocol.block_info = {}
+                self.protocol.block_info = VoxelMap()
             if self.blocks_removed is None:
                 self.blocks_removed = []
-            pos = (x, y, z)
-            info = (seconds(), self.protocol.block_info.pop(pos, None))
-            self.blocks_removed.append(info)
-            connection.on_block_removed(self, x, y, z)
+            now = seconds()
+            pop_point = self.protocol.block_info.pop_point
+            self.blocks_removed.extend(
+                (now, pop_point(x, y, z)) for x, y, z in points)
+            connection.on_blocks_removed(self, points)
 
         def on_kill(self, killer, type, grenade):
             if killer and killer.team is self.team:
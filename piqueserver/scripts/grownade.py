@@ -57,12 +57,9 @@ from glob import glob
 from struct import unpack
 from random import choice
 from itertools import product
-from collections import deque, namedtuple
+from collections import namedtuple
 from twisted.internet.reactor import seconds
 from twisted.internet.task import LoopingCall
-from pyspades.contained import BlockAction, SetColor
-from pyspades.common import make_color
-from pyspades.constants import BUILD_BLOCK
 from piqueserver.commands import command, player_only
 from piqueserver.config import config
 
@@ -195,60 +192,13 @@ class KV6Model:
             self.voxels = voxel_map
 
 
-class BuildQueue:
-    interval = 0.02
-    blocks_per_cycle = 3
-    blocks = None
-    loop = None
-    call_on_exhaustion = None
-
-    def __init__(self, protocol, call_on_exhaustion=None):
-        self.protocol = protocol
-        self.blocks = deque()
-        self.loop = LoopingCall(self.cycle)
-        self.loop.start(self.interval)
-        self.call_on_exhaustion = call_on_exhaustion
-
-    def cycle(self):
-        if not self.blocks:
-            self.loop.stop()
-            if self.call_on_exhaustion:
-                self.call_on_exhaustion()
-            return
-        blocks_left = self.blocks_per_cycle
-        last_color = None
-        while self.blocks and blocks_left:
-            x, y, z, color = self.blocks.popleft()
-            if color != last_color:
-                set_color = SetColor()
-                set_color.value = make_color(*color)
-                set_color.player_id = 32
-                self.protocol.broadcast_contained(set_color, save=True)
-                last_color = color
-            if not self.protocol.map.get_solid(x, y, z):
-                block_action = BlockAction()
-                block_action.value = BUILD_BLOCK
-                block_action.player_id = 32
-                block_action.x = x
-                block_action.y = y
-                block_action.z = z
-                self.protocol.broadcast_contained(block_action, save=True)
-                self.protocol.map.set_point(x, y, z, color)
-                blocks_left -= 1
-        self.protocol.update_entities()
-
-    def push_block(self, x, y, z, color):
-        if not self.loop.running:
-            self.loop.start(self.interval)
-        self.blocks.append((x, y, z, color))
-
-
 class GrowModel:
     model = None
     x, y, z = None, None, None
     open, closed = None, None
-    build_queue = None
     grow_loop = None
+    # the Deferred of the last blocks queued to be built
+    built = None
 
     def __init__(self, protocol, model, x, y, z):
         self.protocol = protocol
@@ -256,12 +206,12 @@ class GrowModel:
         self.x, self.y, self.z = x, y, z
         self.open = [model.pivot]
         self.closed = set()
-        self.build_queue = BuildQueue(protocol, self.queue_exhausted)
         self.grow_loop = LoopingCall(self.grow_cycle)
         self.grow_loop.start(GROW_INTERVAL)
 
     def grow_cycle(self):
         new_nodes = set()
+        blocks = {}
         for xyz in self.open:
             if xyz not in self.model.voxels or xyz in self.closed:
                 continue
@@ -278,22 +228,29 @@ class GrowModel:
             if x < 0 or y < 0 or z < 0 or x >= 512 or y >= 512 or z >= LOWEST_Z:
                 continue
             voxel = self.model.voxels[xyz]
-            self.build_queue.push_block(x, y, z, (voxel.r, voxel.g, voxel.b))
+            color = (voxel.r, voxel.g, voxel.b)
+            blocks.setdefault(color, []).append((x, y, z))
+        for color, points in blocks.items():
+            self.built = self.protocol.map_edits.build(points, color,
+                                                       tag=self)
         self.open = new_nodes
         if not new_nodes:
             self.grow_loop.stop()
+            if self.built is None:
+                self.release()
+            else:
+                self.built.addCallback(self.finished)
 
-    def queue_exhausted(self):
-        if not self.open:
-            self.release()
+    def finished(self, _):
+        self.release()
 
     def release(self):
-        if self.build_queue.loop.running:
-            self.build_queue.loop.stop()
-        self.build_queue.loop = None
+        if self.grow_loop is None:
+            return
         if self.grow_loop.running:
             self.grow_loop.stop()
         self.grow_loop = None
+        self.protocol.map_edits.clear(tag=self)
         self.protocol.growers.remove(self)
 
 
@@ -30,7 +30,7 @@ def set_color(prt, color, player_id=32):
     c = SetColor()
     c.player_id = player_id
     c.value = color
-    prt.broadcast_contained(c)
+    prt.broadcast_contained(c, save=True)
 
 
 def add_block(
@@ -58,8 +58,8 @@ def add_block(
             block_action.x = x
             block_action.y = y
             block_action.z = z
-            prt.broadcast_contained(block_action)
             prt.map.set_point(x, y, z, get_color_tuple(color))
+            prt.broadcast_contained(block_action, save=True)
 
 
 def remove_block(prt, x, y, z, mirror_x=False, mirror_y=False):
@@ -80,7 +80,7 @@ def remove_block(prt, x, y, z, mirror_x=False, mirror_y=False):
             block_action.y = y
             block_action.z = z
             prt.map.remove_point(x, y, z)
-            prt.broadcast_contained(block_action)
+            prt.broadcast_contained(block_action, save=True)
             return True
     return False
 
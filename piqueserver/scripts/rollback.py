@@ -1,6 +1,7 @@
 """
 Rollback rolls back the map to it's original state by placing and removing
-changed blocks. This takes ages. Use with care.
+changed blocks. The changed blocks are found quickly, but sending them to the
+players takes a while. Use with care.
 
 Commands
 ^^^^^^^^
@@ -26,13 +27,12 @@ Options
 
 import os
 import time
-import operator
+from itertools import groupby
+from operator import itemgetter
 
 from twisted.internet.task import LoopingCall
 from pyspades.vxl import VXLData
-from pyspades.contained import BlockAction, SetColor
-from pyspades.constants import *
-from pyspades.common import coordinates, make_color
+from pyspades.common import coordinates, get_color
 from piqueserver.map import Map, MapNotFound, check_rotation
 from piqueserver.commands import command, admin
 from piqueserver.config import config
@@ -51,6 +51,9 @@ S_ROLLBACK_TIME_TAKEN = 'Time taken: {seconds:.3}s'
 
 NON_SURFACE_COLOR = (69, 43, 30)
 
+# the tag of the map edits queued by rollbacks
+ROLLBACK_TAG = 'rollback'
+
 rollback_config = config.section('rollback')
 ROLLBACK_ON_GAME_END_OPTION = rollback_config.option(
     'rollback_on_game_end', False)
@@ -89,17 +92,17 @@ def apply_script(protocol, connection, config):
 
     class RollbackProtocol(protocol):
         rollback_in_progress = False
-        rollback_max_rows = 10  # per 'cycle', intended to cap cpu usage
-        # per 'cycle' cap for (unique packets * players)
-        rollback_max_packets = 180
-        # per 'cycle', each block op is at least 1
-        rollback_max_unique_packets = 12
+        # batches of edits queued at a time, so a cancelled rollback stops
+        # quickly
+        rollback_max_queued = 4
         rollback_time_between_cycles = 0.06
         rollback_time_between_progress_updates = 10.0
         rollback_start_time = None
         rollback_last_chat = None
         rollback_rows = None
         rollback_total_rows = None
+        # the Deferred of the last queued edits
+        rollback_edits = None
 
         # rollback
 
@@ -129,6 +132,7 @@ def apply_script(protocol, connection, config):
             self.rollback_last_chat = self.rollback_start_time
             self.rollback_rows = 0
             self.rollback_total_rows = end_x - start_x
+            self.rollback_edits = None
             self.cycle_call = LoopingCall(self.rollback_cycle)
             self.cycle_call.start(self.rollback_time_between_cycles)
 
@@ -140,9 +144,11 @@ def apply_script(protocol, connection, config):
 
         def end_rollback(self, result):
             self.rollback_in_progress = False
-            self.cycle_call.stop()
+            if self.cycle_call.running:
+                self.cycle_call.stop()
             self.cycle_call = None
             self.packet_generator = None
+            self.map_edits.clear(tag=ROLLBACK_TAG)
             self.update_entities()
             message = S_ROLLBACK_ENDED.format(result=result)
             self.broadcast_chat(message, irc=True)
@@ -151,103 +157,82 @@ def apply_script(protocol, connection, config):
             if not self.rollback_in_progress:
                 return
             try:
-                sent_unique = sent_total = rows = 0
-                while True:
-                    if rows > self.rollback_max_rows:
-                        break
-                    if sent_unique > self.rollback_max_unique_packets:
-                        break
-                    if sent_total > self.rollback_max_packets:
-                        break
-                    sent = next(self.packet_generator)
-                    sent_unique += sent
-                    sent_total += sent * len(self.connections)
-                    rows += (sent == 0)
-                self.rollback_rows += rows
-                if (time.monotonic() - self.rollback_last_chat >
-                        self.rollback_time_between_progress_updates):
-                    self.rollback_last_chat = time.monotonic()
-                    progress = float(self.rollback_rows) / \
-                        self.rollback_total_rows
-                    if progress < 1.0:
-                        message = S_ROLLBACK_PROGRESS.format(percent=progress)
-                        self.broadcast_chat(message)
-                    else:
-                        self.broadcast_chat(S_ROLLBACK_COLOR_PASS)
-            except (StopIteration):
-                elapsed = time.monotonic() - self.rollback_start_time
-                message = S_ROLLBACK_TIME_TAKEN.format(seconds=elapsed)
-                self.end_rollback(message)
+                # the map edit queue paces the packets, only keep it busy
+                while len(self.map_edits) < self.rollback_max_queued:
+                    self.rollback_rows += next(self.packet_generator)
+            except StopIteration:
+                # wait for the last edits to be sent
+                self.cycle_call.stop()
+                if self.rollback_edits is None:
+                    self.rollback_finished()
+                else:
+                    self.rollback_edits.addCallback(self.rollback_finished)
+                return
+            if (time.monotonic() - self.rollback_last_chat >
+                    self.rollback_time_between_progress_updates):
+                self.rollback_last_chat = time.monotonic()
+                progress = float(self.rollback_rows) / \
+                    self.rollback_total_rows
+                if progress < 1.0:
+                    message = S_ROLLBACK_PROGRESS.format(percent=progress)
+                    self.broadcast_chat(message)
+                else:
+                    self.broadcast_chat(S_ROLLBACK_COLOR_PASS)
+
+        def rollback_finished(self, _=None):
+            if not self.rollback_in_progress:
+                return
+            elapsed = time.monotonic() - self.rollback_start_time
+            message = S_ROLLBACK_TIME_TAKEN.format(seconds=elapsed)
+            self.end_rollback(message)
 
         def create_rollback_generator(self, cur, new, start_x, start_y,
                                       end_x, end_y, ignore_indestructable):
-            surface = {}
-            block_action = BlockAction()
-            block_action.player_id = 31
-            set_color = SetColor()
-            set_color.value = make_color(*NON_SURFACE_COLOR)
-            set_color.player_id = 31
-            self.broadcast_contained(set_color, save=True)
+            """queue the edits that turn cur into new, one row at a time.
+            Yields the number of rows queued"""
+            edits = self.map_edits
+            surface = []
             old = cur.copy()
             check_protected = hasattr(protocol, 'protected')
             for x in range(start_x, end_x):
-                block_action.x = x
-                for y in range(start_y, end_y):
-                    block_action.y = y
+                removals, fills, colors = old.diff(new, x, start_y, x + 1,
+                                                   end_y)
+                destroyed = []
+                for i in range(0, len(removals), 3):
+                    y, z = removals[i + 1], removals[i + 2]
+                    if check_protected and self.is_protected(x, y, 0):
+                        continue
+                    if (not ignore_indestructable and
+                            not new.get_solid(x, y, z) and
+                            self.is_indestructable(x, y, z)):
+                        continue
+                    destroyed.append((x, y, z))
+                built = []
+                for i in range(0, len(fills), 3):
+                    y, z = fills[i + 1], fills[i + 2]
+                    if check_protected and self.is_protected(x, y, 0):
+                        continue
+                    built.append((x, y, z))
+                for i in range(0, len(colors), 4):
+                    y, z, color = colors[i + 1], colors[i + 2], colors[i + 3]
                     if check_protected and self.is_protected(x, y, 0):
                         continue
-                    for z in range(63):
-                        action = None
-                        cur_solid = cur.get_solid(x, y, z)
-                        new_solid = new.get_solid(x, y, z)
-                        if cur_solid and not new_solid:
-                            if (not ignore_indestructable and
-                                    self.is_indestructable(x, y, z)):
-                                continue
-                            else:
-                                action = DESTROY_BLOCK
-                                cur.remove_point(x, y, z)
-                        elif new_solid:
-                            new_is_surface = new.is_surface(x, y, z)
-                            if new_is_surface:
-                                new_color = new.get_color(x, y, z)
-                            if not cur_solid and new_is_surface:
-                                surface[(x, y, z)] = new_color
-                            elif not cur_solid and not new_is_surface:
-                                action = BUILD_BLOCK
-                                cur.set_point(x, y, z, NON_SURFACE_COLOR)
-                            elif cur_solid and new_is_surface:
-                                old_is_surface = old.is_surface(x, y, z)
-                                if old_is_surface:
-                                    old_color = old.get_color(x, y, z)
-                                if not old_is_surface or old_color != new_color:
-                                    surface[(x, y, z)] = new_color
-                                    action = DESTROY_BLOCK
-                                    cur.remove_point(x, y, z)
-                        if action is not None:
-                            block_action.z = z
-                            block_action.value = action
-                            self.broadcast_contained(block_action, save=True)
-                            yield 1
+                    surface.append((color, x, y, z))
+                if destroyed:
+                    self.rollback_edits = edits.destroy(destroyed,
+                                                        tag=ROLLBACK_TAG)
+                if built:
+                    self.rollback_edits = edits.build(
+                        built, NON_SURFACE_COLOR, tag=ROLLBACK_TAG)
+                yield 1
+            # the surface is built last, sorted by color, so every color only
+            # has to be sent once
+            surface.sort()
+            for color, points in groupby(surface, key=itemgetter(0)):
+                self.rollback_edits = edits.build(
+                    [point[1:] for point in points], get_color(color),
+                    tag=ROLLBACK_TAG)
                 yield 0
-            last_color = None
-            block_action.value = BUILD_BLOCK
-            for pos, color in sorted(iter(surface.items()),
-                                     key=operator.itemgetter(1)):
-                x, y, z = pos
-                packets_sent = 0
-                if color != last_color:
-                    set_color.value = make_color(*color)
-                    self.broadcast_contained(set_color, save=True)
-                    packets_sent += 1
-                    last_color = color
-                cur.set_point(x, y, z, color)
-                block_action.x = x
-                block_action.y = y
-                block_action.z = z
-                self.broadcast_contained(block_action, save=True)
-                packets_sent += 1
-                yield packets_sent
 
         def on_map_change(self, map):
             self.rollback_map = map.copy()
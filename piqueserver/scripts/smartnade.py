@@ -7,6 +7,7 @@ Smartnade script
 .. codeauthor:: ?
 """
 
+from pyspades.constants import GRENADE_RANGE
 
 SMARTNADE_DELAY = 0.5
 
@@ -18,9 +19,14 @@ def apply_script(protocol, connection, config):
             for player in list(self.players.values()):
                 for nade in player.smart_nades:
                     if nade.fuse > SMARTNADE_DELAY:
-                        for enemy in player.team.other.get_players():
-                            if nade.get_damage(
-                                    enemy.world_object.position) != 0:
+                        x, y, z = nade.position.get()
+                        for enemy in self.get_players_in_box(
+                                x - GRENADE_RANGE, y - GRENADE_RANGE,
+                                z - GRENADE_RANGE, x + GRENADE_RANGE,
+                                y + GRENADE_RANGE, z + GRENADE_RANGE):
+                            if (enemy.team is player.team.other and
+                                    nade.get_damage(
+                                        enemy.world_object.position) != 0):
                                 nade.fuse = min(nade.fuse, SMARTNADE_DELAY)
             return protocol.on_world_update(self)
 
@@ -169,7 +169,7 @@ class VoteMap:
         else:
             self.protocol.broadcast_chat('Mapvote ended. Next map will be: %s.' %
                                          result, irc=True)
-            self.protocol.planned_map = check_rotation([result])[0]
+            self.protocol.set_planned_map(check_rotation([result])[0])
         self.set_cooldown()
 
     def set_cooldown(self):
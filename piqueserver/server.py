@@ -35,7 +35,7 @@ from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 import aiohttp
 from enet import Address, Packet, Peer
 from twisted.internet import reactor, threads
-from twisted.internet.defer import Deferred, ensureDeferred
+from twisted.internet.defer import Deferred, ensureDeferred, succeed
 from twisted.internet.task import LoopingCall, coiterate, deferLater
 from twisted.internet.tcp import Port
 from twisted.logger import (FilteringLogObserver, Logger, LogLevel,
@@ -48,18 +48,24 @@ import piqueserver.core_commands  # pylint: disable=unused-import
 from piqueserver import commands, extensions
 from piqueserver.config import cast_duration, config
 from piqueserver.console import create_console
-from piqueserver.map import Map, MapNotFound, RotationInfo, check_rotation
-from piqueserver.networkdict import NetworkDict
+from piqueserver.map import (GeneratedMapCache, Map, MapCache, MapNotFound,
+                             RotationInfo, check_rotation)
+from piqueserver.banjournal import BanJournal
+from piqueserver.networkdict import NetworkDict, format_network, get_cidr, parse_network
+from piqueserver.profiler import HookProfiler
 from piqueserver.player import FeatureConnection
 from piqueserver.release import check_for_releases, format_release
 from piqueserver.scheduler import Scheduler
 from piqueserver.utils import as_deferred, EndCall
 from piqueserver.bansubscribe import bans_config_urls
 from pyspades.bytes import NoDataLeft
+from pyspades.capture import CaptureWriter
 from pyspades.constants import CTF_MODE, ERROR_SHUTDOWN, TC_MODE, EXTENSION_CHATTYPE
+from pyspades.interest import GridInterestPolicy
 from pyspades.master import MAX_SERVER_NAME_SIZE
 from pyspades.server import ServerProtocol, Team
 from pyspades.tools import make_server_identifier
+from pyspades.voxelset import VoxelSet
 from pyspades.vxl import VXLData
 
 log = Logger()
@@ -83,6 +89,7 @@ def sleep(secs):
 # declare configuration options
 bans_config = config.section('bans')
 logging_config = config.section('logging')
+capture_config = config.section('capture')
 team1_config = config.section('team1')
 team2_config = config.section('team2')
 
@@ -93,6 +100,9 @@ respawn_time_option = config.option(
 respawn_waves = config.option('respawn_waves', default=False)
 game_mode = config.option('game_mode', default='ctf')
 random_rotation = config.option('random_rotation', default=False)
+prefetch_maps = config.option('prefetch_maps', default=1)
+generated_map_cache_size = config.option('generated_map_cache_size',
+                                         default=200)
 passwords = config.option('passwords', default={})
 logfile = logging_config.option('logfile', default='./logs/log.txt')
 loglevel = logging_config.option('loglevel', default='info')
@@ -140,6 +150,8 @@ default_ban_duration = bans_config.option(
     'default_duration', default="1day", cast=cast_duration)
 speedhack_detect = config.option('speedhack_detect', True)
 rubberband_distance = config.option('rubberband_distance', default=10)
+interest_radius = config.option('interest_radius', default=0)
+max_catch_up_steps = config.option('max_catch_up_steps', default=5)
 user_blocks_only = config.option('user_blocks_only', False)
 logging_profile_option = logging_config.option('profile', False)
 set_god_build = config.option('set_god_build', False)
@@ -181,6 +193,8 @@ master_hosts = config.option("master_hosts", [
     {'host': 'master1.aos.coffee', 'port': 32886},
     {'host': 'master2.aos.coffee', 'port': 32886},
 ])
+capture_enabled = capture_config.option('enabled', default=False)
+capture_directory = capture_config.option('directory', default='captures')
 
 def ensure_dir_exists(filename: str) -> None:
     d = os.path.dirname(filename)
@@ -226,6 +240,9 @@ class FeatureProtocol(ServerProtocol):
     command_antispam = False
 
     planned_map = None
+    # the next map of the rotation, taken from map_rotator ahead of time to
+    # prefetch it
+    next_rotation_map = None
 
     map_info = None
     spawns = None
@@ -274,13 +291,23 @@ class FeatureProtocol(ServerProtocol):
         self.advance_on_win = int(advance_on_win.get())
         self.win_count = itertools.count(1)
         self.bans = NetworkDict()
+        self.map_cache = MapCache(self.make_map, prefetch_maps.get())
+        if generated_map_cache_size.get() > 0:
+            self.generated_map_cache = GeneratedMapCache(
+                os.path.join(config.config_dir, 'cache', 'maps'),
+                generated_map_cache_size.get() * 1024 * 1024)
+        else:
+            self.generated_map_cache = None
+        self.hook_profiler = HookProfiler(
+            [type(self), self.connection_class])
 
         self.available_proto_extensions = [(EXTENSION_CHATTYPE, 1)]
 
         # attempt to load a saved bans list
+        self.ban_journal = BanJournal(
+            os.path.join(config.config_dir, bans_file.get()))
         try:
-            with open(os.path.join(config.config_dir, bans_file.get()), 'r') as f:
-                self.bans.read_list(json.load(f))
+            self.ban_journal.read_bans(self.bans)
             log.debug("loaded {count} bans", count=len(self.bans))
         except FileNotFoundError:
             log.debug("skip loading bans: file unavailable",
@@ -293,6 +320,10 @@ class FeatureProtocol(ServerProtocol):
             log.error('Could not parse bans file ({path}): {exception!r}',
                       path=bans_file.get(),
                       exception=e)
+        records = self.ban_journal.replay(self.bans)
+        if records:
+            log.debug("replayed {records} ban journal records",
+                      records=records)
 
         self.hard_bans = set()  # possible DDoS'ers are added here
         self.player_memory = deque(maxlen=100)
@@ -349,7 +380,7 @@ class FeatureProtocol(ServerProtocol):
         self.speedhack_detect = speedhack_detect.get()
         self.rubberband_distance = rubberband_distance.get()
         if user_blocks_only.get():
-            self.user_blocks = set()
+            self.user_blocks = VoxelSet()
         self.set_god_build = set_god_build.get()
         if ssh_enabled.get():
             from piqueserver.ssh import RemoteConsole
@@ -381,9 +412,15 @@ class FeatureProtocol(ServerProtocol):
         if everyone_is_admin.get():
             self.everyone_is_admin = True
 
+        self.max_catch_up_steps = max_catch_up_steps.get()
+
         self.port = port_option.get()
         ServerProtocol.__init__(self, self.port, interface)
         self.host.intercept = self.receive_callback
+        if capture_enabled.get():
+            self.start_capture()
+        if interest_radius.get():
+            self.interest_policy = GridInterestPolicy(interest_radius.get())
 
         try:
             self.set_map_rotation(self.config['rotation'])
@@ -510,7 +547,11 @@ class FeatureProtocol(ServerProtocol):
         """
         self.set_time_limit(False)
         if self.planned_map is None:
-            self.planned_map = next(self.map_rotator)
+            if self.next_rotation_map is not None:
+                self.planned_map = self.next_rotation_map
+                self.next_rotation_map = None
+            else:
+                self.planned_map = next(self.map_rotator)
         planned_map = self.planned_map
         self.planned_map = None
         self.on_advance(planned_map)
@@ -538,14 +579,50 @@ class FeatureProtocol(ServerProtocol):
         """
         Sets the map by its name.
         """
-        map_info = await self.make_map(rot_info)
+        map_info = await self.map_cache.get(rot_info)
         if self.map_info:
             self.on_map_leave()
         self.map_info = map_info
         self.max_score = self.map_info.cap_limit or self.default_cap_limit
         self.set_map(self.map_info.data)
+        if self.recorder is not None:
+            self.recorder.set_map(self.map_info.get_rotation_name())
         self.set_time_limit(self.map_info.time_limit)
         self.update_format()
+        self.prefetch_next_map()
+
+    def prefetch_next_map(self) -> None:
+        """
+        Starts loading the map that comes after the current one, so it is
+        ready when the round ends.
+        """
+        if self.map_cache.size <= 0:
+            return
+        rot_info = self.planned_map
+        if rot_info is None:
+            if self.next_rotation_map is None:
+                self.next_rotation_map = next(self.map_rotator)
+            rot_info = self.next_rotation_map
+        self.map_cache.prefetch(rot_info)
+
+    def set_planned_map(self, rot_info: RotationInfo) -> None:
+        """
+        Sets the map to be loaded after the current game ends, and starts
+        loading it.
+        """
+        old_map = self.planned_map
+        self.planned_map = rot_info
+        if old_map is not None:
+            self._drop_prefetch(old_map)
+        if self.map_info is not None:
+            self.prefetch_next_map()
+
+    def _drop_prefetch(self, rot_info: RotationInfo) -> None:
+        # the same map may still be planned or next in the rotation
+        for wanted in (self.planned_map, self.next_rotation_map):
+            if wanted is not None and wanted.full_name == rot_info.full_name:
+                return
+        self.map_cache.cancel(rot_info)
 
     def set_server_name(self, name: str) -> None:
         name_option.set(name)
@@ -561,7 +638,8 @@ class FeatureProtocol(ServerProtocol):
         # we must do this in a new thread, since map generation might take so
         # long that clients time out.
         return threads.deferToThread(
-            Map, rot_info, os.path.join(config.config_dir, 'maps'))
+            Map, rot_info, os.path.join(config.config_dir, 'maps'),
+            self.generated_map_cache)
 
     def set_map_rotation(self, maps: List[str]) -> None:
         """
@@ -572,16 +650,22 @@ class FeatureProtocol(ServerProtocol):
         maps = check_rotation(maps, os.path.join(config.config_dir, 'maps'))
         self.maps = maps
         self.map_rotator = self.map_rotator_type(maps)
+        old_map = self.next_rotation_map
+        self.next_rotation_map = None
+        if old_map is not None:
+            self._drop_prefetch(old_map)
+        if self.map_info is not None:
+            self.prefetch_next_map()
 
     def get_map_rotation(self):
         return [map_item.full_name for map_item in self.maps]
 
     def is_indestructable(self, x: int, y: int, z: int) -> bool:
         if self.user_blocks is not None:
-            if (x, y, z) not in self.user_blocks:
+            if not self.user_blocks.contains(x, y, z):
                 return True
         if self.god_blocks is not None:
-            if (x, y, z) in self.god_blocks:  # pylint: disable=unsupported-membership-test
+            if self.god_blocks.contains(x, y, z):
                 return True
         map_is_indestructable = self.map_info.is_indestructable
         if map_is_indestructable is not None:
@@ -589,6 +673,31 @@ class FeatureProtocol(ServerProtocol):
                 return True
         return False
 
+    def is_region_indestructable(self, x1: int, y1: int, z1: int, x2: int,
+                                 y2: int, z2: int) -> bool:
+        """
+        Return whether any block in the box from (x1, y1, z1) to
+        (x2, y2, z2), exclusive, is indestructable, e.g. for grenades
+        """
+        points = itertools.product(range(x1, x2), range(y1, y2),
+                                   range(z1, z2))
+        if (getattr(self.is_indestructable, '__func__', None) is not
+                FeatureProtocol.is_indestructable):
+            # a script overrides the check for single blocks
+            return any(self.is_indestructable(*point) for point in points)
+        if self.user_blocks is not None:
+            volume = (x2 - x1) * (y2 - y1) * (z2 - z1)
+            if self.user_blocks.count_box(x1, y1, z1, x2, y2, z2) != volume:
+                return True
+        if self.god_blocks is not None:
+            if self.god_blocks.count_box(x1, y1, z1, x2, y2, z2):
+                return True
+        map_is_indestructable = self.map_info.is_indestructable
+        if map_is_indestructable is not None:
+            return any(map_is_indestructable(self, *point)
+                       for point in points)
+        return False
+
     def update_format(self) -> None:
         """
         Called when the map (or other variables) have been updated
@@ -634,6 +743,7 @@ class FeatureProtocol(ServerProtocol):
         """
         if not self.connections:
             # exit instantly if nobody is connected anyway
+            await self.stop_capture()
             return
 
         # send shutdown notification
@@ -649,6 +759,34 @@ class FeatureProtocol(ServerProtocol):
 
         # give the connections some time to terminate
         await sleep(0.2)
+        await self.stop_capture()
+
+    def start_capture(self) -> None:
+        """
+        Starts recording the inbound traffic to a new file in the capture
+        directory, which piqueserver.replay can replay.
+        """
+        directory = capture_directory.get()
+        if not os.path.isabs(directory):
+            directory = os.path.join(config.config_dir, directory)
+        filename = os.path.join(
+            directory, time.strftime('%Y%m%d-%H%M%S.capture'))
+        ensure_dir_exists(filename)
+        self.recorder = CaptureWriter(filename, self.world_time)
+        log.info('recording capture to {filename}', filename=filename)
+
+    def stop_capture(self) -> Deferred:
+        """
+        Stops recording the capture.
+
+        Returns:
+            Deferred that fires when the capture has been written
+        """
+        recorder = self.recorder
+        self.recorder = None
+        if recorder is None:
+            return succeed(None)
+        return recorder.close()
 
     def add_ban(self, ip, reason, duration, name=None):
         """
@@ -664,14 +802,33 @@ class FeatureProtocol(ServerProtocol):
             duration = time.time() + duration
         else:
             duration = None
-        self.bans[ip] = (name or '(unknown)', reason, duration)
-        self.save_bans()
+        ip = format_network(*parse_network(ip))
+        value = (name or '(unknown)', reason, duration)
+        self.bans[ip] = value
+        self.ban_journal.add(ip, value)
+        if self.ban_publish is not None:
+            self.ban_publish.add(ip, reason, duration)
+        self._bans_changed()
 
     def remove_ban(self, ip):
         results = self.bans.remove(ip)
         log.info('Removing ban: {ip} {results}',
                  ip=ip, results=results)
-        self.save_bans()
+        for network, _ in results:
+            self._forget_ban(get_cidr(network))
+        self._bans_changed()
+
+    def _forget_ban(self, network):
+        """record that the ban of network was removed from self.bans"""
+        self.ban_journal.remove(network)
+        if self.ban_publish is not None:
+            self.ban_publish.remove(network)
+
+    def _bans_changed(self):
+        """called after bans were added or removed. Compacts the ban journal
+        once it grew long enough."""
+        if self.ban_journal.needs_compaction():
+            self.ban_journal.compact(self.bans)
 
     async def watch_for_releases(self):
         """Starts a loop for `check_for_releases` and updates `self.new_release`."""
@@ -705,6 +862,7 @@ class FeatureProtocol(ServerProtocol):
                 if ban[1][2] < start_time:
                     # expired
                     del self.bans[ban[0]]
+                    self._forget_ban(ban[0])
                 yield
             log.debug("ban vacuum took {time:.2f} seconds, removed {count} bans",
                       count=bans_count - len(self.bans),
@@ -717,20 +875,14 @@ class FeatureProtocol(ServerProtocol):
 
     def undo_last_ban(self):
         result = self.bans.pop()
-        self.save_bans()
+        self._forget_ban(result[0])
+        self._bans_changed()
         return result
 
     def save_bans(self):
-        ban_file = os.path.join(config.config_dir, bans_file.get())
-        ensure_dir_exists(ban_file)
-
-        start_time = reactor.seconds()
-        with open(ban_file, 'w') as f:
-            json.dump(self.bans.make_list(), f, indent=2)
-        log.debug("saving {count} bans took {time:.2f} seconds",
-                  count=len(self.bans),
-                  time=reactor.seconds() - start_time)
-
+        """write the whole ban list to the bans file in the background, which
+        also empties the ban journal"""
+        self.ban_journal.compact(self.bans)
         if self.ban_publish is not None:
             self.ban_publish.update()
 
@@ -908,9 +1060,10 @@ class FeatureProtocol(ServerProtocol):
         return self.advance_call.getTime() - self.advance_call.seconds()
 
 
-def run() -> None:
+def get_protocol_class() -> type:
     """
-    runs the server
+    returns the protocol class with the scripts and the game mode of the config
+    applied
     """
 
     # load and apply regular scripts
@@ -930,7 +1083,14 @@ def run() -> None:
         game_mode_object, config, protocol_class, connection_class)
 
     protocol_class.connection_class = connection_class
+    return protocol_class
+
 
+def run() -> None:
+    """
+    runs the server
+    """
+    protocol_class = get_protocol_class()
     interface = network_interface.get().encode('utf-8')
 
     # instantiate the protocol class once. It will set timers and hooks to keep
@@ -22,6 +22,7 @@ from aiohttp import web
 from multidict import MultiDict
 
 from jinja2 import Environment, PackageLoader
+import hashlib
 import json
 import time
 from PIL import Image
@@ -91,18 +92,113 @@ def current_state(protocol):
         "scores": {
             "currentBlueScore": protocol.blue_team.score,
             "currentGreenScore": protocol.green_team.score,
-            "maxScore": protocol.max_score}
+            "maxScore": protocol.max_score},
+        "interest": protocol.interest_policy.get_stats(),
+        "mapEdits": protocol.map_edits.get_stats(),
+        "joinBuffers": protocol.get_join_buffer_stats(),
+        "tick": protocol.tick_stats.get_stats()
     }
 
     return dictionary
 
 
+def make_png(image):
+    data = BytesIO()
+    image.save(data, 'png')
+    return data.getvalue()
+
+
+def make_etag(data):
+    return '"{}"'.format(hashlib.sha1(data).hexdigest()[:20])
+
+
+def is_not_modified(request, etag):
+    """whether the If-None-Match header of request matches etag"""
+    header = request.headers.get('If-None-Match')
+    if header is None:
+        return False
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or etag in tags or 'W/' + etag in tags
+
+
+class OverviewRenderer:
+    """
+    Renders the map overview from a snapshot of the map in a worker thread.
+
+    The snapshot is a copy of the map, which shares its chunks with the map
+    until they are modified, so comparing it with the previous snapshot tells
+    which chunks were edited in between. Only the tiles of TILE_SIZE x
+    TILE_SIZE columns containing those are drawn and encoded again, and
+    every tile is also available as its own PNG.
+    """
+    TILE_SIZE = 64
+    TILES = 512 // TILE_SIZE
+
+    def __init__(self):
+        self.snapshot = None
+        self.image = Image.new('RGBA', (512, 512))
+        self.png = None
+        self.etag = None
+        # (x, y) -> (png, etag)
+        self.tiles = {}
+        self.updating = None
+
+    def get_dirty_tiles(self, snapshot):
+        if self.snapshot is None:
+            return [(x, y) for y in range(self.TILES) for x in range(self.TILES)]
+        tiles = set()
+        for x, y in snapshot.get_changed_chunks(self.snapshot):
+            tiles.add((x // self.TILE_SIZE, y // self.TILE_SIZE))
+        return sorted(tiles)
+
+    async def update(self, map_):
+        """redraw the overview from map_. If an update is already running,
+        wait for it instead"""
+        if self.updating is None:
+            self.updating = asyncio.ensure_future(self._update(map_))
+        updating = self.updating
+        try:
+            await asyncio.shield(updating)
+        finally:
+            if updating.done() and self.updating is updating:
+                self.updating = None
+
+    async def _update(self, map_):
+        # copies are cheap, and taking them on the loop keeps the chunk
+        # reference counts out of the worker thread
+        snapshot = map_.copy()
+        dirty = self.get_dirty_tiles(snapshot)
+        if dirty or self.png is None:
+            loop = asyncio.get_event_loop()
+            tiles, self.png = await loop.run_in_executor(
+                None, self.render, snapshot, dirty)
+            self.tiles.update(tiles)
+            self.etag = make_etag(self.png)
+        self.snapshot = snapshot
+
+    def render(self, snapshot, dirty):
+        """draw the tiles in dirty into the overview image, and return them
+        encoded along with the whole image. Runs in a worker thread"""
+        size = self.TILE_SIZE
+        tiles = {}
+        for x, y in dirty:
+            x1, y1 = x * size, y * size
+            data = snapshot.get_overview(rgba=True, x1=x1, y1=y1,
+                                         x2=x1 + size, y2=y1 + size)
+            tile = Image.frombytes('RGBA', (size, size), data)
+            self.image.paste(tile, (x1, y1))
+            png = make_png(tile)
+            tiles[(x, y)] = (png, make_etag(png))
+        return tiles, make_png(self.image)
+
+
 class StatusServer:
     def __init__(self, protocol):
         self.protocol = protocol
         self.last_update = None
         self.last_map_name = None
         self.cached_overview = None
+        self.overview_renderer = OverviewRenderer()
         env = Environment(loader=PackageLoader('piqueserver.web'))
         self.status_template = env.get_template('status.html')
 
@@ -114,25 +210,44 @@ class StatusServer:
     def current_map(self):
         return self.protocol.map_info.name
 
-    def update_cached_overview(self):
+    async def update_cached_overview(self):
         """Updates cached overview"""
-        overview = self.protocol.map.get_overview(rgba=True)
-        image = Image.frombytes('RGBA', (512, 512), overview)
-        data = BytesIO()
-        image.save(data, 'png')
-        self.cached_overview = data.getvalue()
+        renderer = self.overview_renderer
+        await renderer.update(self.protocol.map)
+        self.cached_overview = renderer.png
         self.last_update = time.time()
         self.last_map_name = self.protocol.map_info.name
 
+    def needs_update(self):
+        return (self.cached_overview is None or
+                self.last_map_name != self.current_map or
+                time.time() - self.last_update > interval_option.get())
+
+    def image_response(self, request, data, etag):
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if is_not_modified(request, etag):
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=data, content_type='image/png',
+                            headers=headers)
+
     async def overview(self, request):
         # update cache on a set interval or map change or initialization
-        if (self.cached_overview is None or
-                self.last_map_name != self.current_map or
-                time.time() - self.last_update > interval_option.get()):
-            self.update_cached_overview()
+        if self.needs_update():
+            await self.update_cached_overview()
+
+        return self.image_response(request, self.cached_overview,
+                                   self.overview_renderer.etag)
 
-        return web.Response(body=self.cached_overview,
-                            content_type='image/png')
+    async def overview_tile(self, request):
+        x = int(request.match_info['x'])
+        y = int(request.match_info['y'])
+        renderer = self.overview_renderer
+        if not (0 <= x < renderer.TILES and 0 <= y < renderer.TILES):
+            raise web.HTTPNotFound()
+        if self.needs_update():
+            await self.update_cached_overview()
+        data, etag = renderer.tiles[(x, y)]
+        return self.image_response(request, data, etag)
 
     async def index(self, request):
         rendered = self.status_template.render(server=self.protocol)
@@ -144,6 +259,7 @@ class StatusServer:
         app.add_routes([
             web.get('/json', self.json),
             web.get('/overview', self.overview),
+            web.get(r'/overview/{x:\d+}/{y:\d+}', self.overview_tile),
             web.get('/', self.index)
         ])
         return app
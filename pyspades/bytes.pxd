@@ -2,9 +2,11 @@ DEF INT_ERROR = -0xFFFFFFFF >> 1
 DEF LONG_LONG_ERROR = -0xFFFFFFFFFFFFFFFF >> 1
 DEF FLOAT_ERROR = float('nan')
 
-cdef extern from "<sstream>" namespace "std":
-    cdef cppclass stringstream:
-        pass
+cdef extern from "bytes_c.h":
+    cdef struct WriteBuffer:
+        char * data
+        size_t pos
+        size_t size
 
 cdef class ByteReader:
     cdef char * data
@@ -31,7 +33,7 @@ cdef class ByteReader:
     cpdef size_t tell(self)
 
 cdef class ByteWriter:
-    cdef stringstream * stream
+    cdef WriteBuffer buffer
 
     cdef void writeSize(self, char * data, int size)
     cpdef write(self, data)
@@ -45,4 +47,5 @@ cdef class ByteWriter:
     cpdef writeString(self, value, int size = ?)
     cpdef pad(self, int bytecount)
     cpdef rewind(self, int bytecount)
+    cpdef clear(self)
     cpdef size_t tell(self)
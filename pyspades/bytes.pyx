@@ -31,25 +31,23 @@ cdef extern from "bytes_c.cpp":
     double read_float(char * data, int big_endian)
     char * read_string(char * data)
 
-    stringstream * create_stream()
-    void delete_stream(stringstream * stream)
-    void write_byte(stringstream * stream, char value)
-    void write_ubyte(stringstream * stream, unsigned char value)
-    void write_short(stringstream * stream, short value, int big_endian)
-    void write_ushort(stringstream * stream, unsigned short value, int big_endian)
-    void write_int(stringstream * stream, int value, int big_endian)
-    void write_uint(stringstream * stream, unsigned int value, int big_endian)
-    void write_float(stringstream * stream, double value, int big_endian)
-    void write_string(stringstream * stream, char * data, size_t size)
-    void write(stringstream * stream, char * data, size_t size)
-    void rewind_stream(stringstream * stream, int bytecount)
-    object get_stream(stringstream * stream)
-    size_t get_stream_size(stringstream * stream)
-    size_t get_stream_pos(stringstream * stream)
-
-cdef extern from "<sstream>" namespace "std":
-    cdef cppclass stringstream:
-        pass
+    void init_buffer(WriteBuffer * buffer)
+    void free_buffer(WriteBuffer * buffer)
+    void clear_buffer(WriteBuffer * buffer)
+    void write_byte(WriteBuffer * buffer, char value)
+    void write_ubyte(WriteBuffer * buffer, unsigned char value)
+    void write_short(WriteBuffer * buffer, short value, int big_endian)
+    void write_ushort(WriteBuffer * buffer, unsigned short value, int big_endian)
+    void write_int(WriteBuffer * buffer, int value, int big_endian)
+    void write_uint(WriteBuffer * buffer, unsigned int value, int big_endian)
+    void write_float(WriteBuffer * buffer, double value, int big_endian)
+    void write_string(WriteBuffer * buffer, char * data, size_t size)
+    void write(WriteBuffer * buffer, char * data, size_t size)
+    void write_padding(WriteBuffer * buffer, size_t size)
+    void rewind_buffer(WriteBuffer * buffer, int bytecount)
+    object get_buffer(WriteBuffer * buffer)
+
+cimport cython
 
 class NoDataLeft(Exception):
     pass
@@ -237,63 +235,74 @@ cdef class ByteReader:
     def __bytes__(self):
         return self.data[:self.size]
 
+@cython.freelist(16)
 cdef class ByteWriter:
-    def __init__(self):
-        self.stream = create_stream()
+    """Writes various data types to a buffer.
+
+    The data is written to a buffer inside the writer, which only moves to
+    the heap for unusually large output, and finished writers are kept on a
+    freelist. Creating a writer per packet is therefore cheap, and `clear`
+    allows reusing one for several packets.
+    """
+    def __cinit__(self):
+        init_buffer(&self.buffer)
 
     cdef void writeSize(self, char * data, int size):
-        write(self.stream, data, size)
+        write(&self.buffer, data, size)
 
     cpdef write(self, data):
-        write(self.stream, data, len(data))
+        write(&self.buffer, data, len(data))
 
     cpdef writeByte(self, int value, bint unsigned = False):
         if unsigned:
-            write_ubyte(self.stream, value)
+            write_ubyte(&self.buffer, value)
         else:
-            write_byte(self.stream, value)
+            write_byte(&self.buffer, value)
 
     cpdef writeShort(self, int value, bint unsigned = False,
                      bint big_endian = True):
         if unsigned:
-            write_ushort(self.stream, value, big_endian)
+            write_ushort(&self.buffer, value, big_endian)
         else:
-            write_short(self.stream, value, big_endian)
+            write_short(&self.buffer, value, big_endian)
 
     cpdef writeInt(self, long long value, bint unsigned = False,
                    bint big_endian = True):
         if unsigned:
-            write_uint(self.stream, value, big_endian)
+            write_uint(&self.buffer, value, big_endian)
         else:
-            write_int(self.stream, value, big_endian)
+            write_int(&self.buffer, value, big_endian)
 
     cpdef writeFloat(self, float value, bint big_endian = True):
-        write_float(self.stream, value, big_endian)
+        write_float(&self.buffer, value, big_endian)
 
     cpdef writeStringSize(self, char * value, int size):
-        write_string(self.stream, value, size)
+        write_string(&self.buffer, value, size)
 
     cpdef writeString(self, value, int size = -1):
-        write_string(self.stream, value, len(value))
+        write_string(&self.buffer, value, len(value))
         if size != -1:
             self.pad(size - (len(value) + 1))
 
     cpdef pad(self, int bytecount):
-        cdef int i
-        for i in range(bytecount):
-            write_ubyte(self.stream, 0)
+        if bytecount > 0:
+            write_padding(&self.buffer, bytecount)
 
     cpdef rewind(self, int bytecount):
-        rewind_stream(self.stream, bytecount)
+        rewind_buffer(&self.buffer, bytecount)
+
+    cpdef clear(self):
+        """discard all data written so far, keeping the buffer"""
+        clear_buffer(&self.buffer)
 
     cpdef size_t tell(self):
-        return get_stream_pos(self.stream)
+        return self.buffer.pos
 
     def __bytes__(self):
-        return get_stream(self.stream)
+        return get_buffer(&self.buffer)
 
     def __dealloc__(self):
-        delete_stream(self.stream)
+        free_buffer(&self.buffer)
 
     def __len__(self):
-        return get_stream_size(self.stream)
+        return self.buffer.size
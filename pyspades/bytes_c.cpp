@@ -18,21 +18,7 @@
 */
 
 #include "Python.h"
-#include <iostream>
-#include <sstream>
-#include <string>
-using namespace std;
-
-stringstream *create_stream()
-{
-    stringstream *ss = new stringstream(stringstream::out | stringstream::binary);
-    return ss;
-}
-
-void delete_stream(stringstream *ss)
-{
-    delete ss;
-}
+#include "bytes_c.h"
 
 /*
 read methods
@@ -107,108 +93,104 @@ write methods
 
 // byte
 
-inline void write_byte(stringstream *ss, int8_t value)
+inline void write_byte(WriteBuffer *buffer, int8_t value)
 {
-    ss->put(value);
+    *reserve_buffer(buffer, 1) = value;
 }
 
-inline void write_ubyte(stringstream *ss, uint8_t value)
+inline void write_ubyte(WriteBuffer *buffer, uint8_t value)
 {
-    ss->put((char)value);
+    *reserve_buffer(buffer, 1) = (char)value;
 }
 
 // short
 
-inline void write_short(stringstream *ss, int16_t value, int big_endian)
+inline void write_short(WriteBuffer *buffer, int16_t value, int big_endian)
 {
+    char *out = reserve_buffer(buffer, 2);
     if (big_endian)
     {
-        ss->put((char)(value >> 8));
-        ss->put((char)value);
+        out[0] = (char)(value >> 8);
+        out[1] = (char)value;
     }
     else
     {
-        ss->put((char)value);
-        ss->put((char)(value >> 8));
+        out[0] = (char)value;
+        out[1] = (char)(value >> 8);
     }
 }
 
-inline void write_ushort(stringstream *ss, uint16_t value,
+inline void write_ushort(WriteBuffer *buffer, uint16_t value,
                          int big_endian)
 {
-    write_short(ss, (short)value, big_endian);
+    write_short(buffer, (short)value, big_endian);
 }
 
 // int
 
-inline void write_int(stringstream *ss, int32_t value, int big_endian)
+inline void write_int(WriteBuffer *buffer, int32_t value, int big_endian)
 {
+    char *out = reserve_buffer(buffer, 4);
     if (big_endian)
     {
-        ss->put((char)(value >> 24));
-        ss->put((char)(value >> 16));
-        ss->put((char)(value >> 8));
-        ss->put((char)value);
+        out[0] = (char)(value >> 24);
+        out[1] = (char)(value >> 16);
+        out[2] = (char)(value >> 8);
+        out[3] = (char)value;
     }
     else
     {
-        ss->put((char)value);
-        ss->put((char)(value >> 8));
-        ss->put((char)(value >> 16));
-        ss->put((char)(value >> 24));
+        out[0] = (char)value;
+        out[1] = (char)(value >> 8);
+        out[2] = (char)(value >> 16);
+        out[3] = (char)(value >> 24);
     }
 }
 
-inline void write_uint(stringstream *ss, uint32_t value,
+inline void write_uint(WriteBuffer *buffer, uint32_t value,
                        int big_endian)
 {
-    write_int(ss, (int)value, big_endian);
+    write_int(buffer, (int)value, big_endian);
 }
 
 // float
 
-inline void write_float(stringstream *ss, double value, int big_endian)
+inline void write_float(WriteBuffer *buffer, double value, int big_endian)
 {
-    char out[4];
+    char *out = reserve_buffer(buffer, 4);
     #if (PY_MAJOR_VERSION >= 3 && PY_MINOR_VERSION >= 11)
-        PyFloat_Pack4(value, (char *)&out, !big_endian);
+        PyFloat_Pack4(value, out, !big_endian);
     #else
-        _PyFloat_Pack4(value, (unsigned char *)&out, !big_endian);
+        _PyFloat_Pack4(value, (unsigned char *)out, !big_endian);
     #endif
-    ss->write(out, 4);
 }
 
-inline void write_string(stringstream *ss, char *data, size_t size)
+inline void write_string(WriteBuffer *buffer, char *data, size_t size)
 {
-    ss->write(data, size);
-    ss->put(0);
+    char *out = reserve_buffer(buffer, size + 1);
+    memcpy(out, data, size);
+    out[size] = 0;
 }
 
-inline void write(stringstream *ss, char *data, size_t size)
+inline void write(WriteBuffer *buffer, char *data, size_t size)
 {
-    ss->write(data, size);
+    memcpy(reserve_buffer(buffer, size), data, size);
 }
 
-inline void rewind_stream(stringstream *ss, int bytes)
+inline void write_padding(WriteBuffer *buffer, size_t size)
 {
-    ss->seekp(-bytes, stringstream::cur);
+    memset(reserve_buffer(buffer, size), 0, size);
 }
 
-inline size_t get_stream_size(stringstream *ss)
+inline void rewind_buffer(WriteBuffer *buffer, int bytes)
 {
-    return ss->str().length();
-}
-
-inline size_t get_stream_pos(stringstream *ss)
-{
-    streampos pos = ss->tellp();
-    if (pos == (streampos)-1)
-        return 0;
-    return pos;
+    if ((size_t)bytes > buffer->pos)
+        buffer->pos = 0;
+    else
+        buffer->pos -= bytes;
 }
 
-inline PyObject *get_stream(stringstream *ss)
+inline PyObject *get_buffer(WriteBuffer *buffer)
 {
-    const string tmp = ss->str();
-    return PyBytes_FromStringAndSize(tmp.c_str(), tmp.length());
+    return PyBytes_FromStringAndSize(buffer->data, buffer->size);
 }
@@ -0,0 +1,69 @@
+#ifndef BYTES_C_H
+#define BYTES_C_H
+
+#include <stddef.h>
+#include <string.h>
+
+// large enough for every packet the server sends in a tick, including a
+// full WorldUpdate
+#define WRITE_BUFFER_SIZE 1024
+
+// The output buffer of a ByteWriter. Data is written to `fixed` until it
+// runs out, and only then moved to the heap, so encoding a packet normally
+// doesn't allocate. `size` is the amount of data written, which may be past
+// `pos` after a rewind.
+struct WriteBuffer
+{
+    char *data;
+    size_t pos;
+    size_t size;
+    size_t capacity;
+    char fixed[WRITE_BUFFER_SIZE];
+};
+
+inline void init_buffer(WriteBuffer *buffer)
+{
+    buffer->data = buffer->fixed;
+    buffer->pos = 0;
+    buffer->size = 0;
+    buffer->capacity = WRITE_BUFFER_SIZE;
+}
+
+inline void free_buffer(WriteBuffer *buffer)
+{
+    if (buffer->data != buffer->fixed)
+        delete[] buffer->data;
+    init_buffer(buffer);
+}
+
+inline void clear_buffer(WriteBuffer *buffer)
+{
+    buffer->pos = 0;
+    buffer->size = 0;
+}
+
+// makes sure `size` more bytes fit at the current position and returns a
+// pointer to them
+inline char *reserve_buffer(WriteBuffer *buffer, size_t size)
+{
+    size_t end = buffer->pos + size;
+    if (end > buffer->capacity)
+    {
+        size_t capacity = buffer->capacity * 2;
+        if (capacity < end)
+            capacity = end;
+        char *data = new char[capacity];
+        memcpy(data, buffer->data, buffer->size);
+        if (buffer->data != buffer->fixed)
+            delete[] buffer->data;
+        buffer->data = data;
+        buffer->capacity = capacity;
+    }
+    char *out = buffer->data + buffer->pos;
+    buffer->pos = end;
+    if (end > buffer->size)
+        buffer->size = end;
+    return out;
+}
+
+#endif /* BYTES_C_H */
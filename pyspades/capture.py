@@ -0,0 +1,454 @@
+"""
+Captures of the inbound traffic of a server, and replays of them.
+
+With `ServerProtocol.recorder` set to a `CaptureWriter`, the server records
+every enet event it handles (connects, received packets and disconnects),
+the start of every tick and the map changes to a capture file. Records are
+only packed into a list while the server runs. Compressing and writing them
+happens in a thread, a batch at a time.
+
+The file starts with a header, followed by a zlib stream of the records.
+Events don't carry a time of their own: they belong to the tick recorded
+before them, which is when the server handled them. Every batch is flushed
+to the file completely, so a capture cut short by a crash can be read up to
+its last batch.
+
+Captures hold what players send, chat included, so they are as private as
+the server's logs. The arguments of chat commands, which may be passwords as
+in ``/login <password>``, are left out of them.
+
+`CaptureReplay` feeds a capture back into a server whose host is a
+`ReplayHost`, tick by tick. A `ReplayClock` stands in for the time, so the
+server runs the same world steps and timers as when it was recorded, either
+as fast as possible or in real time. See piqueserver.replay for replaying
+into a full piqueserver.
+"""
+
+import struct
+import time
+import zlib
+from collections import deque, namedtuple
+
+import enet
+from twisted.internet import threads
+from twisted.internet.defer import succeed
+from twisted.logger import Logger
+
+from pyspades import contained as loaders
+from pyspades.bytes import ByteReader, NoDataLeft
+from pyspades.types import TimingWindow
+
+log = Logger()
+
+MAGIC = b'PQCAPTURE'
+VERSION = 1
+
+# magic, version, wall-clock time the capture started at
+HEADER = struct.Struct('<9sBd')
+
+TICK = 0
+CONNECT = 1
+RECEIVE = 2
+DISCONNECT = 3
+MAP = 4
+
+# type, seconds since the capture started
+TICK_RECORD = struct.Struct('<Bd')
+# type, peer id, event data (the client version), port, length of the host
+CONNECT_RECORD = struct.Struct('<BIIHB')
+# type, peer id, length of the data
+RECEIVE_RECORD = struct.Struct('<BII')
+# type, peer id
+DISCONNECT_RECORD = struct.Struct('<BI')
+# type, length of the map name
+MAP_RECORD = struct.Struct('<BH')
+
+# value is the data of RECEIVE records, an Address of CONNECT records and the
+# rotation name of MAP records. time is the time of the tick the record
+# belongs to
+Record = namedtuple('Record', 'type time peer value')
+Address = namedtuple('Address', 'host port')
+
+
+class CaptureError(ValueError):
+    pass
+
+
+def scrub_chat_command(data):
+    """return the data of a received packet with the arguments left out if
+    it is a chat command, as they may be passwords"""
+    if data[:1] != bytes((loaders.ChatMessage.id,)):
+        return data
+    try:
+        chat = loaders.ChatMessage(ByteReader(data[1:]))
+    except NoDataLeft:
+        return data
+    if not chat.value.startswith('/'):
+        return data
+    chat.value = chat.value.split(None, 1)[0]
+    return chat.encode()
+
+
+class CaptureWriter:
+    """
+    Records the inbound events of a server to filename. start_time is the
+    `ServerProtocol.get_time` the capture starts at.
+    """
+    # bytes of records collected before they are handed to the writer thread
+    flush_size = 64 * 1024
+
+    def __init__(self, filename, start_time):
+        self.filename = filename
+        self.start_time = start_time
+        self._file = open(filename, 'wb')
+        self._file.write(HEADER.pack(MAGIC, VERSION, time.time()))
+        self._compress = zlib.compressobj()
+        self._records = []
+        self._size = 0
+        # peer -> id of the peers connected since the capture started
+        self._peers = {}
+        self._next_peer_id = 1
+        self._writing = succeed(None)
+        self.bytes_recorded = 0
+        self.bytes_written = HEADER.size
+
+    def tick(self, now):
+        self._records.append(TICK_RECORD.pack(TICK, now - self.start_time))
+        self._size += TICK_RECORD.size
+        if self._size >= self.flush_size:
+            self.flush()
+
+    def connect(self, peer):
+        peer_id = self._next_peer_id
+        self._next_peer_id += 1
+        self._peers[peer] = peer_id
+        address = peer.address
+        host = str(address.host).encode()
+        self._records.append(CONNECT_RECORD.pack(
+            CONNECT, peer_id, peer.eventData, address.port, len(host)) + host)
+        self._size += CONNECT_RECORD.size + len(host)
+
+    def receive(self, peer, data):
+        peer_id = self._peers.get(peer)
+        if peer_id is None:
+            return
+        data = scrub_chat_command(data)
+        self._records.append(RECEIVE_RECORD.pack(RECEIVE, peer_id, len(data)))
+        self._records.append(data)
+        self._size += RECEIVE_RECORD.size + len(data)
+
+    def disconnect(self, peer):
+        peer_id = self._peers.pop(peer, None)
+        if peer_id is None:
+            return
+        self._records.append(DISCONNECT_RECORD.pack(DISCONNECT, peer_id))
+        self._size += DISCONNECT_RECORD.size
+
+    def set_map(self, name):
+        name = name.encode('utf-8')
+        self._records.append(MAP_RECORD.pack(MAP, len(name)) + name)
+        self._size += MAP_RECORD.size + len(name)
+
+    def flush(self):
+        """hand the records collected so far to the writer thread"""
+        if not self._records:
+            return
+        data = b''.join(self._records)
+        self._records = []
+        self._size = 0
+        self.bytes_recorded += len(data)
+        self._queue(self._write, data)
+
+    def close(self):
+        """write the remaining records and close the file. Returns a Deferred
+        that fires once everything is written"""
+        self.flush()
+        self._queue(self._finish)
+        return self._writing
+
+    def _queue(self, function, *args):
+        # writes go to the thread one at a time, in order
+        self._writing.addCallback(
+            lambda _: threads.deferToThread(function, *args))
+        self._writing.addErrback(self._failed)
+
+    def _write(self, data):
+        if self._file is None:
+            return
+        data = (self._compress.compress(data) +
+                self._compress.flush(zlib.Z_SYNC_FLUSH))
+        self._file.write(data)
+        self._file.flush()
+        self.bytes_written += len(data)
+
+    def _finish(self):
+        if self._file is None:
+            return
+        data = self._compress.flush()
+        self._file.write(data)
+        self._file.close()
+        self._file = None
+        self.bytes_written += len(data)
+
+    def _failed(self, failure):
+        log.error('Could not write capture {filename}: {error}',
+                  filename=self.filename, error=failure.getErrorMessage())
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class CaptureReader:
+    """
+    Reads the records of a capture from the binary file object fobj.
+    Iterating yields `Record`s, and stops early at a record cut short.
+    """
+    chunk_size = 64 * 1024
+
+    def __init__(self, fobj):
+        self._file = fobj
+        header = fobj.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise CaptureError('not a capture: file too short')
+        magic, version, self.start_time = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise CaptureError('not a capture')
+        if version != VERSION:
+            raise CaptureError('unsupported capture version {}'.format(
+                version))
+        self._decompress = zlib.decompressobj()
+        self._buffer = b''
+        self._offset = 0
+
+    def _read(self, size):
+        buffer = self._buffer
+        offset = self._offset
+        while len(buffer) - offset < size:
+            chunk = self._file.read(self.chunk_size)
+            if chunk:
+                try:
+                    data = self._decompress.decompress(chunk)
+                except zlib.error:
+                    # the last batch was cut short
+                    data = b''
+            else:
+                data = b''
+            if not chunk and not data:
+                raise EOFError()
+            buffer = buffer[offset:] + data
+            offset = 0
+        self._buffer = buffer
+        self._offset = offset + size
+        return buffer[offset:offset + size]
+
+    def __iter__(self):
+        tick_time = 0.0
+        read = self._read
+        while True:
+            try:
+                record_type = read(1)[0]
+                if record_type == TICK:
+                    _, tick_time = TICK_RECORD.unpack(
+                        b'\0' + read(TICK_RECORD.size - 1))
+                    yield Record(TICK, tick_time, None, None)
+                elif record_type == RECEIVE:
+                    _, peer_id, size = RECEIVE_RECORD.unpack(
+                        b'\0' + read(RECEIVE_RECORD.size - 1))
+                    yield Record(RECEIVE, tick_time, peer_id, read(size))
+                elif record_type == CONNECT:
+                    _, peer_id, event_data, port, size = CONNECT_RECORD.unpack(
+                        b'\0' + read(CONNECT_RECORD.size - 1))
+                    address = Address(read(size).decode(), port)
+                    yield Record(CONNECT, tick_time, peer_id,
+                                 (address, event_data))
+                elif record_type == DISCONNECT:
+                    _, peer_id = DISCONNECT_RECORD.unpack(
+                        b'\0' + read(DISCONNECT_RECORD.size - 1))
+                    yield Record(DISCONNECT, tick_time, peer_id, None)
+                elif record_type == MAP:
+                    _, size = MAP_RECORD.unpack(
+                        b'\0' + read(MAP_RECORD.size - 1))
+                    yield Record(MAP, tick_time, None,
+                                 read(size).decode('utf-8'))
+                else:
+                    raise CaptureError('invalid record type {}'.format(
+                        record_type))
+            except EOFError:
+                return
+
+
+ReplayEvent = namedtuple('ReplayEvent', 'type peer packet')
+
+
+class ReplayPeer:
+    """A peer of a `ReplayHost`, with the attributes the server uses"""
+    reliableDataInTransit = 0
+    roundTripTime = 0
+
+    def __init__(self, host, address, event_data):
+        self.host = host
+        self.address = address
+        self.eventData = event_data
+        self.connected = True
+
+    def send(self, channel, packet):
+        host = self.host
+        host.totalSentData += packet.dataLength
+        host.totalSentPackets += 1
+
+    def disconnect(self, data=0):
+        self.connected = False
+
+
+class ReplayHost:
+    """
+    Stands in for the enet host of a server in a replay. It hands out the
+    events queued with `queue` and counts what the server sends.
+    """
+    intercept = None
+    socket = None
+
+    def __init__(self, address=None):
+        self.address = address
+        self.events = deque()
+        self.totalReceivedData = 0
+        self.totalReceivedPackets = 0
+        self.totalSentData = 0
+        self.totalSentPackets = 0
+        # packets of peers the server disconnected, which enet would drop
+        self.dropped_packets = 0
+
+    def compress_with_range_coder(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def queue(self, event_type, peer, data=None):
+        packet = None
+        if data is not None:
+            packet = enet.Packet(data)
+        self.events.append(ReplayEvent(event_type, peer, packet))
+
+    def service(self, timeout):
+        events = self.events
+        while events:
+            event = events.popleft()
+            if event.type == enet.EVENT_TYPE_RECEIVE:
+                if not event.peer.connected:
+                    self.dropped_packets += 1
+                    continue
+                self.totalReceivedData += event.packet.dataLength
+                self.totalReceivedPackets += 1
+            return event
+        return None
+
+
+class ReplayClock:
+    """
+    The time of a replay: start plus the time of the capture replayed so
+    far. `install` makes the reactor use it for timers.
+    """
+
+    def __init__(self, reactor, start=0.0):
+        self.reactor = reactor
+        self.start = start
+        self.time = 0.0
+
+    def seconds(self):
+        return self.start + self.time
+
+    def install(self):
+        self.reactor.seconds = self.seconds
+
+    def advance_to(self, time):
+        """move the clock to time seconds into the capture, and run the timers
+        that are due by then"""
+        self.time = time
+        self.reactor.runUntilCurrent()
+
+
+class CaptureReplay:
+    """
+    Replays the records of reader into protocol, whose host must be a
+    `ReplayHost` and whose `get_time` must follow clock.
+
+    Every recorded tick advances the clock to its time, running the timers
+    that are due, and then runs `protocol.run_tick` with the events recorded
+    during that tick queued in the host. With realtime, ticks wait until their
+    time has passed, otherwise they run back to back.
+    """
+
+    def __init__(self, protocol, reader, clock, realtime=False):
+        self.protocol = protocol
+        self.reader = reader
+        self.clock = clock
+        self.realtime = realtime
+        # capture peer id -> ReplayPeer
+        self.peers = {}
+        self.ticks = 0
+        self.connects = 0
+        self.disconnects = 0
+        self.packets = 0
+        self.maps = 0
+        # the time of the last tick replayed, in the capture
+        self.duration = 0.0
+        self.wall_time = 0.0
+        self.timer_timings = TimingWindow(None)
+
+    def on_map(self, name):
+        """called when the capture changes to the map with the rotation name
+        name. The server of the capture had loaded it at this point"""
+        pass
+
+    def run(self):
+        host = self.protocol.host
+        peers = self.peers
+        tick_time = None
+        start = time.perf_counter()
+        self._wall_start = start
+        for record in self.reader:
+            record_type = record.type
+            if record_type == RECEIVE:
+                peer = peers.get(record.peer)
+                if peer is not None:
+                    host.queue(enet.EVENT_TYPE_RECEIVE, peer, record.value)
+                    self.packets += 1
+            elif record_type == TICK:
+                # the previous tick is complete once the next one starts
+                if tick_time is not None:
+                    self.run_tick(tick_time)
+                tick_time = record.time
+            elif record_type == CONNECT:
+                address, event_data = record.value
+                peer = ReplayPeer(host, address, event_data)
+                peers[record.peer] = peer
+                host.queue(enet.EVENT_TYPE_CONNECT, peer)
+                self.connects += 1
+            elif record_type == DISCONNECT:
+                peer = peers.pop(record.peer, None)
+                if peer is not None:
+                    host.queue(enet.EVENT_TYPE_DISCONNECT, peer)
+                    self.disconnects += 1
+            elif record_type == MAP:
+                # maps are loaded between ticks
+                if tick_time is not None:
+                    self.run_tick(tick_time)
+                    tick_time = None
+                self.maps += 1
+                self.on_map(record.value)
+        if tick_time is not None:
+            self.run_tick(tick_time)
+        self.wall_time = time.perf_counter() - start
+
+    def run_tick(self, tick_time):
+        if self.realtime:
+            delay = self._wall_start + tick_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        timers_start = time.perf_counter()
+        self.clock.advance_to(tick_time)
+        self.timer_timings.add(time.perf_counter() - timers_start)
+        self.protocol.run_tick()
+        self.ticks += 1
+        self.duration = tick_time
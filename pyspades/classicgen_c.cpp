@@ -289,15 +289,12 @@ void genland(unsigned int seed, MapData *map)
         for (x = 0; x < VSID; x++, k++)
         {
             height = buf[k].a;
-            for (z = 63; z > height; z--)
-            {
-                map->geometry[get_pos(x, y, z)] = true;
-            }
-            map->geometry[get_pos(x, y, z)] = true;
+            z = height;
+            set_column_solid(x, y, z, 63, map, true);
             lowest_z = get_lowest_height(x, y) + 1;
             for (; z < lowest_z; z++)
             {
-                map->colors[get_pos(x, y, z)] = ((int *)&buf[k])[0];
+                set_column_color(x, y, z, z, map, ((int *)&buf[k])[0]);
             }
         }
     }
@@ -0,0 +1,325 @@
+"""
+A headless client for the 0.75 protocol, e.g. to load test a server with
+simulated players.
+
+`ClientProtocol` runs `BaseProtocol` in client mode and can connect any
+number of `ClientConnection`s to a server. A connection answers the
+handshake, downloads the map and joins a team. What it does once it spawned
+is up to subclasses, see `ClientConnection.update`.
+"""
+
+import asyncio
+import io
+import time
+import zlib
+
+from pyspades import contained as loaders
+from pyspades.bytes import ByteReader, NoDataLeft
+from pyspades.common import make_color
+from pyspades.constants import (BUILD_BLOCK, DESTROY_BLOCK, GAME_VERSION,
+                                RIFLE_WEAPON, SPADE_TOOL)
+from pyspades.packet import load_server_packet
+from pyspades.protocol import BaseConnection, BaseProtocol
+from pyspades.vxl import VXLData
+
+_handlers = {}
+
+
+def handles(loader):
+    """register the decorated method as the handler of loader packets sent
+    by the server"""
+    def register(function):
+        _handlers[loader.id] = function
+        return function
+    return register
+
+
+class ClientConnection(BaseConnection):
+    """
+    A connection to a server. The attributes below the class docstring are
+    what the client joins with.
+    """
+    name = 'Deuce'
+    team = 0
+    weapon = RIFLE_WEAPON
+    # the client identifier, version and OS sent in the VersionResponse
+    client = 'p'
+    client_version = (0, 1, 0)
+    os_info = 'pyspades client'
+    # keep the downloaded map in `map`. Costs a copy of the map per client
+    load_map = False
+
+    player_id = None
+    map = None
+    joined = False
+    alive = False
+    # our position, as sent by the server
+    position = None
+    hp = 100
+    tool = SPADE_TOOL
+    # time.monotonic() of the connection, of MapStart and of StateData
+    connect_time = None
+    map_start_time = None
+    join_time = None
+
+    def __init__(self, protocol, peer):
+        BaseConnection.__init__(self, protocol, peer)
+        self.map_chunks = []
+        self.map_bytes = 0
+        # player id -> name of the other players
+        self.players = {}
+        # player id -> position of the players the last WorldUpdate had
+        self.positions = {}
+        self.last_world_update = None
+        # the longest time between two WorldUpdates, roughly the worst lag
+        # of the server loop
+        self.max_world_update_interval = 0.0
+        self.packets_received = 0
+        self.bad_packets = 0
+
+    def get_map_time(self):
+        """return the seconds between MapStart and StateData, or None if the
+        map wasn't downloaded yet"""
+        if self.map_start_time is None or self.join_time is None:
+            return None
+        return self.join_time - self.map_start_time
+
+    # sending
+
+    def join(self):
+        existing_player = loaders.ExistingPlayer()
+        existing_player.player_id = self.player_id
+        existing_player.team = self.team
+        existing_player.weapon = self.weapon
+        existing_player.tool = self.tool
+        existing_player.kills = 0
+        existing_player.color = make_color(0, 0, 0)
+        existing_player.name = self.name
+        self.send_contained(existing_player)
+
+    def send_position(self, x, y, z):
+        position_data = loaders.PositionData()
+        position_data.x, position_data.y, position_data.z = x, y, z
+        self.send_contained(position_data)
+
+    def send_orientation(self, x, y, z):
+        orientation_data = loaders.OrientationData()
+        orientation_data.x, orientation_data.y, orientation_data.z = x, y, z
+        self.send_contained(orientation_data)
+
+    def send_input(self, up=False, down=False, left=False, right=False,
+                   jump=False, crouch=False, sneak=False, sprint=False):
+        input_data = loaders.InputData()
+        input_data.player_id = self.player_id
+        input_data.up, input_data.down = up, down
+        input_data.left, input_data.right = left, right
+        input_data.jump, input_data.crouch = jump, crouch
+        input_data.sneak, input_data.sprint = sneak, sprint
+        self.send_contained(input_data)
+
+    def send_weapon_input(self, primary=False, secondary=False):
+        weapon_input = loaders.WeaponInput()
+        weapon_input.player_id = self.player_id
+        weapon_input.primary = primary
+        weapon_input.secondary = secondary
+        self.send_contained(weapon_input)
+
+    def set_tool(self, tool):
+        if tool == self.tool:
+            return
+        self.tool = tool
+        set_tool = loaders.SetTool()
+        set_tool.player_id = self.player_id
+        set_tool.value = tool
+        self.send_contained(set_tool)
+
+    def set_color(self, color):
+        set_color = loaders.SetColor()
+        set_color.player_id = self.player_id
+        set_color.value = make_color(*color)
+        self.send_contained(set_color)
+
+    def send_block_action(self, x, y, z, value=BUILD_BLOCK):
+        block_action = loaders.BlockAction()
+        block_action.player_id = self.player_id
+        block_action.x, block_action.y, block_action.z = x, y, z
+        block_action.value = value
+        self.send_contained(block_action)
+
+    def destroy_block(self, x, y, z):
+        self.send_block_action(x, y, z, DESTROY_BLOCK)
+
+    def throw_grenade(self, velocity, fuse=3.0):
+        grenade_packet = loaders.GrenadePacket()
+        grenade_packet.player_id = self.player_id
+        grenade_packet.value = fuse
+        grenade_packet.position = self.position
+        grenade_packet.velocity = tuple(velocity)
+        self.send_contained(grenade_packet)
+
+    def send_chat(self, value):
+        chat_message = loaders.ChatMessage()
+        chat_message.player_id = self.player_id
+        chat_message.chat_type = 0
+        chat_message.value = value
+        self.send_contained(chat_message)
+
+    # receiving
+
+    def loader_received(self, packet):
+        self.packets_received += 1
+        try:
+            contained = load_server_packet(ByteReader(packet.data))
+        except (KeyError, NoDataLeft):
+            self.bad_packets += 1
+            return
+        handler = _handlers.get(contained.id)
+        if handler is not None:
+            handler(self, contained)
+
+    @handles(loaders.HandShakeInit)
+    def on_handshake_init(self, contained):
+        handshake_return = loaders.HandShakeReturn()
+        handshake_return.success = 1
+        self.send_contained(handshake_return)
+
+    @handles(loaders.VersionRequest)
+    def on_version_request(self, contained):
+        version_response = loaders.VersionResponse()
+        version_response.client = self.client
+        version_response.version = self.client_version
+        version_response.os_info = self.os_info
+        self.send_contained(version_response)
+
+    @handles(loaders.MapStart)
+    def on_map_start(self, contained):
+        self.map_start_time = time.monotonic()
+        self.map_chunks = []
+        self.map_bytes = 0
+
+    @handles(loaders.MapChunk)
+    def on_map_chunk(self, contained):
+        self.map_bytes += len(contained.data)
+        if self.load_map:
+            self.map_chunks.append(contained.data)
+
+    @handles(loaders.StateData)
+    def on_state_data(self, contained):
+        self.join_time = time.monotonic()
+        self.player_id = contained.player_id
+        if self.load_map:
+            data = zlib.decompress(b''.join(self.map_chunks))
+            self.map = VXLData(io.BytesIO(data))
+        self.map_chunks = []
+        self.on_map_loaded()
+        self.join()
+
+    @handles(loaders.ExistingPlayer)
+    def on_existing_player(self, contained):
+        self.players[contained.player_id] = contained.name
+
+    @handles(loaders.CreatePlayer)
+    def on_create_player(self, contained):
+        if contained.player_id != self.player_id:
+            self.players[contained.player_id] = contained.name
+            return
+        self.position = (contained.x, contained.y, contained.z)
+        self.alive = True
+        self.hp = 100
+        if not self.joined:
+            self.joined = True
+            self.on_join()
+        self.on_spawn()
+
+    @handles(loaders.PlayerLeft)
+    def on_player_left(self, contained):
+        self.players.pop(contained.player_id, None)
+        self.positions.pop(contained.player_id, None)
+
+    @handles(loaders.KillAction)
+    def on_kill_action(self, contained):
+        if contained.player_id == self.player_id:
+            self.alive = False
+            self.on_death()
+
+    @handles(loaders.SetHP)
+    def on_set_hp(self, contained):
+        self.hp = contained.hp
+
+    @handles(loaders.WorldUpdate)
+    def on_world_update(self, contained):
+        now = time.monotonic()
+        if self.last_world_update is not None:
+            self.max_world_update_interval = max(
+                self.max_world_update_interval, now - self.last_world_update)
+        self.last_world_update = now
+        positions = self.positions
+        for player_id, (position, _) in enumerate(contained.items):
+            if player_id == self.player_id:
+                self.position = position
+            elif player_id in self.players:
+                positions[player_id] = position
+
+    # events
+
+    def on_connect(self):
+        self.connect_time = time.monotonic()
+
+    def on_map_loaded(self):
+        pass
+
+    def on_join(self):
+        pass
+
+    def on_spawn(self):
+        pass
+
+    def on_death(self):
+        pass
+
+    def update(self, dt):
+        """called on every update of the protocol while connected, with the
+        seconds since the last one"""
+        pass
+
+
+class ClientProtocol(BaseProtocol):
+    """
+    A client host that can connect to any number of servers
+    """
+    is_client = True
+
+    def __init__(self, max_connections=None, update_interval=1 / 60.0):
+        if max_connections is not None:
+            self.max_connections = max_connections
+        self.update_interval = update_interval
+        BaseProtocol.__init__(self, port=None, interface=None)
+
+    def connect(self, connection_class, host, port, version=GAME_VERSION,
+                channel_count=1, timeout=5.0):
+        return BaseProtocol.connect(self, connection_class, host, port,
+                                    version, channel_count, timeout)
+
+    async def update(self):
+        last_time = time.monotonic()
+        while self.host is not None:
+            BaseProtocol.update(self)
+            now = time.monotonic()
+            dt = now - last_time
+            last_time = now
+            for connection in list(self.clients.values()):
+                if connection.connect_time is not None:
+                    connection.update(dt)
+            await asyncio.sleep(self.update_interval)
+
+    def get_stats(self):
+        """return the traffic of the host, in bytes and packets"""
+        host = self.host
+        if host is None:
+            return {}
+        return {
+            'bytes_received': host.totalReceivedData,
+            'bytes_sent': host.totalSentData,
+            'packets_received': host.totalReceivedPackets,
+            'packets_sent': host.totalSentPackets,
+        }
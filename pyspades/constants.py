@@ -49,6 +49,8 @@ BUILD_TOLERANCE = 5
 FOG_DISTANCE = 128.0
 
 MELEE_DISTANCE = 3
+# grenades damage players less than this many blocks away on every axis
+GRENADE_RANGE = 16
 
 MAX_CHAT_SIZE = 90  # more like 95, but just to make sure
 
@@ -24,8 +24,10 @@ This module contains the definitions and registrations for the various packets u
 # This is due to these packets all being cdef. This means you can not assign to
 # them, and hence not use decorators on them.
 #
-# Other things that should probably be done here is using cython.freelist(n) to
-# speed up allocation for packets
+# cython.freelist(n) can't be used to speed up allocation for packets, as
+# Cython only supports freelists on base types. Packets sent many times per
+# tick are reused instead, see e.g. the module level loaders in
+# pyspades/player.py
 
 from pyspades.common import encode, decode
 from pyspades.constants import NEUTRAL_TEAM, CTF_MODE, TC_MODE
@@ -121,11 +123,18 @@ cdef class WorldUpdate(Loader):
 
     cdef public:
         list items
+        # if set, write() takes the first `count` player slots straight from
+        # this World instead of using items
+        object world
+        int count
 
     cpdef read(self, ByteReader reader):
         cdef list items = []
         self.items = items
+        # the server only sends the slots up to the highest player id
         for _ in range(32):
+            if reader.dataLeft() < 24:
+                break
             p_x = reader.readFloat(False)
             p_y = reader.readFloat(False)
             p_z = reader.readFloat(False)
@@ -136,6 +145,9 @@ cdef class WorldUpdate(Loader):
 
     cpdef write(self, ByteWriter writer):
         writer.writeByte(self.id, True)
+        if self.world is not None:
+            self.world.write_world_update(writer, self.count)
+            return
         cdef tuple item
         for item in self.items:
             (p_x, p_y, p_z), (o_x, o_y, o_z) = item
@@ -923,6 +935,8 @@ cdef class HandShakeReturn(Loader):
 
     cpdef write(self, ByteWriter writer):
         writer.writeByte(self.id, True)
+        # echo the challenge of HandShakeInit
+        writer.writeInt(42 if self.success else 0, True)
 
 register_packet(HandShakeReturn)
 
@@ -957,6 +971,10 @@ cdef class VersionResponse(Loader):
 
     cpdef write(self, ByteWriter writer):
         writer.writeByte(self.id, True)
+        writer.writeByte(ord(self.client), True)
+        for part in self.version:
+            writer.writeByte(part, True)
+        writer.writeString(encode(self.os_info))
 
 register_packet(VersionResponse)
 
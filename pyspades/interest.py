@@ -0,0 +1,155 @@
+"""
+Interest management decides which players receive the broadcasts of events
+that happen at a position in the world, e.g. a player's key presses or
+weapon fire. Players far away from an event can't see it through the fog,
+so sending it to them only costs bandwidth.
+
+The policy in use is `ServerProtocol.interest_policy`. Only broadcasts that
+pass an `origin` are filtered, and packets that modify the map or are saved
+for joining players are always sent to everyone.
+"""
+
+import enet
+
+from pyspades import contained as loaders
+
+# packets that describe the current state of a player rather than a one-off
+# event, so they are worth sending again once a player comes into range
+STATE_PACKETS = (loaders.InputData.id, loaders.WeaponInput.id)
+
+
+class InterestPolicy:
+    """
+    The default policy, which sends every event to every player. Subclasses
+    override `update` and `get_excluded`.
+    """
+
+    def __init__(self):
+        self.packets_sent = 0
+        self.bytes_sent = 0
+        self.packets_saved = 0
+        self.bytes_saved = 0
+
+    def update(self, protocol):
+        """called on every network update, before the world update is sent"""
+        pass
+
+    def get_excluded(self, origin):
+        """return the players that don't need to receive an event at origin,
+        or None if everyone does"""
+        return None
+
+    def remember(self, sender, data):
+        """called with the encoded data of every filtered broadcast"""
+        pass
+
+    def get_stats(self):
+        return {
+            'packets_sent': self.packets_sent,
+            'bytes_sent': self.bytes_sent,
+            'packets_saved': self.packets_saved,
+            'bytes_saved': self.bytes_saved,
+        }
+
+
+class GridInterestPolicy(InterestPolicy):
+    """
+    Filters events by the 2D distance between the event and the receiving
+    player, using a grid over the map that is rebuilt from the player
+    positions on every network update.
+
+    Players without a world object (e.g. spectators) receive everything, as
+    their camera position isn't known.
+
+    Skipped packets carry state, like the keys a player holds down. The last
+    packet of each type from each player is remembered and sent again when
+    that player comes into range of a receiver.
+    """
+    cell_size = 32
+
+    def __init__(self, radius=128):
+        super().__init__()
+        self.radius = radius
+        self.cells = {}
+        self.positions = {}
+        # player -> the players in range at the last update
+        self.in_range = {}
+        # player -> {packet id: encoded packet}
+        self.last_packets = {}
+        self.packets_resent = 0
+
+    def update(self, protocol):
+        cells = {}
+        positions = {}
+        cell_size = self.cell_size
+        for player in protocol.players.values():
+            world_object = player.world_object
+            if world_object is None:
+                continue
+            position = world_object.position
+            x, y = position.x, position.y
+            positions[player] = (x, y)
+            key = (int(x) // cell_size, int(y) // cell_size)
+            cells.setdefault(key, []).append(player)
+        self.cells = cells
+        self.positions = positions
+
+        last_packets = self.last_packets
+        for player in list(last_packets):
+            if player not in positions:
+                del last_packets[player]
+
+        old_in_range = self.in_range
+        in_range = {}
+        for player, position in positions.items():
+            excluded = self.get_excluded(position)
+            current = {other for other in positions
+                       if other not in excluded and other is not player}
+            in_range[player] = current
+            for other in current - old_in_range.get(player, set()):
+                self.resend(player, other)
+        self.in_range = in_range
+
+    def resend(self, player, other):
+        """send the remembered packets of other to player"""
+        packets = self.last_packets.get(other)
+        if not packets:
+            return
+        for data in packets.values():
+            player.send_packet(enet.Packet(data, enet.PACKET_FLAG_RELIABLE))
+            self.packets_resent += 1
+
+    def get_excluded(self, origin):
+        ox, oy = origin[0], origin[1]
+        radius = self.radius
+        radius_squared = radius * radius
+        cell_size = self.cell_size
+        excluded = set()
+        for (cell_x, cell_y), players in self.cells.items():
+            # the closest and farthest distance of the cell to the origin,
+            # per axis
+            left = cell_x * cell_size
+            top = cell_y * cell_size
+            near_x = max(left - ox, 0, ox - (left + cell_size))
+            near_y = max(top - oy, 0, oy - (top + cell_size))
+            if near_x * near_x + near_y * near_y > radius_squared:
+                excluded.update(players)
+                continue
+            far_x = max(abs(ox - left), abs(ox - (left + cell_size)))
+            far_y = max(abs(oy - top), abs(oy - (top + cell_size)))
+            if far_x * far_x + far_y * far_y <= radius_squared:
+                continue
+            for player in players:
+                x, y = self.positions[player]
+                if (x - ox) ** 2 + (y - oy) ** 2 > radius_squared:
+                    excluded.add(player)
+        return excluded
+
+    def remember(self, sender, data):
+        if data[0] in STATE_PACKETS and sender in self.positions:
+            self.last_packets.setdefault(sender, {})[data[0]] = data
+
+    def get_stats(self):
+        stats = super().get_stats()
+        stats['packets_resent'] = self.packets_resent
+        return stats
@@ -0,0 +1,194 @@
+"""
+The packets saved for a client while it downloads the map, to be sent once
+the download is done.
+
+On a busy server a download can take long enough for thousands of packets to
+pile up, most of which only matter for the state they leave behind.
+`JoinBuffer` keeps them compact:
+
+* If the buffer knows the snapshot of the map the client downloads, map edits
+  aren't kept at all. Once the download is done, the difference between the
+  snapshot and the current map is sent instead, so a block that was built and
+  destroyed many times costs nothing and a wall built block by block is sent
+  as a few BlockLines.
+* A packet that only sets some state, like the fog color or the block color
+  of a player, replaces the previous packet setting the same state.
+* An IntelCapture that repeats the previous one, without an IntelPickup in
+  between, is dropped.
+
+A buffer that still grows past `JoinBuffer.max_size` bytes is thrown away and
+the download restarted from a fresh snapshot, see
+`ServerConnection.restart_map_transfer`.
+"""
+
+from pyspades import contained as loaders
+from pyspades.common import get_color
+from pyspades.mapedit import encode_edits
+
+# the color of blocks built inside the terrain, which players never see
+FILL_COLOR = (69, 43, 30)
+
+MAP_EDIT_IDS = (loaders.BlockAction.id, loaders.BlockLine.id)
+
+# packets that set some state of the player or object whose id is their
+# first byte
+STATE_IDS = (loaders.SetColor.id, loaders.SetTool.id, loaders.MoveObject.id)
+
+# the state of a player that is meaningless once they left
+PLAYER_STATE_IDS = (loaders.SetColor.id, loaders.SetTool.id)
+
+
+def get_state_key(data):
+    """return a key for the state the encoded packet data sets, or None if
+    it does more than setting state"""
+    packet_id = data[0]
+    if packet_id == loaders.FogColor.id:
+        return (packet_id,)
+    if packet_id in STATE_IDS:
+        return (packet_id, data[1])
+    return None
+
+
+class JoinBufferStats:
+    """
+    Counters shared by the join buffers of a server
+    """
+
+    def __init__(self):
+        self.packets_dropped = 0
+        self.bytes_dropped = 0
+        # packets sent in place of the dropped map edits
+        self.map_packets = 0
+        self.restarts = 0
+
+    def get_stats(self, buffers):
+        """return the stats, including those of buffers, the buffers of the
+        clients downloading the map right now"""
+        buffers = list(buffers)
+        return {
+            'downloading': len(buffers),
+            'packets': sum(len(buffer) for buffer in buffers),
+            'bytes': sum(buffer.size for buffer in buffers),
+            'max_bytes': max((buffer.size for buffer in buffers), default=0),
+            'packets_dropped': self.packets_dropped,
+            'bytes_dropped': self.bytes_dropped,
+            'map_packets': self.map_packets,
+            'restarts': self.restarts,
+        }
+
+
+class JoinBuffer:
+    """
+    The encoded packets saved for a client downloading the map, in the order
+    they were saved
+    """
+    # the size in bytes past which the download is restarted
+    max_size = 1024 * 1024
+
+    def __init__(self, stats=None):
+        if stats is None:
+            stats = JoinBufferStats()
+        self.stats = stats
+        # dropped packets leave a None behind, so the indices in states stay
+        # valid
+        self.packets = []
+        self.count = 0
+        self.size = 0
+        # the map the client downloads, see set_snapshot
+        self.snapshot = None
+        self.has_map_edits = False
+        # state key -> index of the packet that set it last
+        self.states = {}
+        self.capture = None
+
+    def set_snapshot(self, snapshot):
+        """set the snapshot of the map the client downloads. Map edits are
+        dropped from now on, and get_packets brings the snapshot up to date
+        instead. Ignored if map edits were saved already"""
+        if self.has_map_edits:
+            return
+        self.snapshot = snapshot
+
+    def append(self, data):
+        """save the encoded packet data, bytes or a ByteWriter"""
+        data = bytes(data)
+        packet_id = data[0]
+        if packet_id in MAP_EDIT_IDS:
+            if self.snapshot is not None:
+                self._drop(data)
+                return
+            self.has_map_edits = True
+            # the block color of the player has to be sent before the edit
+            self.states.pop((loaders.SetColor.id, data[1]), None)
+        elif packet_id == loaders.IntelCapture.id:
+            if data == self.capture:
+                self._drop(data)
+                return
+            self.capture = data
+        elif packet_id == loaders.IntelPickup.id:
+            self.capture = None
+        elif packet_id == loaders.PlayerLeft.id:
+            for state_id in PLAYER_STATE_IDS:
+                index = self.states.pop((state_id, data[1]), None)
+                if index is not None:
+                    self._remove(index)
+        else:
+            key = get_state_key(data)
+            if key is not None:
+                index = self.states.get(key)
+                if index is not None:
+                    self._remove(index)
+                self.states[key] = len(self.packets)
+        self.packets.append(data)
+        self.count += 1
+        self.size += len(data)
+
+    def extend(self, packets):
+        for data in packets:
+            self.append(data)
+
+    def is_full(self):
+        return self.size > self.max_size
+
+    def get_map_packets(self, map_):
+        """return encoded packets that turn the snapshot into map_"""
+        if self.snapshot is None:
+            return []
+        removals, fills, surface = self.snapshot.diff(map_)
+        destroyed = [tuple(removals[i:i + 3])
+                     for i in range(0, len(removals), 3)]
+        built = {}
+        if fills:
+            built[FILL_COLOR] = [tuple(fills[i:i + 3])
+                                 for i in range(0, len(fills), 3)]
+        for i in range(0, len(surface), 4):
+            built.setdefault(get_color(surface[i + 3]), []).append(
+                tuple(surface[i:i + 3]))
+        packets = encode_edits(destroyed, built)
+        self.stats.map_packets += len(packets)
+        return packets
+
+    def get_packets(self, map_):
+        """return the packets to send once the download is done, where map_
+        is the current map"""
+        return list(self) + self.get_map_packets(map_)
+
+    def __len__(self):
+        """the number of saved packets"""
+        return self.count
+
+    def __iter__(self):
+        for data in self.packets:
+            if data is not None:
+                yield data
+
+    def _drop(self, data):
+        self.stats.packets_dropped += 1
+        self.stats.bytes_dropped += len(data)
+
+    def _remove(self, index):
+        data = self.packets[index]
+        self.packets[index] = None
+        self.count -= 1
+        self.size -= len(data)
+        self._drop(data)
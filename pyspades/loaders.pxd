@@ -20,4 +20,5 @@ from pyspades.bytes cimport ByteWriter, ByteReader
 cdef class Loader:
     cpdef read(self, ByteReader reader)
     cpdef write(self, ByteWriter writer)
-    cpdef ByteWriter generate(self)
\ No newline at end of file
+    cpdef ByteWriter generate(self)
+    cpdef bytes encode(self)
\ No newline at end of file
@@ -15,6 +15,9 @@
 # You should have received a copy of the GNU General Public License
 # along with pyspades.  If not, see <http://www.gnu.org/licenses/>.
 
+# shared by all loaders for encode(), so encoding doesn't create a writer
+cdef ByteWriter shared_writer = ByteWriter()
+
 cdef class Loader:
     def __init__(self, ByteReader reader = None):
         if reader is not None:
@@ -36,3 +39,10 @@ cdef class Loader:
         cdef ByteWriter writer = ByteWriter()
         self.write(writer)
         return writer
+
+    cpdef bytes encode(self):
+        """return the encoded packet as bytes. Unlike generate, this reuses
+        one writer for every packet"""
+        shared_writer.clear()
+        self.write(shared_writer)
+        return shared_writer.buffer.data[:shared_writer.buffer.size]
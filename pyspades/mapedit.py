@@ -0,0 +1,378 @@
+"""
+Map edits made by the server, like rebuilding part of the map or growing a
+model, go through the queue in `ServerProtocol.map_edits` instead of
+broadcasting a BlockAction and a SetColor for every block.
+
+The queue sends a limited number of packets per tick, and briefly holds
+back while a player has too much reliable data waiting to be acknowledged, so
+bulk edits don't flood slow clients. A player that stays behind for longer is
+no longer waited for, so one client can't stall the edits of everyone else.
+Edits that must be in place right away can be sent unpaced.
+
+Edits are applied to the map when they are sent rather than when they are
+queued, so the server never has blocks the players don't know about. Blocks
+that were already built or destroyed by then are skipped.
+
+Builds are sent as BlockLine runs, with a SetColor only when the color
+changes, and columns of three destroyed blocks as one spade destroy.
+"""
+
+from collections import deque
+from itertools import groupby
+
+from twisted.internet.defer import Deferred
+
+from pyspades import contained as loaders
+from pyspades.common import make_color
+from pyspades.constants import BUILD_BLOCK, DESTROY_BLOCK, SPADE_DESTROY
+from pyspades.world import cube_line
+
+# the longest BlockLine the client builds
+MAX_BLOCK_LINE = 65
+
+
+# Algorithm for minimizing the number of blocks sent using a block line.
+# Probably won't find the optimal solution for shapes that are not rectangular
+# prisms but it's better than nothing.
+# d = changing indice
+# c1 = first constant indice
+# c2 = second constant indice
+
+
+def partition(points, d, c1, c2):
+    row = {}
+    row_list = []
+    for point in points:
+        pc1 = point[c1]
+        pc2 = point[c2]
+        if pc1 not in row:
+            row[pc1] = {}
+        dic1 = row[pc1]
+        if pc2 not in dic1:
+            dic1[pc2] = []
+            row_list.append(dic1[pc2])
+        dic2 = dic1[pc2]
+        dic2.append(point)
+
+    row_list_sorted = [sorted(div, key=lambda k: k[d]) for div in row_list]
+
+    # row_list_sorted is a list containing lists of points that all have the
+    # same point[c1] and point[c2] values and are sorted in increasing order
+    # according to point[d]
+    start_block = None
+    final_blocks = []
+    for block_list in row_list_sorted:
+        counter = 0
+        for i, block in enumerate(block_list):
+            counter += 1
+            if start_block is None:
+                start_block = block
+            if i + 1 == len(block_list):
+                next_block = None
+            else:
+                next_block = block_list[i + 1]
+            if (counter == MAX_BLOCK_LINE or next_block is None or
+                    block[d] + 1 != next_block[d]):
+                final_blocks.append([start_block, block])
+                start_block = None
+                counter = 0
+    return final_blocks
+
+
+def minimize_block_line(points):
+    x = partition(points, 0, 1, 2)
+    y = partition(points, 1, 0, 2)
+    z = partition(points, 2, 0, 1)
+    xlen = len(x)
+    ylen = len(y)
+    zlen = len(z)
+    if xlen <= ylen and xlen <= zlen:
+        return x
+    if ylen <= xlen and ylen <= zlen:
+        return y
+    if zlen <= xlen and zlen <= ylen:
+        return z
+    return x
+
+
+def is_valid_point(point):
+    x, y, z = point
+    return 0 <= x < 512 and 0 <= y < 512 and 0 <= z < 64
+
+
+def get_destroy_groups(points):
+    """group points into spade destroys of three blocks on top of each other,
+    and single blocks. Returns a list of (x, y, z, value), where z is the
+    middle block of spade destroys"""
+    groups = []
+    for (x, y), column in groupby(sorted(set(points)),
+                                  key=lambda point: point[:2]):
+        run = []
+        for point in column:
+            z = point[2]
+            if run and run[-1] + 1 != z:
+                groups.extend(get_column_groups(x, y, run))
+                run = []
+            run.append(z)
+        groups.extend(get_column_groups(x, y, run))
+    return groups
+
+
+def get_column_groups(x, y, run):
+    groups = []
+    end = len(run) - len(run) % 3
+    for i in range(0, end, 3):
+        groups.append((x, y, run[i + 1], SPADE_DESTROY))
+    for z in run[end:]:
+        groups.append((x, y, z, DESTROY_BLOCK))
+    return groups
+
+
+class MapEditBatch:
+    def __init__(self, tag):
+        # a generator that sends the edits, yielding the number of packets
+        # sent each time it sent some
+        self.edits = None
+        self.tag = tag
+        # the number of blocks built or destroyed
+        self.changed = 0
+        # fired with `changed` once all edits are sent or dropped
+        self.deferred = Deferred()
+
+
+class MapEditQueue:
+    """
+    The queue of map edits made by the server. Edits are sent in the order
+    they were queued.
+    """
+    # the player id the edits are sent as
+    player_id = 32
+    # the most packets sent per tick
+    packets_per_tick = 20
+    # nothing is sent while a player has more reliable data than this, in
+    # bytes, waiting to be acknowledged
+    max_in_transit = 4096
+    # the most ticks in a row a player holds the queue back. After that, it
+    # gets the edits along with everyone else until it catches up
+    max_paused_ticks = 15
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.batches = deque()
+        # the color of player_id the clients know about, reset every tick in
+        # case something else sent a SetColor for the same player
+        self.color = None
+        self.packets_sent = 0
+        self.blocks_built = 0
+        self.blocks_destroyed = 0
+        self.paused_ticks = 0
+        # the ticks in a row each player that is behind has been waited for
+        self.waiting = {}
+
+    def __len__(self):
+        """the number of queued batches of edits"""
+        return len(self.batches)
+
+    def build(self, points, color, tag=None, paced=True):
+        """queue building the blocks at points, an iterable of (x, y, z),
+        with color. Blocks that are solid when they are sent are skipped.
+        Unless paced, the blocks are built and sent right away instead.
+
+        Returns a Deferred that fires with the number of blocks built once
+        all of them are sent."""
+        points = [tuple(point) for point in points if is_valid_point(point)]
+        batch = MapEditBatch(tag)
+        batch.edits = self._build(batch, minimize_block_line(points),
+                                  tuple(color))
+        return self._add(batch, paced)
+
+    def destroy(self, points, tag=None, paced=True):
+        """queue destroying the blocks at points, an iterable of (x, y, z).
+        Blocks that are open when they are sent are skipped. Unless paced,
+        the blocks are destroyed and sent right away instead.
+
+        Returns a Deferred that fires with the number of blocks destroyed
+        once all of them are sent."""
+        points = [tuple(point) for point in points if is_valid_point(point)]
+        batch = MapEditBatch(tag)
+        batch.edits = self._destroy(batch, get_destroy_groups(points))
+        return self._add(batch, paced)
+
+    def clear(self, tag=None):
+        """drop the queued edits, or only those queued with tag. Their
+        Deferreds fire with the number of blocks changed so far"""
+        kept = deque()
+        dropped = []
+        for batch in self.batches:
+            if tag is None or batch.tag == tag:
+                dropped.append(batch)
+            else:
+                kept.append(batch)
+        self.batches = kept
+        for batch in dropped:
+            batch.edits.close()
+            batch.deferred.callback(batch.changed)
+
+    def is_congested(self):
+        """return True if a player has too much reliable data in transit to
+        send more. Players that have held the queue back for
+        max_paused_ticks are skipped until they catch up"""
+        waiting = {}
+        congested = False
+        for player in self.protocol.connections.values():
+            # players downloading the map get the edits once it is done
+            if player.player_id is None or player.saved_loaders is not None:
+                continue
+            if player.peer.reliableDataInTransit <= self.max_in_transit:
+                continue
+            ticks = self.waiting.get(player, 0)
+            waiting[player] = ticks + 1
+            if ticks < self.max_paused_ticks:
+                congested = True
+        self.waiting = waiting
+        return congested
+
+    def update(self):
+        """send the next edits. Called on every tick of the server loop"""
+        if not self.batches:
+            return
+        if self.is_congested():
+            self.paused_ticks += 1
+            return
+        self.color = None
+        budget = self.packets_per_tick
+        while budget > 0 and self.batches:
+            batch = self.batches[0]
+            try:
+                budget -= next(batch.edits)
+            except StopIteration:
+                self.batches.popleft()
+                batch.deferred.callback(batch.changed)
+        if budget < self.packets_per_tick:
+            # entities may have lost the ground under them
+            self.protocol.update_entities()
+
+    def get_stats(self):
+        return {
+            'queued': len(self.batches),
+            'packets_sent': self.packets_sent,
+            'blocks_built': self.blocks_built,
+            'blocks_destroyed': self.blocks_destroyed,
+            'paused_ticks': self.paused_ticks,
+        }
+
+    def _add(self, batch, paced):
+        if paced:
+            self.batches.append(batch)
+            return batch.deferred
+        # something else may have sent a SetColor since the last tick
+        self.color = None
+        for _ in batch.edits:
+            pass
+        batch.deferred.callback(batch.changed)
+        if batch.changed:
+            self.protocol.update_entities()
+        return batch.deferred
+
+    def _send(self, contained):
+        contained.player_id = self.player_id
+        self.protocol.broadcast_contained(contained, save=True)
+        self.packets_sent += 1
+
+    def _send_color(self, color):
+        if color == self.color:
+            return 0
+        set_color = loaders.SetColor()
+        set_color.value = make_color(*color)
+        self._send(set_color)
+        self.color = color
+        return 1
+
+    def _build(self, batch, lines, color):
+        map_ = self.protocol.map
+        for start, end in lines:
+            # the blocks of the line that are solid by now split it
+            points = cube_line(*(start + end))
+            runs = []
+            run = []
+            for point in points:
+                if map_.get_solid(*point):
+                    if run:
+                        runs.append(run)
+                    run = []
+                else:
+                    run.append(point)
+            if run:
+                runs.append(run)
+            for run in runs:
+                packets = self._send_color(color)
+                for x, y, z in run:
+                    map_.set_point(x, y, z, color)
+                if len(run) == 1:
+                    block_action = loaders.BlockAction()
+                    block_action.value = BUILD_BLOCK
+                    block_action.x, block_action.y, block_action.z = run[0]
+                    self._send(block_action)
+                else:
+                    block_line = loaders.BlockLine()
+                    block_line.x1, block_line.y1, block_line.z1 = run[0]
+                    block_line.x2, block_line.y2, block_line.z2 = run[-1]
+                    self._send(block_line)
+                batch.changed += len(run)
+                self.blocks_built += len(run)
+                yield packets + 1
+
+    def _destroy(self, batch, groups):
+        map_ = self.protocol.map
+        block_action = loaders.BlockAction()
+        for x, y, z, value in groups:
+            if value == SPADE_DESTROY:
+                points = [(x, y, z - 1), (x, y, z), (x, y, z + 1)]
+            else:
+                points = [(x, y, z)]
+            points = [point for point in points if map_.get_solid(*point)]
+            if not points:
+                continue
+            if value == SPADE_DESTROY and len(points) == 3:
+                sends = [(x, y, z, SPADE_DESTROY)]
+            else:
+                sends = [point + (DESTROY_BLOCK,) for point in points]
+            for point in points:
+                map_.remove_point(*point)
+            for (block_action.x, block_action.y, block_action.z,
+                 block_action.value) in sends:
+                self._send(block_action)
+            batch.changed += len(points)
+            self.blocks_destroyed += len(points)
+            yield len(sends)
+
+
+def encode_edits(destroyed, built, player_id=MapEditQueue.player_id):
+    """return encoded packets that destroy the (x, y, z) points of destroyed
+    and then build built, a dict of color -> points, as player_id.
+
+    Unlike the queue, this neither checks nor changes a map, e.g. to bring a
+    client's copy of an older version of the map up to date."""
+    packets = []
+    block_action = loaders.BlockAction()
+    block_action.player_id = player_id
+    for (block_action.x, block_action.y, block_action.z,
+         block_action.value) in get_destroy_groups(destroyed):
+        packets.append(block_action.encode())
+    set_color = loaders.SetColor()
+    set_color.player_id = player_id
+    block_line = loaders.BlockLine()
+    block_line.player_id = player_id
+    block_action.value = BUILD_BLOCK
+    for color, points in built.items():
+        set_color.value = make_color(*color)
+        packets.append(set_color.encode())
+        for start, end in minimize_block_line(points):
+            if start == end:
+                block_action.x, block_action.y, block_action.z = start
+                packets.append(block_action.encode())
+            else:
+                block_line.x1, block_line.y1, block_line.z1 = start
+                block_line.x2, block_line.y2, block_line.z2 = end
+                packets.append(block_line.encode())
+    return packets
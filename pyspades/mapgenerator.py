@@ -2,8 +2,13 @@
 The map generator is responsible for generating the map bytes that get sent
 to the client on connect
 """
+import asyncio
 import zlib
 
+from twisted.logger import Logger
+
+log = Logger()
+
 COMPRESSION_LEVEL = 5
 
 
@@ -26,6 +31,11 @@ class ProgressiveMapGenerator:
     all_data = b''
     pos = 0
 
+    # packets to replay after the download and the map they apply to, see
+    # CompressedMapReader
+    edits = ()
+    snapshot = None
+
     def __init__(self, map_, parent=False):
         # parent=True enables saving all data sent instead of just
         # deleting it afterwards.
@@ -40,6 +50,10 @@ class ProgressiveMapGenerator:
         # over the wire
         return 1.5 * 1024 * 1024  # 2MB
 
+    def ready(self):
+        """return True if the map size is known and reading can start"""
+        return True
+
     def read(self, size):
         """read size bytes from the map generator"""
         data = self.data
@@ -77,6 +91,8 @@ class ProgressiveMapGenerator:
 
 class MapGeneratorChild:
     pos = 0
+    edits = ()
+    snapshot = None
 
     def __init__(self, generator):
         self.parent = generator
@@ -85,6 +101,10 @@ class MapGeneratorChild:
         """get the size of the parent map generator"""
         return self.parent.get_size()
 
+    def ready(self):
+        """return True if the map size is known and reading can start"""
+        return True
+
     def read(self, size):
         """read size bytes from the parent map generator, if possible"""
         pos = self.pos
@@ -97,3 +117,131 @@ class MapGeneratorChild:
     def data_left(self):
         """return True if any data is left"""
         return self.parent.data_left() or self.pos < self.parent.pos
+
+
+class CompressedMap:
+    """
+    A snapshot of a map that is compressed once, in a worker thread, and then
+    shared by every client that downloads it.
+
+    `edits` holds encoded map edit packets broadcast since the snapshot was
+    taken, so they can be replayed to clients that download the snapshot. The
+    first `seed_count` of them only restore the state the edits depend on
+    (e.g. player block colors) and are not worth replaying on their own.
+
+    The snapshot is kept after compressing it, so clients can be sent the
+    difference to the current map instead of every edit, see
+    `pyspades.joinbuffer`.
+    """
+    data = None
+
+    def __init__(self, map_, compression_level=COMPRESSION_LEVEL, seed=()):
+        # copying is cheap, the snapshot shares its storage with the map
+        # until either of them is modified
+        self.snapshot = map_.copy()
+        self.generation = map_.generation
+        self.compression_level = compression_level
+        self.edits = list(seed)
+        self.seed_count = len(self.edits)
+
+    def build(self):
+        """compress the snapshot. This is safe to run in a worker thread"""
+        self.data = zlib.compress(self.snapshot.generate(),
+                                  self.compression_level)
+
+    def ready(self):
+        return self.data is not None
+
+
+class CompressedMapReader:
+    """
+    Reads a `CompressedMap`, with the same interface as
+    `ProgressiveMapGenerator`
+    """
+    pos = 0
+
+    def __init__(self, compressed, extra_edits=()):
+        self.compressed = compressed
+        self.snapshot = compressed.snapshot
+        # only replay the edits made until now, later ones reach the client
+        # through the usual saved loaders
+        edit_count = len(compressed.edits)
+        if edit_count > compressed.seed_count:
+            self.edits = compressed.edits[:edit_count] + list(extra_edits)
+        else:
+            self.edits = []
+
+    def get_size(self):
+        """get the compressed map size. Only valid once ready() is True"""
+        return len(self.compressed.data)
+
+    def ready(self):
+        """return True once the map has been compressed"""
+        return self.compressed.ready()
+
+    def read(self, size):
+        """read size bytes of the compressed map"""
+        pos = self.pos
+        data = self.compressed.data[pos:pos + size]
+        self.pos += len(data)
+        return data
+
+    def data_left(self):
+        """return True if any data is left"""
+        return not self.ready() or self.pos < len(self.compressed.data)
+
+
+class MapTransferCache:
+    """
+    Keeps a compressed snapshot of the current map that map downloads are
+    served from, so a map is compressed once instead of once per client, and
+    outside of the update loop.
+
+    Map edits made after the snapshot was taken are recorded with `record`
+    and replayed to the clients downloading it. Once `max_edits` edits have
+    piled up, `needs_snapshot` asks for a fresh snapshot.
+    """
+    max_edits = 512
+    current = None
+
+    def __init__(self, compression_level=COMPRESSION_LEVEL):
+        self.compression_level = compression_level
+
+    def snapshot(self, map_, seed=()):
+        """take a snapshot of map_ and start compressing it in a worker
+        thread. seed are encoded packets that restore the state recorded
+        edits depend on"""
+        current = CompressedMap(map_, self.compression_level, seed)
+        self.current = current
+        loop = asyncio.get_event_loop()
+        future = loop.run_in_executor(None, current.build)
+        future.add_done_callback(self._on_build_done)
+        return current
+
+    def _on_build_done(self, future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            log.error("Error while compressing map: {error!r}", error=error)
+
+    def record(self, data):
+        """record an encoded map edit packet"""
+        if self.current is not None:
+            self.current.edits.append(data)
+
+    def get_edit_count(self):
+        """return the number of edits recorded since the current snapshot
+        was taken"""
+        current = self.current
+        if current is None:
+            return 0
+        return len(current.edits) - current.seed_count
+
+    def needs_snapshot(self):
+        return self.get_edit_count() >= self.max_edits
+
+    def get_reader(self, extra_edits=()):
+        """return a reader for downloading the current snapshot. extra_edits
+        are appended to the replayed edits, if there are any"""
+        return CompressedMapReader(self.current, extra_edits)
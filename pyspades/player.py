@@ -4,7 +4,6 @@ import random
 import re
 import shlex
 import textwrap
-from itertools import product
 from typing import Dict, Optional, Sequence, Tuple, Union
 
 import enet
@@ -20,12 +19,14 @@ from pyspades.constants import (BLOCK_TOOL, CTF_MODE, ERROR_FULL,
                                 ERROR_TOO_MANY_CONNECTIONS,
                                 ERROR_WRONG_VERSION, FALL_KILL, HEAD,
                                 HEADSHOT_KILL, HIT_TOLERANCE,
-                                FOG_DISTANCE, MAX_BLOCK_DISTANCE, MAX_POSITION_RATE,
+                                FOG_DISTANCE, GRENADE_RANGE, MAX_BLOCK_DISTANCE,
+                                MAX_POSITION_RATE,
                                 MELEE, MELEE_DISTANCE, MELEE_KILL,
                                 RAPID_WINDOW_ENTRIES, SPADE_TOOL,
                                 TC_CAPTURE_DISTANCE, TC_MODE, WEAPON_KILL,
                                 WEAPON_TOOL)
-from pyspades.mapgenerator import ProgressiveMapGenerator
+from pyspades.joinbuffer import JoinBuffer
+from pyspades.mapgenerator import CompressedMapReader
 from pyspades.packet import call_packet_handler, register_packet_handler
 from pyspades.protocol import BaseConnection
 from pyspades.team import Team
@@ -36,6 +37,8 @@ log = Logger()
 
 
 tc_data = loaders.TCState()
+block_action = loaders.BlockAction()
+position_data = loaders.PositionData()
 
 # special characters to replace in chat messages
 MSG_SPECIAL_CHARACTER_MAP = str.maketrans({'\r': ' ', '\n': ' '})
@@ -90,6 +93,7 @@ class ServerConnection(BaseConnection):
     world_object = None  # type: world.Character
     last_block = None
     map_data = None
+    map_start_sent = False
     last_position_update = None
     local = False
 
@@ -301,7 +305,8 @@ class ServerConnection(BaseConnection):
         if self.filter_weapon_input:
             return
         contained.player_id = self.player_id
-        self.protocol.broadcast_contained(contained, sender=self)
+        self.protocol.broadcast_contained(
+            contained, sender=self, origin=self.world_object.position.get())
 
     @register_packet_handler(loaders.InputData)
     def on_input_data_recieved(self, contained: loaders.InputData) -> None:
@@ -354,7 +359,8 @@ class ServerConnection(BaseConnection):
                 contained.sprint)
         if self.filter_visibility_data or self.filter_animation_data:
             return
-        self.protocol.broadcast_contained(contained, sender=self)
+        self.protocol.broadcast_contained(
+            contained, sender=self, origin=world_object.position.get())
 
     @register_packet_handler(loaders.WeaponReload)
     def on_reload_recieved(self, contained) -> None:
@@ -364,7 +370,8 @@ class ServerConnection(BaseConnection):
         if self.filter_animation_data:
             return
         contained.player_id = self.player_id
-        self.protocol.broadcast_contained(contained, sender=self)
+        self.protocol.broadcast_contained(
+            contained, sender=self, origin=self.world_object.position.get())
 
     @register_packet_handler(loaders.HitPacket)
     def on_hit_recieved(self, contained):
@@ -542,15 +549,14 @@ class ServerConnection(BaseConnection):
                 if count:
                     self.total_blocks_removed += count
                     self.blocks = min(50, self.blocks + 1)
-                    self.on_block_removed(x, y, z)
+                    self.on_blocks_removed([(x, y, z)])
             elif value == SPADE_DESTROY:
-                for xyz in ((x, y, z), (x, y, z + 1), (x, y, z - 1)):
-                    count = map_.destroy_point(*xyz)
-                    if count:
-                        self.total_blocks_removed += count
-                        self.on_block_removed(*xyz)
+                count, removed = map_.destroy_points(
+                    ((x, y, z), (x, y, z + 1), (x, y, z - 1)))
+                self.total_blocks_removed += count
+                if removed:
+                    self.on_blocks_removed(removed)
             self.last_block_destroy = reactor.seconds()
-        block_action = loaders.BlockAction()
         block_action.x = x
         block_action.y = y
         block_action.z = z
@@ -835,7 +841,6 @@ class ServerConnection(BaseConnection):
             z -= 0.5
             if self.world_object is not None:
                 self.world_object.set_position(x, y, z)
-        position_data = loaders.PositionData()
         position_data.x = x
         position_data.y = y
         position_data.z = z
@@ -897,6 +902,8 @@ class ServerConnection(BaseConnection):
                 position = Vertex3(x, y, z)
                 self.world_object = self.protocol.world.create_object(
                     world.Character, position, None, self._on_fall)
+                self.protocol.world.set_character(
+                    self.player_id, self.world_object)
             self.world_object.dead = False
             self.tool = WEAPON_TOOL
             self.refill(True)
@@ -1100,14 +1107,15 @@ class ServerConnection(BaseConnection):
 
     def _connection_ack(self) -> None:
         self._send_connection_data()
-        self.send_map(ProgressiveMapGenerator(self.protocol.map))
+        self.send_map(self.protocol.get_map_reader())
         if not self.client_info:
             handshake_init = loaders.HandShakeInit()
             self.send_contained(handshake_init)
 
-    def _send_connection_data(self) -> None:
-        saved_loaders = self.saved_loaders = []
-        if self.player_id is None:
+    def _send_connection_data(self, restart: bool = False) -> None:
+        saved_loaders = self.saved_loaders = JoinBuffer(
+            self.protocol.join_stats)
+        if self.player_id is None or restart:
             for player in self.protocol.players.values():
                 if player.name is None:
                     continue
@@ -1121,6 +1129,7 @@ class ServerConnection(BaseConnection):
                 existing_player.color = make_color(*player.color)
                 saved_loaders.append(existing_player.generate())
 
+        if self.player_id is None:
             self.player_id = self.protocol.player_ids.pop()
             self.protocol.update_master()
 
@@ -1210,9 +1219,14 @@ class ServerConnection(BaseConnection):
         if x < 0 or x > 512 or y < 0 or y > 512 or z < 0 or z > 63:
             return
 
+        # only players within this box can be damaged, see Grenade.get_damage
+        near = self.protocol.get_players_in_box(
+            x - GRENADE_RANGE, y - GRENADE_RANGE, z - GRENADE_RANGE,
+            x + GRENADE_RANGE, y + GRENADE_RANGE, z + GRENADE_RANGE)
         x, y, z = int(math.floor(x)), int(math.floor(y)), int(math.floor(z))
 
-        for player_list in (self.team.other.get_players(), (self,)):
+        enemies = [player for player in near if player.team is self.team.other]
+        for player_list in (enemies, (self,)):
             for player in player_list:
                 # Requirement 4: Skip dead players
                 if not player.hp:
@@ -1242,14 +1256,12 @@ class ServerConnection(BaseConnection):
             return
 
         # Destroy blocks within the explosion radius and track how many were removed
-        map = self.protocol.map
-        for n_x, n_y, n_z in product(range(x - 1, x + 2), range(y - 1, y + 2), range(z - 1, z + 2)):
-            count = map.destroy_point(n_x, n_y, n_z)
-            if count:
-                self.total_blocks_removed += count
-                self.on_block_removed(n_x, n_y, n_z)
+        count, removed = self.protocol.map.destroy_region(
+            x - 1, y - 1, z - 1, x + 2, y + 2, z + 2)
+        self.total_blocks_removed += count
+        if removed:
+            self.on_blocks_removed(removed)
 
-        block_action = loaders.BlockAction()
         block_action.x = x
         block_action.y = y
         block_action.z = z
@@ -1275,19 +1287,30 @@ class ServerConnection(BaseConnection):
         weapon_reload.reserve_ammo = self.weapon_object.current_stock
         self.send_contained(weapon_reload)
 
-    def send_map(self, data: Optional[ProgressiveMapGenerator] = None) -> None:
+    def send_map(self, data: Optional[CompressedMapReader] = None) -> None:
         if data is not None:
             self.map_data = data
-            map_start = loaders.MapStart()
-            map_start.size = data.get_size()
-            self.send_contained(map_start)
+            self.map_start_sent = False
+            # map edits made since the map snapshot was taken
+            self.saved_loaders.set_snapshot(data.snapshot)
+            self.saved_loaders.extend(data.edits)
         elif self.map_data is None:
             return
 
+        if not self.map_data.ready():
+            # the map is still being compressed, continue_map_transfer will
+            # check back later
+            return
+        if not self.map_start_sent:
+            self.map_start_sent = True
+            map_start = loaders.MapStart()
+            map_start.size = self.map_data.get_size()
+            self.send_contained(map_start)
+
         if not self.map_data.data_left():
             log.debug("done sending map data to {player}", player=self)
             self.map_data = None
-            for data in self.saved_loaders:
+            for data in self.saved_loaders.get_packets(self.protocol.map):
                 packet = enet.Packet(bytes(data), enet.PACKET_FLAG_RELIABLE)
                 self.peer.send(0, packet)
             self.saved_loaders = None
@@ -1303,6 +1326,16 @@ class ServerConnection(BaseConnection):
     def continue_map_transfer(self) -> None:
         self.send_map()
 
+    def restart_map_transfer(self) -> None:
+        """start the map download over from a fresh snapshot, because too
+        many packets were saved while downloading the old one"""
+        log.info("restarting map download of {player}, {size} bytes of "
+                 "packets were saved", player=self,
+                 size=self.saved_loaders.size)
+        self.protocol.join_stats.restarts += 1
+        self._send_connection_data(restart=True)
+        self.send_map(self.protocol.get_map_reader(fresh=True))
+
     def send_data(self, data):
         self.protocol.transport.write(data, self.address)
 
@@ -1434,6 +1467,13 @@ class ServerConnection(BaseConnection):
     def on_block_removed(self, x, y, z):
         pass
 
+    def on_blocks_removed(self, points):
+        """called with the list of (x, y, z) points a single action removed.
+        Override this to handle them in bulk, the default calls
+        on_block_removed for every point"""
+        for point in points:
+            self.on_block_removed(*point)
+
     def on_refill(self):
         pass
 
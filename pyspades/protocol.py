@@ -17,11 +17,21 @@
 
 import asyncio
 from twisted.internet import reactor
-from pyspades.bytes import ByteWriter
 
 import enet
 
 
+def make_packet(contained, sequence=False):
+    """encode contained into an enet packet. The packet can be sent to any
+    number of peers, so a loader going to several players only needs to be
+    encoded once"""
+    if sequence:
+        flags = enet.PACKET_FLAG_UNSEQUENCED
+    else:
+        flags = enet.PACKET_FLAG_RELIABLE
+    return enet.Packet(contained.encode(), flags)
+
+
 class BaseConnection:
     disconnected = False
     timeout_call = None
@@ -47,13 +57,12 @@ class BaseConnection:
     def send_contained(self, contained, sequence=False):
         if self.disconnected:
             return
-        if sequence:
-            flags = enet.PACKET_FLAG_UNSEQUENCED
-        else:
-            flags = enet.PACKET_FLAG_RELIABLE
-        data = ByteWriter()
-        contained.write(data)
-        packet = enet.Packet(bytes(data), flags)
+        self.peer.send(0, make_packet(contained, sequence))
+
+    def send_packet(self, packet):
+        """send a packet made with make_packet"""
+        if self.disconnected:
+            return
         self.peer.send(0, packet)
 
     # events
@@ -83,7 +92,7 @@ class BaseProtocol:
         else:
             address = None
         try:
-            self.host = enet.Host(address, self.max_connections, 1)
+            self.host = self.create_host(address)
         except MemoryError:
             # pyenet raises memoryerror when the enet host could not be created
             raise IOError("Failed  to Create Enet Host. Is the Port in use?")
@@ -93,6 +102,10 @@ class BaseProtocol:
         self.connections = {}
         self.clients = {}
 
+    def create_host(self, address):
+        """create the enet host, bound to address if it isn't None"""
+        return enet.Host(address, self.max_connections, 1)
+
     def connect(self, connection_class, host, port, version, channel_count=1,
                 timeout=5.0):
         host = host.encode()
@@ -130,7 +143,7 @@ class BaseProtocol:
 
     def check_client(self):
         if self.is_client and not self.clients:
-            self.update_loop.stop()
+            self.update_loop.cancel()
             self.update_loop = None
             self.host = None  # important for GC
 
@@ -156,6 +169,7 @@ class BaseProtocol:
                         connection.on_connect()
                         connection.timeout_call.cancel()
                     elif event_type == enet.EVENT_TYPE_DISCONNECT:
+                        connection.disconnected = True
                         connection.on_disconnect()
                         del self.clients[peer]
                         self.check_client()
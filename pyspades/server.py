@@ -28,21 +28,29 @@ from pyspades.protocol import BaseProtocol
 from pyspades.constants import (
     CTF_MODE, TC_MODE, GAME_VERSION, MIN_TERRITORY_COUNT, MAX_TERRITORY_COUNT,
     UPDATE_FREQUENCY, UPDATE_FPS, NETWORK_FPS)
-from pyspades.types import IDPool
+from pyspades.types import IDPool, TickStats
 from pyspades.master import MasterPool
 from pyspades.team import Team
 from pyspades.entities import Territory
 # importing tc_data is a quick hack since this file writes into it
 from pyspades.player import ServerConnection, check_nan, tc_data
 from pyspades import world
-from pyspades.bytes import ByteWriter
 from pyspades import contained as loaders
 from pyspades.common import make_color
-from pyspades.mapgenerator import ProgressiveMapGenerator
+from pyspades.interest import InterestPolicy
+from pyspades.joinbuffer import JoinBufferStats
+from pyspades.mapedit import MapEditQueue
+from pyspades.mapgenerator import MapTransferCache
 from twisted.logger import Logger
 
 log = Logger()
 
+# packets that modify the map, or that map modifications depend on. These are
+# replayed to clients downloading an older snapshot of the map.
+MAP_EDIT_LOADERS = (loaders.BlockAction, loaders.BlockLine, loaders.SetColor)
+
+world_update = loaders.WorldUpdate()
+
 class MasterHostDict(TypedDict):
     host: str
     port: int
@@ -58,6 +66,8 @@ class ServerProtocol(BaseProtocol):
     master = False
     max_score = 10
     map = None
+    map_edits = None
+    join_stats = None
     spade_teamkills_on_grief = False
     friendly_fire = False
     friendly_fire_time = 2
@@ -77,6 +87,12 @@ class ServerProtocol(BaseProtocol):
     melee_damage = 100
     version = GAME_VERSION
     respawn_waves = False
+    # the most world steps run in one iteration of the loop to catch up after
+    # a stall. Anything more is dropped, which slows down the game instead of
+    # never catching up. 0 disables the limit.
+    max_catch_up_steps = 5
+    # a pyspades.capture.CaptureWriter that records the inbound enet events
+    recorder = None
     master_hosts: List[MasterHostDict]
 
     def __init__(self, *arg, **kw):
@@ -93,6 +109,10 @@ class ServerProtocol(BaseProtocol):
         self._create_teams()
 
         self.world = world.World()
+        self.map_transfer = MapTransferCache()
+        self.interest_policy = InterestPolicy()
+        self.map_edits = MapEditQueue(self)
+        self.join_stats = JoinBufferStats()
         self.master_pool = MasterPool(protocol=self)
         self.set_master()
 
@@ -108,8 +128,9 @@ class ServerProtocol(BaseProtocol):
                             abs(vec[1] * 1.02) +
                             abs(vec[2] * 1.01))
 
-        self.last_network_update = self.world_time = time.monotonic()
+        self.last_network_update = self.world_time = self.get_time()
         self.loop_count = 0
+        self.tick_stats = TickStats()
 
     def _create_teams(self):
         """create the teams
@@ -145,7 +166,7 @@ class ServerProtocol(BaseProtocol):
         return self.team_spectator
 
     def broadcast_contained(self, contained, unsequenced=False, sender=None,
-                            team=None, save=False, rule=None):
+                            team=None, save=False, rule=None, origin=None):
         """send a Contained `Loader` to all or a selection of connected
         players
 
@@ -160,15 +181,29 @@ class ServerProtocol(BaseProtocol):
             rule: if set to a callable, this function is called with the player
                 as parameter to determine if a given player should receive the
                 packet
+            origin: if set to the position of the event, the interest policy
+                may skip players that are too far away to perceive it. Ignored
+                for saved packets and map edits
         """
         if unsequenced:
             flags = enet.PACKET_FLAG_UNSEQUENCED
         else:
             flags = enet.PACKET_FLAG_RELIABLE
-        writer = ByteWriter()
-        contained.write(writer)
-        data = bytes(writer)
+        data = contained.encode()
         packet = enet.Packet(data, flags)
+        if save and isinstance(contained, MAP_EDIT_LOADERS):
+            self.map_transfer.record(data)
+            if self.map_transfer.needs_snapshot():
+                self.map_transfer.snapshot(
+                    self.map, self._get_block_color_packets())
+        interest_policy = self.interest_policy
+        excluded = None
+        if (origin is not None and not save and
+                not isinstance(contained, MAP_EDIT_LOADERS)):
+            excluded = interest_policy.get_excluded(origin)
+            if sender is not None:
+                interest_policy.remember(sender, data)
+        size = len(data)
         for player in self.connections.values():
             if player is sender or player.player_id is None:
                 continue
@@ -179,7 +214,14 @@ class ServerProtocol(BaseProtocol):
             if player.saved_loaders is not None:
                 if save:
                     player.saved_loaders.append(data)
+                    if player.saved_loaders.is_full():
+                        player.restart_map_transfer()
+            elif excluded and player in excluded:
+                interest_policy.packets_saved += 1
+                interest_policy.bytes_saved += size
             else:
+                interest_policy.packets_sent += 1
+                interest_policy.bytes_sent += size
                 player.peer.send(0, packet)
 
     # backwards compatability
@@ -227,70 +269,119 @@ class ServerProtocol(BaseProtocol):
             entities.append(flag)
         return entities
 
+    def get_time(self):
+        """return the time of the server loop in seconds. Replays of captures
+        override this with the recorded times"""
+        return time.monotonic()
+
     async def update(self):
         while True:
-            start_time = time.monotonic()
+            start_time = self.get_time()
             # Notify if update starts more than 4ms later than requested
             lag = start_time - self.world_time - UPDATE_FREQUENCY
             if lag > 0.004:
                 log.debug(
                     "LAG before world update: {lag:.0f} ms", lag=lag * 1000)
 
-            BaseProtocol.update(self)
-            # Map transfer
-            for player in self.connections.values():
-                if (player.map_data is not None and
-                        not player.peer.reliableDataInTransit):
-                    player.continue_map_transfer()
-            # Update world
-            while (time.monotonic() - self.world_time) > UPDATE_FREQUENCY:
-                self.loop_count += 1
-                self.world.update(UPDATE_FREQUENCY)
-                try:
-                    self.on_world_update()
-                except Exception:
-                    traceback.print_exc()
-                self.world_time += UPDATE_FREQUENCY
-            # Update network
-            if time.monotonic() - self.last_network_update >= 1 / NETWORK_FPS:
-                self.last_network_update = self.world_time
-                self.update_network()
-
-            # Notify if update uses more than 70% of time budget
-            lag = time.monotonic() - start_time
-            if lag > (UPDATE_FREQUENCY * 0.7):
-                log.debug("world update LAG: {lag:.0f} ms", lag=lag * 1000)
-
-            delay = self.world_time + UPDATE_FREQUENCY - time.monotonic()
+            self.run_tick()
+
+            delay = self.world_time + UPDATE_FREQUENCY - self.get_time()
             await asyncio.sleep(delay)
 
+    def run_tick(self):
+        """run one iteration of the server loop and record how long each of
+        its phases takes in `tick_stats`"""
+        stats = self.tick_stats
+        clock = time.perf_counter
+        tick_start = clock()
+        # the loop reads the time once, so a replay with the same times runs
+        # the same world steps
+        now = self.get_time()
+        if self.recorder is not None:
+            self.recorder.tick(now)
+
+        BaseProtocol.update(self)
+        enet_end = clock()
+        stats.record('enet', enet_end - tick_start)
+
+        # Map transfer
+        for player in self.connections.values():
+            if (player.map_data is not None and
+                    not player.peer.reliableDataInTransit):
+                player.continue_map_transfer()
+        map_end = clock()
+        stats.record('map_transfer', map_end - enet_end)
+
+        # Map edits
+        self.map_edits.update()
+        edits_end = clock()
+        stats.record('map_edits', edits_end - map_end)
+
+        # Update world
+        world_time = hook_time = 0.0
+        steps = 0
+        while (now - self.world_time) > UPDATE_FREQUENCY:
+            if self.max_catch_up_steps and steps >= self.max_catch_up_steps:
+                dropped = int((now - self.world_time) / UPDATE_FREQUENCY)
+                stats.dropped_steps += dropped
+                log.warn("world update fell behind, dropping {dropped} steps",
+                         dropped=dropped)
+                self.world_time += dropped * UPDATE_FREQUENCY
+                break
+            steps += 1
+            self.loop_count += 1
+            step_start = clock()
+            self.world.update(UPDATE_FREQUENCY)
+            hook_start = clock()
+            try:
+                self.on_world_update()
+            except Exception:
+                traceback.print_exc()
+            hook_end = clock()
+            world_time += hook_start - step_start
+            hook_time += hook_end - hook_start
+            self.world_time += UPDATE_FREQUENCY
+        if steps:
+            stats.steps += steps
+            stats.record('world', world_time)
+            stats.record('hooks', hook_time)
+
+        # Update network
+        if now - self.last_network_update >= 1 / NETWORK_FPS:
+            self.last_network_update = self.world_time
+            network_start = clock()
+            self.update_network()
+            stats.record('network', clock() - network_start)
+
+        # Notify if update uses more than 70% of time budget
+        taken = clock() - tick_start
+        stats.record('total', taken)
+        stats.ticks += 1
+        if taken > UPDATE_FREQUENCY:
+            stats.overruns += 1
+        if taken > (UPDATE_FREQUENCY * 0.7):
+            log.debug("world update LAG: {lag:.0f} ms", lag=taken * 1000)
+
     def update_network(self):
         if not len(self.players):
             return
-        items = []
-        highest_player_id = max(self.players)
-        for i in range(highest_player_id + 1):
-            position = orientation = None
-            try:
-                player = self.players[i]
-                if (not player.filter_visibility_data and
-                        not player.team.spectator):
-                    world_object = player.world_object
-                    position = world_object.position.get()
-                    orientation = world_object.orientation.get()
-            except (KeyError, TypeError, AttributeError):
-                pass
-            if position is None:
-                position = (0.0, 0.0, 0.0)
-                orientation = (0.0, 0.0, 0.0)
-            items.append((position, orientation))
-        world_update = loaders.WorldUpdate()
-        # we only want to send as many items of the player list as needed, so
-        # we slice it off at the highest player id
-        world_update.items = items[:highest_player_id+1]
+        self.interest_policy.update(self)
+        for player in self.players.values():
+            world_object = player.world_object
+            if world_object is not None:
+                team = player.team
+                world_object.hidden = (player.filter_visibility_data or
+                                       team is None or team.spectator)
+        # the positions are written straight from the world. We only want to
+        # send as many items of the player list as needed, so we stop at the
+        # highest player id
+        world_update.world = self.world
+        world_update.count = max(self.players) + 1
         self.broadcast_contained(world_update, unsequenced=True)
 
     def set_map(self, map_obj):
+        # queued edits were meant for the old map
+        self.map_edits.clear()
         self.map = map_obj
         self.world.map = map_obj
         self.on_map_change(map_obj)
@@ -299,19 +390,49 @@ class ServerProtocol(BaseProtocol):
         if self.game_mode == TC_MODE:
             self.reset_tc()
         self.players = {}
-        if self.connections:
-            data = ProgressiveMapGenerator(self.map, parent=True)
-            for connection in list(self.connections.values()):
-                if connection.player_id is None:
-                    continue
-                if connection.map_data is not None:
-                    connection.disconnect()
-                    continue
-                connection.reset()
-                connection._send_connection_data()
-                connection.send_map(data.get_child())
+        self.map_transfer.snapshot(self.map)
+        for connection in list(self.connections.values()):
+            if connection.player_id is None:
+                continue
+            if connection.map_data is not None:
+                connection.disconnect()
+                continue
+            connection.reset()
+            connection._send_connection_data()
+            connection.send_map(self.get_map_reader())
         self.update_entities()
 
+    def get_map_reader(self, fresh=False):
+        """return a reader for the map download of a joining client
+
+        All clients are served from a shared, compressed snapshot of the map.
+        Map edits made since the snapshot was taken are replayed once the
+        download is complete. If fresh is set, a new snapshot is taken if the
+        map was edited since the current one was taken."""
+        map_transfer = self.map_transfer
+        if (map_transfer.current is None or
+                fresh and map_transfer.get_edit_count()):
+            map_transfer.snapshot(self.map, self._get_block_color_packets())
+        return map_transfer.get_reader(self._get_block_color_packets())
+
+    def get_join_buffer_stats(self):
+        """return the stats of the packets saved for clients downloading the
+        map"""
+        return self.join_stats.get_stats(
+            player.saved_loaders for player in self.connections.values()
+            if player.saved_loaders is not None)
+
+    def _get_block_color_packets(self):
+        """return encoded SetColor packets for the current block color of
+        every player"""
+        packets = []
+        for player in self.players.values():
+            set_color = loaders.SetColor()
+            set_color.player_id = player.player_id
+            set_color.value = make_color(*player.color)
+            packets.append(set_color.generate())
+        return packets
+
     def reset_game(self, player=None, territory=None):
         """reset the score of the game
 
@@ -375,6 +496,23 @@ class ServerProtocol(BaseProtocol):
         z = self.map.get_z(x, y)
         return x, y, z
 
+    def get_players_in_radius(self, x, y, z, radius):
+        """return the players whose character is within radius of
+        (x, y, z), ordered by player id"""
+        return self._get_players(
+            self.world.get_characters_in_radius(x, y, z, radius))
+
+    def get_players_in_box(self, x1, y1, z1, x2, y2, z2):
+        """return the players whose character is within the box from
+        (x1, y1, z1) to (x2, y2, z2), inclusive, ordered by player id"""
+        return self._get_players(
+            self.world.get_characters_in_box(x1, y1, z1, x2, y2, z2))
+
+    def _get_players(self, characters):
+        players = self.players
+        return [players[character.player_id] for character in characters
+                if character.player_id in players]
+
     def set_master(self):
         self.master_pool.reset()
 
@@ -481,6 +619,21 @@ class ServerProtocol(BaseProtocol):
 
     # events
 
+    def on_connect(self, peer):
+        if self.recorder is not None:
+            self.recorder.connect(peer)
+        BaseProtocol.on_connect(self, peer)
+
+    def on_disconnect(self, peer):
+        if self.recorder is not None:
+            self.recorder.disconnect(peer)
+        BaseProtocol.on_disconnect(self, peer)
+
+    def data_received(self, peer, packet):
+        if self.recorder is not None:
+            self.recorder.receive(peer, packet.data)
+        BaseProtocol.data_received(self, peer, packet)
+
     def on_cp_capture(self, cp):
         pass
 
@@ -23,10 +23,13 @@ IDPool is used to distribute the IDs given out by the Server
 AttributeSet is used for testing if various settings are active
 
 MultikeyDict is used to make player names accessible by both id and name
+
+TimingWindow and TickStats keep rolling timings of the server loop
 """
 
 import itertools
 from collections import deque
+from typing import Optional
 
 
 class IDPool:
@@ -118,3 +121,83 @@ class RateLimiter:
 
     def get_events(self) -> list:
         return list(self._window)
+
+
+class TimingWindow:
+    """
+    Keeps the last `size` durations, or all of them if size is None, and
+    reports percentiles over them
+
+    >>> window = TimingWindow(size=4)
+    >>> for duration in (0.001, 0.002, 0.003, 0.010, 0.004):
+    ...     window.add(duration)
+    >>> window.percentile(50)
+    0.003
+    >>> window.percentile(99)
+    0.01
+    """
+
+    def __init__(self, size: Optional[int] = 600) -> None:
+        self._samples = deque(maxlen=size)  # type: deque
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, duration: float) -> None:
+        self._samples.append(duration)
+
+    def total(self) -> float:
+        return sum(self._samples)
+
+    def percentile(self, percent: float) -> float:
+        """return the nearest-rank percentile of the durations, or 0 if there
+        are none yet"""
+        if not self._samples:
+            return 0.0
+        samples = sorted(self._samples)
+        # nearest rank: the smallest sample that at least percent % of the
+        # samples are less than or equal to
+        rank = -(-len(samples) * percent // 100)
+        return samples[max(int(rank), 1) - 1]
+
+    def get_stats(self) -> dict:
+        """return the p50, p99 and maximum in milliseconds"""
+        return {
+            'p50': self.percentile(50) * 1000,
+            'p99': self.percentile(99) * 1000,
+            'max': max(self._samples, default=0.0) * 1000,
+        }
+
+
+class TickStats:
+    """
+    Rolling timings of the phases of the server loop.
+
+    Every phase is recorded once per tick in which it runs, so the world and
+    hook timings of a tick that catches up several steps are the sum over
+    those steps, and network sends only count the ticks that send.
+    """
+    phases = ('enet', 'map_transfer', 'map_edits', 'world', 'hooks', 'network',
+              'total')
+
+    def __init__(self, size: Optional[int] = 600) -> None:
+        self.timings = {name: TimingWindow(size) for name in self.phases}
+        self.ticks = 0
+        self.steps = 0
+        # ticks that went over the time budget of one step
+        self.overruns = 0
+        # world steps skipped because the loop fell too far behind
+        self.dropped_steps = 0
+
+    def record(self, phase: str, duration: float) -> None:
+        self.timings[phase].add(duration)
+
+    def get_stats(self) -> dict:
+        return {
+            'ticks': self.ticks,
+            'steps': self.steps,
+            'overruns': self.overruns,
+            'dropped_steps': self.dropped_steps,
+            'phases': {name: timings.get_stats()
+                       for name, timings in self.timings.items()},
+        }
@@ -0,0 +1,319 @@
+"""
+Compact containers for sets of voxels of a map, e.g. the blocks built by
+players.
+
+A Python set of ``(x, y, z)`` tuples costs well over 100 bytes per voxel,
+and every lookup builds and hashes a tuple. `VoxelSet` stores one bit per
+voxel instead, in chunks of 16x16 columns like the map, which are only
+allocated once a voxel in them is added. `VoxelMap` maps voxels to a small
+number of distinct values, like the player who built each block.
+
+Both take and return points as ``(x, y, z)`` tuples, so they can stand in for
+the sets and dicts they replace, and have `x, y, z` methods for the hot
+paths.
+"""
+
+from libc.stdint cimport uint32_t, uint64_t
+from libc.stdlib cimport calloc, free
+from libcpp.unordered_map cimport unordered_map
+from cython.operator cimport dereference, preincrement
+
+cdef extern from "vxl_c.h":
+    enum:
+        MAP_X
+        MAP_Y
+        MAP_Z
+        CHUNK_SIZE
+        CHUNK_COLUMNS
+        CHUNKS_X
+        CHUNK_COUNT
+    int get_chunk_index(int x, int y)
+    int get_column_index(int x, int y)
+    int popcount64(uint64_t value)
+
+cdef struct VoxelChunk:
+    uint64_t columns[CHUNK_COLUMNS]
+    int count
+
+
+cdef inline bint is_valid(int x, int y, int z):
+    return 0 <= x < MAP_X and 0 <= y < MAP_Y and 0 <= z < MAP_Z
+
+
+cdef inline uint32_t pack_point(int x, int y, int z):
+    return x | (y << 9) | (z << 18)
+
+
+cdef class VoxelSet:
+    """
+    A set of voxels, stored as a bitset per chunk of the map
+    """
+    cdef VoxelChunk * chunks[CHUNK_COUNT]
+    cdef Py_ssize_t count
+
+    def __init__(self, points=None):
+        if points is not None:
+            self.update(points)
+
+    def __dealloc__(self):
+        self.clear()
+
+    cpdef bint contains(self, int x, int y, int z):
+        cdef VoxelChunk * chunk
+        if not is_valid(x, y, z):
+            return False
+        chunk = self.chunks[get_chunk_index(x, y)]
+        if chunk == NULL:
+            return False
+        return (chunk.columns[get_column_index(x, y)] >> z) & 1
+
+    cpdef add_point(self, int x, int y, int z):
+        cdef int index
+        cdef uint64_t bit
+        cdef VoxelChunk * chunk
+        if not is_valid(x, y, z):
+            raise ValueError('point (%s, %s, %s) is outside the map' % (
+                x, y, z))
+        index = get_chunk_index(x, y)
+        chunk = self.chunks[index]
+        if chunk == NULL:
+            chunk = <VoxelChunk *>calloc(1, sizeof(VoxelChunk))
+            if chunk == NULL:
+                raise MemoryError()
+            self.chunks[index] = chunk
+        bit = (<uint64_t>1) << z
+        index = get_column_index(x, y)
+        if not chunk.columns[index] & bit:
+            chunk.columns[index] |= bit
+            chunk.count += 1
+            self.count += 1
+
+    cpdef discard_point(self, int x, int y, int z):
+        cdef int index
+        cdef uint64_t bit
+        cdef VoxelChunk * chunk
+        if not is_valid(x, y, z):
+            return
+        index = get_chunk_index(x, y)
+        chunk = self.chunks[index]
+        if chunk == NULL:
+            return
+        bit = (<uint64_t>1) << z
+        if not chunk.columns[get_column_index(x, y)] & bit:
+            return
+        chunk.columns[get_column_index(x, y)] &= ~bit
+        chunk.count -= 1
+        self.count -= 1
+        if chunk.count == 0:
+            free(chunk)
+            self.chunks[index] = NULL
+
+    def add(self, point):
+        x, y, z = point
+        self.add_point(x, y, z)
+
+    def discard(self, point):
+        x, y, z = point
+        self.discard_point(x, y, z)
+
+    def remove(self, point):
+        x, y, z = point
+        if not self.contains(x, y, z):
+            raise KeyError(point)
+        self.discard_point(x, y, z)
+
+    def update(self, points):
+        """add every (x, y, z) point of points, e.g. the result of
+        cube_line"""
+        cdef int x, y, z
+        for x, y, z in points:
+            self.add_point(x, y, z)
+
+    def difference_update(self, points):
+        cdef int x, y, z
+        for x, y, z in points:
+            self.discard_point(x, y, z)
+
+    cpdef int count_box(self, int x1, int y1, int z1, int x2, int y2, int z2):
+        """return how many voxels of the box from (x1, y1, z1) to
+        (x2, y2, z2), exclusive, are in the set"""
+        cdef int x, y, total = 0
+        cdef uint64_t mask
+        cdef VoxelChunk * chunk
+        x1, y1, z1 = max(x1, 0), max(y1, 0), max(z1, 0)
+        x2, y2, z2 = min(x2, MAP_X), min(y2, MAP_Y), min(z2, MAP_Z)
+        if x1 >= x2 or y1 >= y2 or z1 >= z2:
+            return 0
+        mask = ~(<uint64_t>0) >> (64 - (z2 - z1)) << z1
+        for x in range(x1, x2):
+            for y in range(y1, y2):
+                chunk = self.chunks[get_chunk_index(x, y)]
+                if chunk != NULL:
+                    total += popcount64(
+                        chunk.columns[get_column_index(x, y)] & mask)
+        return total
+
+    def clear(self):
+        cdef int i
+        for i in range(CHUNK_COUNT):
+            if self.chunks[i] != NULL:
+                free(self.chunks[i])
+                self.chunks[i] = NULL
+        self.count = 0
+
+    def __contains__(self, point):
+        try:
+            x, y, z = point
+        except (TypeError, ValueError):
+            return False
+        return self.contains(x, y, z)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        """iterate over the points ordered by chunk, then column, then z"""
+        cdef int i, column, z
+        cdef uint64_t value
+        cdef VoxelChunk * chunk
+        for i in range(CHUNK_COUNT):
+            chunk = self.chunks[i]
+            if chunk == NULL:
+                continue
+            for column in range(CHUNK_COLUMNS):
+                # the chunk may be freed while the caller handles a point
+                chunk = self.chunks[i]
+                if chunk == NULL:
+                    break
+                value = chunk.columns[column]
+                for z in range(MAP_Z):
+                    if (value >> z) & 1:
+                        yield ((i % CHUNKS_X) * CHUNK_SIZE +
+                               column % CHUNK_SIZE,
+                               (i // CHUNKS_X) * CHUNK_SIZE +
+                               column // CHUNK_SIZE, z)
+
+    def get_memory_usage(self):
+        """return the bytes used by the allocated chunks"""
+        cdef int i, chunks = 0
+        for i in range(CHUNK_COUNT):
+            if self.chunks[i] != NULL:
+                chunks += 1
+        return chunks * sizeof(VoxelChunk)
+
+
+cdef class VoxelMap:
+    """
+    A mapping of voxels to values. Every distinct value is stored once and
+    voxels hold an index to it, so this suits many voxels sharing a few
+    hashable values, e.g. ``(name, team)`` of the builder. Values are kept
+    until the map is cleared.
+    """
+    cdef unordered_map[uint32_t, uint32_t] voxels
+    cdef list values
+    cdef dict indices
+
+    def __init__(self):
+        self.values = []
+        self.indices = {}
+
+    cdef uint32_t get_index(self, value) except? 0xFFFFFFFF:
+        index = self.indices.get(value)
+        if index is None:
+            index = len(self.values)
+            self.values.append(value)
+            self.indices[value] = index
+        return index
+
+    cpdef set_point(self, int x, int y, int z, value):
+        if not is_valid(x, y, z):
+            raise ValueError('point (%s, %s, %s) is outside the map' % (
+                x, y, z))
+        self.voxels[pack_point(x, y, z)] = self.get_index(value)
+
+    cpdef get_point(self, int x, int y, int z, default=None):
+        cdef unordered_map[uint32_t, uint32_t].iterator it
+        if not is_valid(x, y, z):
+            return default
+        it = self.voxels.find(pack_point(x, y, z))
+        if it == self.voxels.end():
+            return default
+        return self.values[dereference(it).second]
+
+    cpdef pop_point(self, int x, int y, int z, default=None):
+        cdef unordered_map[uint32_t, uint32_t].iterator it
+        if not is_valid(x, y, z):
+            return default
+        it = self.voxels.find(pack_point(x, y, z))
+        if it == self.voxels.end():
+            return default
+        value = self.values[dereference(it).second]
+        self.voxels.erase(it)
+        return value
+
+    def set_points(self, points, value):
+        """set every (x, y, z) point of points, e.g. the result of
+        cube_line, to value"""
+        cdef int x, y, z
+        cdef uint32_t index = self.get_index(value)
+        for x, y, z in points:
+            if not is_valid(x, y, z):
+                raise ValueError('point (%s, %s, %s) is outside the map' % (
+                    x, y, z))
+            self.voxels[pack_point(x, y, z)] = index
+
+    def __setitem__(self, point, value):
+        x, y, z = point
+        self.set_point(x, y, z, value)
+
+    def __getitem__(self, point):
+        x, y, z = point
+        value = self.get_point(x, y, z, self)
+        if value is self:
+            raise KeyError(point)
+        return value
+
+    def __delitem__(self, point):
+        x, y, z = point
+        if self.pop_point(x, y, z, self) is self:
+            raise KeyError(point)
+
+    def get(self, point, default=None):
+        x, y, z = point
+        return self.get_point(x, y, z, default)
+
+    def pop(self, point, default=None):
+        x, y, z = point
+        return self.pop_point(x, y, z, default)
+
+    def clear(self):
+        self.voxels.clear()
+        self.values = []
+        self.indices = {}
+
+    def __contains__(self, point):
+        try:
+            x, y, z = point
+        except (TypeError, ValueError):
+            return False
+        return (is_valid(x, y, z) and
+                self.voxels.count(pack_point(x, y, z)) != 0)
+
+    def __len__(self):
+        return self.voxels.size()
+
+    def items(self):
+        """return a list of the (point, value) items"""
+        cdef unordered_map[uint32_t, uint32_t].iterator it
+        cdef uint32_t key
+        items = []
+        it = self.voxels.begin()
+        while it != self.voxels.end():
+            key = dereference(it).first
+            items.append(((key & 511, (key >> 9) & 511, key >> 18),
+                          self.values[dereference(it).second]))
+            preincrement(it)
+        return items
+
+    def __iter__(self):
+        return iter([point for point, _ in self.items()])
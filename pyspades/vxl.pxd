@@ -1,3 +1,5 @@
+from libcpp.vector cimport vector
+
 cdef extern from "vxl_c.cpp":
     enum:
         MAP_X
@@ -5,19 +7,32 @@ cdef extern from "vxl_c.cpp":
         MAP_Z
         DEFAULT_COLOR
     struct MapData:
-        pass
+        unsigned int generation
     struct MapGenerator:
         pass
     MapGenerator * create_map_generator(MapData * original)
     void delete_map_generator(MapGenerator * generator)
     object get_generator_data(MapGenerator * generator, int columns)
-    MapData * load_vxl(unsigned char * v)
+    MapData * load_vxl(const unsigned char * v, size_t size,
+        int threads) nogil
     MapData * copy_map(MapData * map)
     void delete_vxl(MapData * map)
     object save_vxl(MapData * map)
+    size_t write_vxl(MapData * map, char * out) nogil
+    enum:
+        VXL_BUFFER_SIZE
+        CHUNK_SIZE
+        CHUNKS_X
+        CHUNK_COUNT
     int check_node(int x, int y, int z, MapData * map, int destroy)
-    bint get_solid(int x, int y, int z, MapData * map)
-    int get_color(int x, int y, int z, MapData * map)
+    int destroy_points(const int * points, int count, MapData * map,
+        char * removed)
+    bint get_solid(int x, int y, int z, MapData * map) nogil
+    unsigned long long get_column(int x, int y, MapData * map) nogil
+    int get_top_z(int x, int y, int start, MapData * map) nogil
+    int get_ground_height(int x, int y, MapData * map) nogil
+    bint is_chunk_shared(MapData * map, MapData * other, int index)
+    int get_color(int x, int y, int z, MapData * map) nogil
     void set_point(int x, int y, int z, MapData * map, bint solid, int color)
     void set_column_solid(int x, int y, int start_z, int end_z,
         MapData * map, bint solid)
@@ -27,6 +42,9 @@ cdef extern from "vxl_c.cpp":
         float random_1, float random_2, int * x, int * y)
     bint is_valid_position(int x, int y, int z)
     void update_shadows(MapData * map)
+    void diff_map(MapData * map, MapData * other, int x1, int y1, int x2,
+        int y2, vector[int] & removals, vector[int] & fills,
+        vector[int] & surface) nogil
 
 cdef class VXLData:
     cdef MapData * map
@@ -41,6 +59,7 @@ cdef class VXLData:
     cpdef bint is_surface(self, int x, int y, int z)
     cpdef list get_neighbors(self, int x, int y, int z)
     cpdef int check_node(self, int x, int y, int z, bint destroy = ?)
+    cdef tuple _destroy_points(self, int * data, int count)
     cpdef bint build_point(self, int x, int y, int z, tuple color)
     cpdef bint set_column_fast(self, int x, int y, int start_z,
         int end_z, int end_color_z, int color)
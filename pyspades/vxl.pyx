@@ -15,6 +15,10 @@
 # You should have received a copy of the GNU General Public License
 # along with pyspades.  If not, see <http://www.gnu.org/licenses/>.
 
+from libc.stdlib cimport malloc, free
+from libc.string cimport memcpy
+from libcpp.vector cimport vector
+from cpython cimport array
 from pyspades.common cimport allocate_memory
 
 cdef tuple make_color_tuple(int color):
@@ -28,9 +32,46 @@ cdef tuple make_color_tuple(int color):
 cpdef inline int make_color(int r, int g, int b, int a = 255):
     return b | (g << 8) | (r << 16) | (<int>((a / 255.0) * 128) << 24)
 
+import array
+import io
+import mmap
 import time
 import random
 
+
+def read_vxl_file(fp):
+    """Return the rest of the VXL file fp, memory-mapped if it is a plain
+    file, so it isn't copied into a bytes object first"""
+    try:
+        fileno = fp.fileno()
+        if fp.tell() == 0:
+            return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        # not a plain file, or an empty one
+        pass
+    return fp.read()
+
+
+cdef MapData * parse_vxl(data, int threads) except NULL:
+    cdef const unsigned char[::1] view = data
+    cdef MapData * map
+    if view.shape[0] == 0:
+        raise ValueError('no VXL data')
+    with nogil:
+        map = load_vxl(&view[0], view.shape[0], threads)
+    if map == NULL:
+        raise ValueError('invalid VXL data')
+    return map
+
+cdef array.array make_int_array(vector[int] & values):
+    cdef array.array result = array.clone(array.array('i'), values.size(),
+                                          zero=False)
+    if values.size():
+        memcpy(result.data.as_ints, values.data(),
+               values.size() * sizeof(int))
+    return result
+
+
 cdef class Generator:
     cdef MapGenerator * generator
     cdef public:
@@ -38,6 +79,8 @@ cdef class Generator:
 
     def __init__(self, VXLData data):
         self.done = False
+        # the generator works on a copy-on-write snapshot of the map, so
+        # edits to the live map don't show up halfway through a download
         self.generator = create_map_generator(data.map)
 
     def get_data(self, int columns = 2):
@@ -53,23 +96,45 @@ cdef class Generator:
         delete_map_generator(self.generator)
 
 cdef class VXLData:
-    def __init__(self, fp = None):
-        cdef unsigned char * c_data
-        if fp is not None:
-            data = fp.read()
-            c_data = data
+    def __init__(self, fp = None, int threads = 0):
+        """Load the map from the VXL file fp, or create an empty map if it is
+        None. Columns are decoded with up to threads threads without the GIL,
+        with one per core if it is 0."""
+        if fp is None:
+            self.map = load_vxl(NULL, 0, 1)
+            return
+        data = read_vxl_file(fp)
+        try:
+            self.map = parse_vxl(data, threads)
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+    def load_vxl(self, data = None, int threads = 0):
+        """Replace the map with the VXL map in data, any object supporting
+        the buffer protocol, or with an empty map if it is None"""
+        cdef MapData * map
+        if data is None:
+            map = load_vxl(NULL, 0, 1)
         else:
-            c_data = NULL
-        self.map = load_vxl(c_data)
-
-    def load_vxl(self, c_data = None):
-        self.map = load_vxl(c_data)
+            map = parse_vxl(data, threads)
+        delete_vxl(self.map)
+        self.map = map
 
     def copy(self):
-        cdef VXLData map = VXLData()
+        """Return a copy of the map.
+
+        The copy shares its storage with this map until either of them is
+        modified, so copying is cheap."""
+        cdef VXLData map = VXLData.__new__(VXLData)
         map.map = copy_map(self.map)
         return map
 
+    @property
+    def generation(self):
+        """A counter that changes every time the map is modified"""
+        return self.map.generation
+
     def get_point(self, int x, int y, int z):
         color = self.get_color(x, y, z)
         solid = color is not None
@@ -101,18 +166,17 @@ cdef class VXLData:
         moving down.  Useful for getting the coordinate for where something
         should be after being dropped.
         '''
-
-        for z in range(start, 64):
-            if get_solid(x, y, z, self.map):
-                return z
-        return 0
+        cdef int z
+        if not is_valid_position(x, y, 0):
+            return 0
+        # a lookup in the column's bitmask, which every edit keeps up to date
+        z = get_top_z(x, y, start, self.map)
+        return 0 if z < 0 else z
 
     cpdef int get_height(self, int x, int y):
-        cdef int start = 63
-        for z in range(start, -1, -1):
-            if not get_solid(x, y, z, self.map):
-                return z + 1
-        return 0
+        if not is_valid_position(x, y, 0):
+            return 64
+        return get_ground_height(x, y, self.map)
 
     cpdef tuple get_safe_coords(self, int x, int y, int z):
         '''
@@ -132,28 +196,96 @@ cdef class VXLData:
             random.random(), &x, &y)
         return x, y
 
-    def count_land(self, int x1, y1, x2, y2):
-        cdef int land = 0
+    def count_land(self, int x1, int y1, int x2, int y2):
+        cdef int x, y, land = 0
+        cdef unsigned long long bit = 1ULL << 62
+        x1, y1 = max(x1, 0), max(y1, 0)
+        x2, y2 = min(x2, MAP_X), min(y2, MAP_Y)
         for x in range(x1, x2):
             for y in range(y1, y2):
-                if self.get_solid(x, y, 62):
+                if get_column(x, y, self.map) & bit:
                     land += 1
         return land
 
     def destroy_point(self, int x, int y, int z):
-        if not self.get_solid(x, y, z) or z >= 62:
-            return 0
-        set_point(x, y, z, self.map, 0, 0)
-        count = 1
+        """remove the voxel at x, y, z and everything that is no longer
+        connected to the ground. Returns the number of voxels removed"""
+        cdef int point[3]
+        point[0] = x
+        point[1] = y
+        point[2] = z
         start = time.monotonic()
-        for node_x, node_y, node_z in self.get_neighbors(x, y, z):
-            if node_z < 62:
-                count += self.check_node(node_x, node_y, node_z, True)
+        count = destroy_points(point, 1, self.map, NULL)
         taken = time.monotonic() - start
         if taken > 0.1:
             print('destroying block at', x, y, z, 'took:', taken)
         return count
 
+    cdef tuple _destroy_points(self, int * data, int count):
+        cdef char * removed = <char *>malloc(count)
+        if removed == NULL:
+            raise MemoryError()
+        cdef int i, total
+        cdef list points = []
+        try:
+            total = destroy_points(data, count, self.map, removed)
+            for i in range(count):
+                if removed[i]:
+                    points.append((data[i * 3], data[i * 3 + 1],
+                                   data[i * 3 + 2]))
+        finally:
+            free(removed)
+        return total, points
+
+    def destroy_points(self, points):
+        """remove the voxels at the (x, y, z) tuples of points and everything
+        that is no longer connected to the ground, in one pass. This gives
+        the same result as calling destroy_point for every point, but checks
+        the connectivity of shared structures only once.
+
+        Returns:
+            count, removed: the number of voxels removed, including ones that
+            fell down, and a list of the points that were removed
+        """
+        cdef int count = len(points)
+        if count == 0:
+            return 0, []
+        cdef int * data = <int *>malloc(sizeof(int) * 3 * count)
+        if data == NULL:
+            raise MemoryError()
+        cdef int i
+        try:
+            for i, (x, y, z) in enumerate(points):
+                data[i * 3] = x
+                data[i * 3 + 1] = y
+                data[i * 3 + 2] = z
+            return self._destroy_points(data, count)
+        finally:
+            free(data)
+
+    def destroy_region(self, int x1, int y1, int z1, int x2, int y2, int z2):
+        """like destroy_points, for every point in the box from x1, y1, z1 up
+        to, but not including, x2, y2, z2. The points are visited in x, y, z
+        order"""
+        if x2 <= x1 or y2 <= y1 or z2 <= z1:
+            return 0, []
+        cdef int count = (x2 - x1) * (y2 - y1) * (z2 - z1)
+        cdef int * data = <int *>malloc(sizeof(int) * 3 * count)
+        if data == NULL:
+            raise MemoryError()
+        cdef int x, y, z, i = 0
+        try:
+            for x in range(x1, x2):
+                for y in range(y1, y2):
+                    for z in range(z1, z2):
+                        data[i] = x
+                        data[i + 1] = y
+                        data[i + 2] = z
+                        i += 3
+            return self._destroy_points(data, count)
+        finally:
+            free(data)
+
     def remove_point(self, int x, int y, int z):
         if is_valid_position(x, y, z):
             set_point(x, y, z, self.map, 0, 0)
@@ -221,36 +353,82 @@ cdef class VXLData:
     cpdef update_shadows(self):
         update_shadows(self.map)
 
-    def get_overview(self, int z = -1, bint rgba = False):
+    def get_overview(self, int z = -1, bint rgba = False, int x1 = 0,
+                     int y1 = 0, int x2 = 512, int y2 = 512):
+        """Return the colors of the columns from (x1, y1) to (x2, y2),
+        exclusive, as 4 bytes per column, row by row. With z = -1 it shows
+        the top of every column, otherwise the voxels at height z, with
+        transparent air.
+
+        The GIL is released while the image is drawn."""
         cdef unsigned int * data
         cdef unsigned int i, r, g, b, a, color
-        data_python = allocate_memory(sizeof(int[512][512]), <char**>&data)
+        cdef int x, y, current_z
+        x1, y1 = max(x1, 0), max(y1, 0)
+        x2, y2 = max(min(x2, MAP_X), x1), max(min(y2, MAP_Y), y1)
+        data_python = allocate_memory((x2 - x1) * (y2 - y1) * sizeof(int),
+                                      <char**>&data)
         i = 0
-        cdef int current_z
-        if z == -1:
-            a = 255
-        else:
-            current_z = z
-        for y in range(512):
-            for x in range(512):
-                if z == -1:
-                    current_z = self.get_z(x, y)
-                else:
-                    if get_solid(x, y, z, self.map):
+        a = 255
+        current_z = z
+        with nogil:
+            for y in range(y1, y2):
+                for x in range(x1, x2):
+                    if z == -1:
+                        current_z = get_top_z(x, y, 0, self.map)
+                        if current_z < 0:
+                            current_z = 0
+                    elif get_solid(x, y, z, self.map):
                         a = 255
                     else:
                         a = 0
-                color = get_color(x, y, current_z, self.map)
-                if rgba:
-                    b = color & 0xFF
-                    g = (color & 0xFF00) >> 8
-                    r = (color & 0xFF0000) >> 16
-                    data[i] = r | (g << 8) | (b << 16) | (a << 24)
-                else:
-                    data[i] = (color & 0x00FFFFFF) | (a << 24)
-                i += 1
+                    color = get_color(x, y, current_z, self.map)
+                    if rgba:
+                        b = color & 0xFF
+                        g = (color & 0xFF00) >> 8
+                        r = (color & 0xFF0000) >> 16
+                        data[i] = r | (g << 8) | (b << 16) | (a << 24)
+                    else:
+                        data[i] = (color & 0x00FFFFFF) | (a << 24)
+                    i += 1
         return data_python
 
+    def get_changed_chunks(self, VXLData other):
+        """Return the (x, y) of the first column of every chunk of
+        CHUNK_SIZE x CHUNK_SIZE columns that was modified in this map or in
+        other since one was copied from the other. Chunks of unrelated maps
+        always count as changed."""
+        cdef int i
+        return [((i % CHUNKS_X) * CHUNK_SIZE, (i // CHUNKS_X) * CHUNK_SIZE)
+                for i in range(CHUNK_COUNT)
+                if not is_chunk_shared(self.map, other.map, i)]
+
+    def diff(self, VXLData other, int x1 = 0, int y1 = 0, int x2 = 512,
+             int y2 = 512):
+        """Compare the columns from (x1, y1) to (x2, y2), exclusive, with
+        other, and return the edits that turn this map into other as
+        ``(removals, fills, surface)``, ``array('i')`` buffers ordered by x,
+        then y, then z:
+
+        * ``removals``: x, y, z of every voxel to remove
+        * ``fills``: x, y, z of every voxel to build that is inside the
+          terrain of other, so its color doesn't matter
+        * ``surface``: x, y, z and the color, as in
+          `pyspades.common.make_color`, of every voxel to build on the surface
+          of other
+
+        Surface voxels that are solid in both maps but had another color or
+        were inside the terrain are in both removals and surface. Voxels
+        beside the edges of the map count as open, as in `is_surface`. The
+        bottom layer (z = 63) is left out. Chunks both maps still share are
+        skipped, so comparing a map with a copy of it is cheap."""
+        cdef vector[int] removals, fills, surface
+        with nogil:
+            diff_map(self.map, other.map, x1, y1, x2, y2, removals, fills,
+                     surface)
+        return (make_int_array(removals), make_int_array(fills),
+                make_int_array(surface))
+
     def set_overview(self, data_str, int z):
         cdef unsigned int * data
         cdef unsigned int r, g, b, a, color, i, new_color
@@ -267,8 +445,23 @@ cdef class VXLData:
                 i += 1
 
     def generate(self):
+        """Return the map in VXL format.
+
+        The GIL is released while the map is serialised, so this can run in
+        a worker thread. The map must not be modified meanwhile; generate a
+        :meth:`copy` to keep editing the original."""
+        cdef char * out
+        cdef size_t size
         start = time.monotonic()
-        data = save_vxl(self.map)
+        out = <char *>malloc(VXL_BUFFER_SIZE)
+        if out == NULL:
+            raise MemoryError()
+        try:
+            with nogil:
+                size = write_vxl(self.map, out)
+            data = out[:size]
+        finally:
+            free(out)
         dt = time.monotonic() - start
         if dt > 1.0:
             print('VXLData.generate() took {}'.format(dt))
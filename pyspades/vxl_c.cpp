@@ -20,6 +20,10 @@
 
 #include "vxl_c.h"
 #include "Python.h"
+#include <algorithm>
+#include <new>
+#include <system_error>
+#include <thread>
 #include <vector>
 
 using namespace std;
@@ -36,62 +40,211 @@ void inline limit(int *value, int min, int max)
     }
 }
 
-MapData *load_vxl(unsigned char *v)
+// VXL maps store the columns one after another, row by row, as a list of
+// spans. Columns have no fixed size, so loading first walks the spans to
+// find where every column starts, and then decodes the chunks in parallel,
+// as each chunk only needs its own columns.
+
+#define MAX_LOAD_THREADS 8
+
+// returns the size of the column at `v`, or 0 if it runs past `end` or has
+// a span whose colors don't fit in it
+static size_t get_column_size(const unsigned char *v, const unsigned char *end)
 {
-    MapData *map = new MapData;
-    if (v == NULL)
-        return map;
-    int x, y, z;
-    for (y = 0; y < 512; ++y)
+    const unsigned char *start = v;
+    for (;;)
     {
-        for (x = 0; x < 512; ++x)
+        if (end - v < 4)
+            return 0;
+        if (v[0] == 0)
         {
-            for (z = 0; z < 64; ++z)
-            {
-                map->geometry[get_pos(x, y, z)] = 1;
-            }
-            z = 0;
-            for (;;)
-            {
-                int *color;
-                int i;
-                int number_4byte_chunks = v[0];
-                int top_color_start = v[1];
-                int top_color_end = v[2]; // inclusive
-                int bottom_color_start;
-                int bottom_color_end; // exclusive
-                int len_top;
-                int len_bottom;
-                for (i = z; i < top_color_start; i++)
-                    map->geometry[get_pos(x, y, i)] = 0;
-                color = (int *)(v + 4);
-                for (z = top_color_start; z <= top_color_end; z++)
-                    map->colors[get_pos(x, y, z)] = *color++;
-                len_bottom = top_color_end - top_color_start + 1;
-
-                // check for end of data marker
-                if (number_4byte_chunks == 0)
-                {
-                    // infer ACTUAL number of 4-byte chunks from the length of the color data
-                    v += 4 * (len_bottom + 1);
-                    break;
-                }
+            // the last span only has its top colors
+            size_t size = 4 * (v[2] - v[1] + 2);
+            if (v[2] + 1 < v[1] || (size_t)(end - v) < size)
+                return 0;
+            return v + size - start;
+        }
+        // the top colors of the span have to fit in it, the bottom colors
+        // take up the rest
+        int len_bottom = v[2] - v[1] + 1;
+        if (len_bottom < 0 || len_bottom > v[0] - 1 || end - v < v[0] * 4)
+            return 0;
+        v += v[0] * 4;
+    }
+}
 
-                // infer the number of bottom colors in next span from chunk length
-                len_top = (number_4byte_chunks - 1) - len_bottom;
+// returns bits a to b of a column mask, exclusive
+uint64_t inline get_bits(int a, int b)
+{
+    if (a >= b)
+        return 0;
+    uint64_t mask = b >= 64 ? ~0ULL : (1ULL << b) - 1;
+    return mask & (~0ULL << a);
+}
 
-                // now skip the v pointer past the data to the beginning of the next span
-                v += v[0] * 4;
+// decodes the column at `v` into `column` of `chunk`, appending its colors.
+// Returns false if the column is invalid.
+static bool decode_column(const unsigned char *v, MapChunk *chunk, int column)
+{
+    uint64_t geometry = ~0ULL;
+    uint64_t colored = 0;
+    const int *color;
+    int z = 0;
+    int last_z = -1;
+    for (;;)
+    {
+        int top_color_start = v[1];
+        int top_color_end = v[2]; // inclusive
+        int len_bottom = top_color_end - top_color_start + 1;
+        if (top_color_start <= last_z || top_color_end >= MAP_Z)
+            return false;
+        geometry &= ~get_bits(z, top_color_start);
+        color = (const int *)(v + 4);
+        chunk->colors.insert(chunk->colors.end(), color, color + len_bottom);
+        colored |= get_bits(top_color_start, top_color_end + 1);
+        last_z = top_color_end;
+        if (v[0] == 0)
+            break;
+
+        // the colors of the bottom of this span follow, and end where the
+        // air of the next span starts
+        int len_top = (v[0] - 1) - len_bottom;
+        color += len_bottom;
+        v += v[0] * 4;
+        int bottom_color_end = v[3]; // exclusive, aka air start
+        int bottom_color_start = bottom_color_end - len_top;
+        if (len_top < 0 || bottom_color_end > MAP_Z ||
+            (len_top > 0 && bottom_color_start <= last_z))
+            return false;
+        chunk->colors.insert(chunk->colors.end(), color, color + len_top);
+        colored |= get_bits(bottom_color_start, bottom_color_end);
+        if (len_top > 0)
+            last_z = bottom_color_end - 1;
+        z = bottom_color_end;
+    }
+    chunk->geometry[column] = geometry;
+    chunk->color_masks[column] = colored;
+    return true;
+}
 
-                bottom_color_end = v[3]; // aka air start
-                bottom_color_start = bottom_color_end - len_top;
-                for (z = bottom_color_start; z < bottom_color_end; ++z)
-                {
-                    map->colors[get_pos(x, y, z)] = *color++;
-                }
+// decodes chunks first to last - 1. Returns false if a column is invalid
+// or memory ran out, as exceptions can't leave the threads
+static bool decode_chunks(const unsigned char **columns, MapData *map,
+                          int first, int last)
+{
+    try
+    {
+        for (int i = first; i < last; i++)
+        {
+            MapChunk *chunk = map->chunks[i];
+            int x1 = (i % CHUNKS_X) * CHUNK_SIZE;
+            int y1 = (i / CHUNKS_X) * CHUNK_SIZE;
+            for (int column = 0; column < CHUNK_COLUMNS; column++)
+            {
+                int x = x1 + column % CHUNK_SIZE;
+                int y = y1 + column / CHUNK_SIZE;
+                chunk->starts[column] = chunk->colors.size();
+                if (!decode_column(columns[x + y * MAP_X], chunk, column))
+                    return false;
             }
+            chunk->starts[CHUNK_COLUMNS] = chunk->colors.size();
+            chunk->colors.shrink_to_fit();
+        }
+    }
+    catch (...)
+    {
+        return false;
+    }
+    return true;
+}
+
+// decodes the VXL map in the `size` bytes at `v` into `map`. Returns false if
+// the data is invalid or memory ran out
+static bool decode_vxl(const unsigned char *v, size_t size, int threads,
+                       MapData *map)
+{
+    std::vector<const unsigned char *> columns;
+    std::vector<std::thread> workers;
+    std::vector<char> results;
+    try
+    {
+        columns.resize(MAP_X * MAP_Y);
+        workers.reserve(MAX_LOAD_THREADS);
+        results.resize(MAX_LOAD_THREADS);
+    }
+    catch (const std::bad_alloc &)
+    {
+        return false;
+    }
+    const unsigned char *end = v + size;
+    for (int i = 0; i < MAP_X * MAP_Y; i++)
+    {
+        size_t column_size = get_column_size(v, end);
+        if (column_size == 0)
+            return false;
+        columns[i] = v;
+        v += column_size;
+    }
+
+    if (threads <= 0)
+        threads = std::thread::hardware_concurrency();
+    if (threads > MAX_LOAD_THREADS)
+        threads = MAX_LOAD_THREADS;
+    if (threads < 1)
+        threads = 1;
+    int per_thread = (CHUNK_COUNT + threads - 1) / threads;
+    for (int i = 1; i < threads; i++)
+    {
+        int first = i * per_thread;
+        int last = std::min(first + per_thread, CHUNK_COUNT);
+        try
+        {
+            // the space is reserved, so only starting the thread can throw
+            workers.push_back(std::thread([&columns, map, &results, i, first,
+                                           last]() {
+                results[i] = decode_chunks(columns.data(), map, first, last);
+            }));
+        }
+        catch (const std::system_error &)
+        {
+            // the chunks of a thread that can't start are decoded here
+            results[i] = decode_chunks(columns.data(), map, first, last);
         }
     }
+    results[0] = decode_chunks(columns.data(), map, 0,
+                               std::min(per_thread, CHUNK_COUNT));
+    for (std::thread &worker : workers)
+        worker.join();
+    for (int i = 0; i < threads; i++)
+    {
+        if (!results[i])
+            return false;
+    }
+    return true;
+}
+
+// loads the VXL map in the `size` bytes at `v`, using up to `threads`
+// threads, or as many as there are cores if it is 0. Returns an empty map if
+// `v` is NULL, or NULL if the data is invalid or memory ran out. Doesn't
+// need the GIL.
+MapData *load_vxl(const unsigned char *v, size_t size, int threads)
+{
+    MapData *map;
+    try
+    {
+        map = new MapData;
+    }
+    catch (const std::bad_alloc &)
+    {
+        return NULL;
+    }
+    if (v == NULL)
+        return map;
+    if (!decode_vxl(v, size, threads, map))
+    {
+        delete map;
+        return NULL;
+    }
     return map;
 }
 
@@ -100,103 +253,181 @@ void inline delete_vxl(MapData *map)
     delete map;
 }
 
-struct Position
+// Connectivity checks flood fill whole runs of solid voxels in a column at
+// once, using the same bit per voxel layout as the column geometry masks.
+// `visited` holds the voxels reached by the current fill. `grounded` holds
+// the voxels a previous fill of the same batch found to be connected to the
+// ground, so later fills can stop as soon as they reach one of them. Both
+// are cleared through the run lists after use, so a fill only costs as much
+// as the structure it walks.
+
+struct Run
 {
     int x;
     int y;
-    int z;
+    uint64_t mask;
 };
 
-#define NODE_RESERVE_SIZE 250000
-static Position *nodes = NULL;
-static int node_pos;
-static int nodes_size;
-static set_type<int> marked;
+static uint64_t *visited = NULL;
+static uint64_t *grounded = NULL;
+static std::vector<Run> runs;
+static std::vector<Run> grounded_runs;
+static size_t stack_pos;
 
-inline void push_back_node(int x, int y, int z)
+#define GROUND_MASK (3ULL << 62)
+#define get_column_pos(x, y) ((x) + (y)*MAP_Y)
+
+// returns the run of set bits in `bits` that contains bit z
+uint64_t inline get_run(uint64_t bits, int z)
 {
-    nodes[node_pos].x = x;
-    nodes[node_pos].y = y;
-    nodes[node_pos].z = z;
-    node_pos++;
+    uint64_t above = ~bits >> z;
+    uint64_t run;
+    if (above)
+        run = ((1ULL << lowest_bit(above)) - 1) << z;
+    else
+        run = ~0ULL << z;
+    uint64_t below = (1ULL << z) - 1;
+    uint64_t gaps = ~bits & below;
+    if (gaps)
+        below &= ~0ULL << (highest_bit(gaps) + 1);
+    return run | below;
 }
 
-inline const Position *pop_back_node()
+void inline init_fill()
 {
-    return &nodes[--node_pos];
+    if (visited != NULL)
+        return;
+    visited = (uint64_t *)calloc(MAP_X * MAP_Y, sizeof(uint64_t));
+    grounded = (uint64_t *)calloc(MAP_X * MAP_Y, sizeof(uint64_t));
 }
 
-inline void add_node(int x, int y, int z, MapData *map)
+void inline clear_runs(uint64_t *bits, std::vector<Run> &list, size_t start)
 {
-    if (x < 0 || x > 511 ||
-        y < 0 || y > 511 ||
-        z < 0 || z > 63)
-        return;
-    if (!map->geometry[get_pos(x, y, z)])
-        return;
-    push_back_node(x, y, z);
+    for (size_t i = start; i < list.size(); i++)
+        bits[get_column_pos(list[i].x, list[i].y)] &= ~list[i].mask;
+    list.resize(start);
 }
 
-int check_node(int x, int y, int z, MapData *map, int destroy)
+// marks the unvisited run in column x, y that contains `seeds` and queues
+// it. Returns true if the run is connected to the ground.
+bool inline visit_column(int x, int y, uint64_t seeds, MapData *map)
 {
-    if (nodes == NULL)
+    int pos = get_column_pos(x, y);
+    uint64_t open = get_column(x, y, map) & ~visited[pos];
+    seeds &= open;
+    while (seeds)
     {
-        nodes = (Position *)malloc(sizeof(Position) * NODE_RESERVE_SIZE);
-        nodes_size = NODE_RESERVE_SIZE;
+        uint64_t run = get_run(open, lowest_bit(seeds));
+        seeds &= ~run;
+        if ((run & GROUND_MASK) || (run & grounded[pos]))
+            return true;
+        visited[pos] |= run;
+        Run item = {x, y, run};
+        runs.push_back(item);
     }
-    node_pos = 0;
+    return false;
+}
 
-    push_back_node(x, y, z);
+// flood fills from x, y, z. Returns the number of solid voxels connected to
+// it, or 0 if they are connected to the ground. If destroy is set, the
+// connected voxels are removed.
+int fill_node(int x, int y, int z, MapData *map, int destroy)
+{
+    if (!is_valid_position(x, y, z) || !get_solid_unchecked(x, y, z, map))
+        return 0;
+    runs.clear();
+    stack_pos = 0;
+    bool is_grounded = visit_column(x, y, 1ULL << z, map);
+    while (!is_grounded && stack_pos < runs.size())
+    {
+        Run current = runs[stack_pos++];
+        int cx = current.x;
+        int cy = current.y;
+        uint64_t run = current.mask;
+        is_grounded = (cx > 0 && visit_column(cx - 1, cy, run, map)) ||
+                      (cx < MAP_X - 1 && visit_column(cx + 1, cy, run, map)) ||
+                      (cy > 0 && visit_column(cx, cy - 1, run, map)) ||
+                      (cy < MAP_Y - 1 && visit_column(cx, cy + 1, run, map));
+    }
 
-    while (node_pos > 0)
+    int count = 0;
+    for (size_t i = 0; i < runs.size(); i++)
     {
-        if (node_pos >= nodes_size - 6)
+        Run &item = runs[i];
+        visited[get_column_pos(item.x, item.y)] &= ~item.mask;
+        if (is_grounded)
         {
-            nodes_size += NODE_RESERVE_SIZE;
-            nodes = (Position *)realloc((void *)nodes,
-                                        sizeof(Position) * nodes_size);
+            // everything reached so far is connected to the ground too
+            grounded[get_column_pos(item.x, item.y)] |= item.mask;
+            grounded_runs.push_back(item);
+            continue;
         }
-        const Position *current_node = pop_back_node();
-        z = current_node->z;
-        if (z >= 62)
-        {
-            marked.clear();
-            return 0;
-        }
-        x = current_node->x;
-        y = current_node->y;
-
-        int i = get_pos(x, y, z);
-
-        // already visited?
-        pair<set_type<int>::iterator, bool> ret;
-        ret = marked.insert(i);
-        if (ret.second)
+        count += popcount64(item.mask);
+        if (destroy)
         {
-            add_node(x, y, z - 1, map);
-            add_node(x, y - 1, z, map);
-            add_node(x, y + 1, z, map);
-            add_node(x - 1, y, z, map);
-            add_node(x + 1, y, z, map);
-            add_node(x, y, z + 1, map);
+            MapChunk *chunk = get_writable_chunk(item.x, item.y, map);
+            int column = get_column_index(item.x, item.y);
+            chunk->geometry[column] &= ~item.mask;
+            chunk->erase_colors(column, item.mask);
         }
     }
+    runs.clear();
+    return is_grounded ? 0 : count;
+}
 
-    // destroy the node's path!
+int check_node(int x, int y, int z, MapData *map, int destroy)
+{
+    init_fill();
+    int count = fill_node(x, y, z, map, destroy);
+    clear_runs(grounded, grounded_runs, 0);
+    return count;
+}
 
-    if (destroy)
+// removes the solid voxels of `points` (x, y, z triples) below the ground
+// layer, then everything that no longer is connected to the ground.
+// Returns the number of voxels removed. If `removed` is given, it is set to
+// 1 for every point that was removed and 0 otherwise.
+int destroy_points(const int *points, int count, MapData *map, char *removed)
+{
+    init_fill();
+    std::vector<char> removed_buffer;
+    if (removed == NULL)
+    {
+        removed_buffer.resize(count);
+        removed = &removed_buffer[0];
+    }
+    int total = 0;
+    for (int i = 0; i < count; i++)
     {
-        for (set_type<int>::const_iterator iter = marked.begin();
-             iter != marked.end(); ++iter)
+        int x = points[i * 3];
+        int y = points[i * 3 + 1];
+        int z = points[i * 3 + 2];
+        removed[i] = is_valid_position(x, y, z) && z < 62 &&
+                     get_solid_unchecked(x, y, z, map);
+        if (removed[i])
         {
-            map->geometry[*iter] = 0;
-            map->colors.erase(*iter);
+            set_point(x, y, z, map, 0, 0);
+            total++;
         }
     }
-
-    int ret = (int)marked.size();
-    marked.clear();
-    return ret;
+    // the fills share what they learn about grounded voxels, as removing
+    // floating voxels can't disconnect anything else from the ground
+    for (int i = 0; i < count; i++)
+    {
+        if (!removed[i])
+            continue;
+        int x = points[i * 3];
+        int y = points[i * 3 + 1];
+        int z = points[i * 3 + 2];
+        total += fill_node(x, y, z - 1, map, 1);
+        total += fill_node(x, y - 1, z, map, 1);
+        total += fill_node(x, y + 1, z, map, 1);
+        total += fill_node(x - 1, y, z, map, 1);
+        total += fill_node(x + 1, y, z, map, 1);
+        total += fill_node(x, y, z + 1, map, 1);
+    }
+    clear_runs(grounded, grounded_runs, 0);
+    return total;
 }
 
 // write_map/save_vxl function from stb/nothings - thanks a lot for the
@@ -204,32 +435,31 @@ int check_node(int x, int y, int z, MapData *map, int destroy)
 
 inline int is_surface(MapData *map, int x, int y, int z)
 {
-    if (map->geometry[get_pos(x, y, z)] == 0)
+    if (get_solid_unchecked(x, y, z, map) == 0)
         return 0;
     if (z == 0)
         return 1;
-    if (x > 0 && map->geometry[get_pos(x - 1, y, z)] == 0)
+    if (x > 0 && get_solid_unchecked(x - 1, y, z, map) == 0)
         return 1;
-    if (x + 1 < 512 && map->geometry[get_pos(x + 1, y, z)] == 0)
+    if (x + 1 < 512 && get_solid_unchecked(x + 1, y, z, map) == 0)
         return 1;
-    if (y > 0 && map->geometry[get_pos(x, y - 1, z)] == 0)
+    if (y > 0 && get_solid_unchecked(x, y - 1, z, map) == 0)
         return 1;
-    if (y + 1 < 512 && map->geometry[get_pos(x, y + 1, z)] == 0)
+    if (y + 1 < 512 && get_solid_unchecked(x, y + 1, z, map) == 0)
         return 1;
-    if (z > 0 && map->geometry[get_pos(x, y, z - 1)] == 0)
+    if (z > 0 && get_solid_unchecked(x, y, z - 1, map) == 0)
         return 1;
-    if (z + 1 < 64 && map->geometry[get_pos(x, y, z + 1)] == 0)
+    if (z + 1 < 64 && get_solid_unchecked(x, y, z + 1, map) == 0)
         return 1;
     return 0;
 }
 
 inline int get_write_color(MapData *map, int x, int y, int z)
 {
-    map_type<int, int>::const_iterator iter = map->colors.find(
-        get_pos(x, y, z));
-    if (iter == map->colors.end())
+    int *color = get_chunk(x, y, map)->find_color(get_column_index(x, y), z);
+    if (color == NULL)
         return DEFAULT_COLOR;
-    return iter->second;
+    return *color;
 }
 
 inline void write_color(char **pos, int color)
@@ -245,19 +475,23 @@ inline void write_color(char **pos, int color)
     *pos += 4;
 }
 
+#define VXL_BUFFER_SIZE (10 * 1024 * 1024)
+
 char *out_global = 0;
 
 void create_temp()
 {
     if (out_global == 0)
-        out_global = (char *)malloc(10 * 1024 * 1024); // allocate 10 mb
+        out_global = (char *)malloc(VXL_BUFFER_SIZE); // allocate 10 mb
 }
 
-PyObject *save_vxl(MapData *map)
+// writes the map in VXL format to out, which must hold VXL_BUFFER_SIZE
+// bytes, and returns the number of bytes written. Doesn't touch any Python
+// objects, so it can run without the GIL.
+size_t write_vxl(MapData *map, char *out_start)
 {
     int i, j, k;
-    create_temp();
-    char *out = out_global;
+    char *out = out_start;
 
     for (j = 0; j < MAP_Y; ++j)
     {
@@ -278,7 +512,7 @@ PyObject *save_vxl(MapData *map)
                 int colors;
                 // find the air region
                 air_start = k;
-                while (k < MAP_Z && !map->geometry[get_pos(i, j, k)])
+                while (k < MAP_Z && !get_solid_unchecked(i, j, k, map))
                     ++k;
                 // find the top region
                 top_colors_start = k;
@@ -287,7 +521,7 @@ PyObject *save_vxl(MapData *map)
                 top_colors_end = k;
 
                 // now skip past the solid voxels
-                while (k < MAP_Z && map->geometry[get_pos(i, j, k)] &&
+                while (k < MAP_Z && get_solid_unchecked(i, j, k, map) &&
                        !is_surface(map, i, j, k))
                     ++k;
 
@@ -349,9 +583,17 @@ PyObject *save_vxl(MapData *map)
             }
         }
     }
-    return PyBytes_FromStringAndSize((char *)out_global, out - out_global);
+    return out - out_start;
+}
+
+PyObject *save_vxl(MapData *map)
+{
+    create_temp();
+    size_t size = write_vxl(map, out_global);
+    return PyBytes_FromStringAndSize((char *)out_global, size);
 }
 
+// cheap, the chunks are only copied when one of the maps writes to them
 inline MapData *copy_map(MapData *map)
 {
     return new MapData(*map);
@@ -382,7 +624,7 @@ inline void get_random_point(int x1, int y1, int x2, int y2, MapData *map,
     {
         for (y = y1; y < y2; y++)
         {
-            if (map->geometry[get_pos(x, y, 62)])
+            if (get_solid_unchecked(x, y, 62, map))
             {
                 Point2D item;
                 item.x = x;
@@ -424,14 +666,127 @@ int sunblock(MapData *map, int x, int y, int z)
 
 void update_shadows(MapData *map)
 {
-    int x, y, z;
-    for (map_type<int, int>::iterator iter = map->colors.begin();
-         iter != map->colors.end(); ++iter)
+    for (int i = 0; i < CHUNK_COUNT; i++)
+    {
+        int base_x = (i % CHUNKS_X) * CHUNK_SIZE;
+        int base_y = (i / CHUNKS_X) * CHUNK_SIZE;
+        MapChunk *chunk = get_writable_chunk(base_x, base_y, map);
+        int *color = chunk->colors.data();
+        for (int column = 0; column < CHUNK_COLUMNS; column++)
+        {
+            int x = base_x + column % CHUNK_SIZE;
+            int y = base_y + column / CHUNK_SIZE;
+            uint64_t mask = chunk->color_masks[column];
+            for (int z = 0; mask != 0; z++, mask >>= 1)
+            {
+                if (!(mask & 1))
+                    continue;
+                int a = sunblock(map, x, y, z);
+                *color = (*color & 0x00FFFFFF) | (a << 24);
+                color++;
+            }
+        }
+    }
+}
+
+// the solid voxels of the column that are not on the surface, i.e. that are
+// only next to solid voxels. Voxels beside the map count as open, as in
+// VXLData.is_surface, which rollbacks used to check the surface with. This
+// differs from is_surface above, which decides the colors saved to VXL
+// files, so voxels on the edges of the map are rebuilt with their colors.
+static uint64_t get_interior(int x, int y, MapData *map)
+{
+    uint64_t column = get_column(x, y, map);
+    uint64_t interior = column & (column << 1) & (column >> 1);
+    interior &= x > 0 ? get_column(x - 1, y, map) : 0;
+    interior &= x < MAP_X - 1 ? get_column(x + 1, y, map) : 0;
+    interior &= y > 0 ? get_column(x, y - 1, map) : 0;
+    interior &= y < MAP_Y - 1 ? get_column(x, y + 1, map) : 0;
+    return interior;
+}
+
+// Collects the edits that turn the columns from (x1, y1) to (x2, y2),
+// exclusive, of `map` into those of `other`, column by column, ordered by x,
+// then y, then z:
+//
+// * `removals`: x, y, z of the voxels to remove, either because they are
+//   open in `other` or because they are on its surface with another color
+// * `fills`: x, y, z of the voxels to build that are not on the surface of
+//   `other`, so their color doesn't matter
+// * `surface`: x, y, z and color of the voxels to build with the color they
+//   have in `other`
+//
+// The bottom layer (z = 63) is left out, as it can't be changed in game.
+// Columns in chunks both maps share are skipped, unless a neighbouring
+// column changed their surface.
+void diff_map(MapData *map, MapData *other, int x1, int y1, int x2, int y2,
+              std::vector<int> &removals, std::vector<int> &fills,
+              std::vector<int> &surface)
+{
+    const uint64_t layers = ~0ULL >> 1;
+    limit(&x1, 0, MAP_X);
+    limit(&x2, 0, MAP_X);
+    limit(&y1, 0, MAP_Y);
+    limit(&y2, 0, MAP_Y);
+    for (int x = x1; x < x2; x++)
     {
-        get_xyz(iter->first, &x, &y, &z);
-        unsigned int color = iter->second;
-        int a = sunblock(map, x, y, z);
-        iter->second = (color & 0x00FFFFFF) | (a << 24);
+        for (int y = y1; y < y2; y++)
+        {
+            uint64_t old_interior = get_interior(x, y, map);
+            uint64_t new_interior = get_interior(x, y, other);
+            if (is_chunk_shared(map, other, get_chunk_index(x, y)) &&
+                old_interior == new_interior)
+                continue;
+            uint64_t old_column = get_column(x, y, map) & layers;
+            uint64_t new_column = get_column(x, y, other) & layers;
+            uint64_t new_surface = new_column & ~new_interior;
+            uint64_t removed = old_column & ~new_column;
+            uint64_t filled = new_column & ~old_column & new_interior;
+            uint64_t built = new_surface & ~old_column;
+            // surface voxels that stay solid are rebuilt if they were inside
+            // or had another color
+            uint64_t kept = new_surface & old_column;
+            MapChunk *old_chunk = get_chunk(x, y, map);
+            MapChunk *new_chunk = get_chunk(x, y, other);
+            int column = get_column_index(x, y);
+            for (; kept; kept &= kept - 1)
+            {
+                int z = lowest_bit(kept);
+                uint64_t bit = 1ULL << z;
+                if (!(old_interior & bit))
+                {
+                    int *old_color = old_chunk->find_color(column, z);
+                    int *new_color = new_chunk->find_color(column, z);
+                    int a = old_color == NULL ? 0 : *old_color;
+                    int b = new_color == NULL ? 0 : *new_color;
+                    if (!((a ^ b) & 0xFFFFFF))
+                        continue;
+                }
+                removed |= bit;
+                built |= bit;
+            }
+            for (; removed; removed &= removed - 1)
+            {
+                removals.push_back(x);
+                removals.push_back(y);
+                removals.push_back(lowest_bit(removed));
+            }
+            for (; filled; filled &= filled - 1)
+            {
+                fills.push_back(x);
+                fills.push_back(y);
+                fills.push_back(lowest_bit(filled));
+            }
+            for (; built; built &= built - 1)
+            {
+                int z = lowest_bit(built);
+                int *color = new_chunk->find_color(column, z);
+                surface.push_back(x);
+                surface.push_back(y);
+                surface.push_back(z);
+                surface.push_back(color == NULL ? 0 : *color & 0xFFFFFF);
+            }
+        }
     }
 }
 
@@ -477,7 +832,7 @@ PyObject *get_generator_data(MapGenerator *generator, int columns)
             {
                 // find the air region
                 int air_start = k;
-                while (k < MAP_Z && !map->geometry[get_pos(i, j, k)])
+                while (k < MAP_Z && !get_solid_unchecked(i, j, k, map))
                     ++k;
                 // find the top region
                 int top_colors_start = k;
@@ -486,7 +841,7 @@ PyObject *get_generator_data(MapGenerator *generator, int columns)
                 int top_colors_end = k; // exlusive
 
                 // now skip past the solid voxels
-                while (k < MAP_Z && map->geometry[get_pos(i, j, k)] &&
+                while (k < MAP_Z && get_solid_unchecked(i, j, k, map) &&
                        !is_surface(map, i, j, k))
                     ++k;
 
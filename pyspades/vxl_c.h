@@ -1,9 +1,11 @@
 #ifndef VXL_C_H
 #define VXL_C_H
 
-#include <bitset>
+#include <stdint.h>
+#include <string.h>
 #include <unordered_map>
 #include <unordered_set>
+#include <vector>
 
 #define map_type std::unordered_map
 #define set_type std::unordered_set
@@ -14,13 +16,245 @@
 #define get_pos(x, y, z) ((x) + (y)*MAP_Y + (z)*MAP_X * MAP_Y)
 #define DEFAULT_COLOR 0xFF674028
 
+// the map is stored in square chunks of CHUNK_SIZE * CHUNK_SIZE columns
+#define CHUNK_SIZE 16
+#define CHUNK_COLUMNS (CHUNK_SIZE * CHUNK_SIZE)
+#define CHUNKS_X (MAP_X / CHUNK_SIZE)
+#define CHUNKS_Y (MAP_Y / CHUNK_SIZE)
+#define CHUNK_COUNT (CHUNKS_X * CHUNKS_Y)
+#define get_chunk_index(x, y) ((x) / CHUNK_SIZE + ((y) / CHUNK_SIZE) * CHUNKS_X)
+#define get_column_index(x, y) \
+    ((x) % CHUNK_SIZE + ((y) % CHUNK_SIZE) * CHUNK_SIZE)
+
+int inline popcount64(uint64_t value)
+{
+#if defined(__GNUC__) || defined(__clang__)
+    return __builtin_popcountll(value);
+#else
+    value = value - ((value >> 1) & 0x5555555555555555ULL);
+    value = (value & 0x3333333333333333ULL) +
+            ((value >> 2) & 0x3333333333333333ULL);
+    value = (value + (value >> 4)) & 0x0F0F0F0F0F0F0F0FULL;
+    return (int)((value * 0x0101010101010101ULL) >> 56);
+#endif
+}
+
+int inline lowest_bit(uint64_t value)
+{
+#if defined(__GNUC__) || defined(__clang__)
+    return __builtin_ctzll(value);
+#else
+    int z = 0;
+    while (!((value >> z) & 1))
+        z++;
+    return z;
+#endif
+}
+
+int inline highest_bit(uint64_t value)
+{
+#if defined(__GNUC__) || defined(__clang__)
+    return 63 - __builtin_clzll(value);
+#else
+    int z = 63;
+    while (!((value >> z) & 1))
+        z--;
+    return z;
+#endif
+}
+
+// One chunk of the map. For every column, bit z of `geometry` is set if the
+// voxel at height z is solid, and bit z of `color_masks` is set if it has a
+// color. All colors of the chunk are packed into one array, ordered by column
+// and then by z, and `starts` holds the index of the first color of each
+// column. This costs 4 bytes per colored voxel instead of a hash node per
+// voxel, and keeps the colors of a column next to each other.
+//
+// Chunks are shared between a map and its copies and are only cloned when
+// one of them writes to the chunk (copy-on-write). `refs` counts the maps
+// using the chunk; it is only touched while holding the GIL.
+struct MapChunk
+{
+    int refs;
+    uint64_t geometry[CHUNK_COLUMNS];
+    uint64_t color_masks[CHUNK_COLUMNS];
+    uint16_t starts[CHUNK_COLUMNS + 1];
+    std::vector<int> colors;
+
+    MapChunk() : refs(1)
+    {
+        memset(geometry, 0, sizeof(geometry));
+        memset(color_masks, 0, sizeof(color_masks));
+        memset(starts, 0, sizeof(starts));
+    }
+
+    MapChunk(const MapChunk &other) : refs(1), colors(other.colors)
+    {
+        memcpy(geometry, other.geometry, sizeof(geometry));
+        memcpy(color_masks, other.color_masks, sizeof(color_masks));
+        memcpy(starts, other.starts, sizeof(starts));
+    }
+
+    int inline get_index(int column, int z)
+    {
+        uint64_t below = color_masks[column] & ((1ULL << z) - 1);
+        return starts[column] + popcount64(below);
+    }
+
+    // returns a pointer to the stored color, or NULL if there is none
+    int inline *find_color(int column, int z)
+    {
+        if (!((color_masks[column] >> z) & 1))
+            return NULL;
+        return &colors[get_index(column, z)];
+    }
+
+    void inline set_color(int column, int z, int color)
+    {
+        int index = get_index(column, z);
+        uint64_t bit = 1ULL << z;
+        if (color_masks[column] & bit)
+        {
+            colors[index] = color;
+            return;
+        }
+        color_masks[column] |= bit;
+        colors.insert(colors.begin() + index, color);
+        for (int i = column + 1; i <= CHUNK_COLUMNS; i++)
+            starts[i]++;
+    }
+
+    void inline erase_color(int column, int z)
+    {
+        uint64_t bit = 1ULL << z;
+        if (!(color_masks[column] & bit))
+            return;
+        int index = get_index(column, z);
+        color_masks[column] &= ~bit;
+        colors.erase(colors.begin() + index);
+        for (int i = column + 1; i <= CHUNK_COLUMNS; i++)
+            starts[i]--;
+    }
+
+    // erases the colors of all voxels of the column in `mask` at once
+    void erase_colors(int column, uint64_t mask)
+    {
+        uint64_t bits = color_masks[column];
+        mask &= bits;
+        if (!mask)
+            return;
+        int in = starts[column];
+        int out = in;
+        for (; bits; bits &= bits - 1, in++)
+        {
+            if (!(mask & bits & -bits))
+                colors[out++] = colors[in];
+        }
+        colors.erase(colors.begin() + out, colors.begin() + in);
+        color_masks[column] &= ~mask;
+        int removed = in - out;
+        for (int i = column + 1; i <= CHUNK_COLUMNS; i++)
+            starts[i] -= removed;
+    }
+
+private:
+    MapChunk &operator=(const MapChunk &);
+};
+
+void inline release_chunk(MapChunk *chunk)
+{
+    if (--chunk->refs == 0)
+        delete chunk;
+}
+
 struct MapData
 {
-    std::bitset<MAP_X * MAP_Y * MAP_Z> geometry;
-    // char geometry[MAP_X * MAP_Y * MAP_Z];
-    map_type<int, int> colors;
+    MapChunk *chunks[CHUNK_COUNT];
+    // bumped on every write, so readers can tell if the map changed
+    unsigned int generation;
+
+    MapData() : generation(0)
+    {
+        for (int i = 0; i < CHUNK_COUNT; i++)
+            chunks[i] = new MapChunk;
+    }
+
+    // copying a map only shares the chunks, the actual copy is deferred
+    // until either map writes to a chunk
+    MapData(const MapData &other) : generation(other.generation)
+    {
+        for (int i = 0; i < CHUNK_COUNT; i++)
+        {
+            chunks[i] = other.chunks[i];
+            chunks[i]->refs++;
+        }
+    }
+
+    ~MapData()
+    {
+        for (int i = 0; i < CHUNK_COUNT; i++)
+            release_chunk(chunks[i]);
+    }
+
+private:
+    MapData &operator=(const MapData &);
 };
 
+MapChunk inline *get_chunk(int x, int y, MapData *map)
+{
+    return map->chunks[get_chunk_index(x, y)];
+}
+
+// returns a chunk that is safe to modify, cloning it first if it is shared
+MapChunk inline *get_writable_chunk(int x, int y, MapData *map)
+{
+    MapChunk *&chunk = map->chunks[get_chunk_index(x, y)];
+    if (chunk->refs > 1)
+    {
+        MapChunk *copy = new MapChunk(*chunk);
+        release_chunk(chunk);
+        chunk = copy;
+    }
+    map->generation++;
+    return chunk;
+}
+
+uint64_t inline get_column(int x, int y, MapData *map)
+{
+    return get_chunk(x, y, map)->geometry[get_column_index(x, y)];
+}
+
+// the first solid z at or below `start`, i.e. the top of the terrain when
+// start is 0, or -1 if there is none
+int inline get_top_z(int x, int y, int start, MapData *map)
+{
+    if (start < 0)
+        start = 0;
+    else if (start >= MAP_Z)
+        return -1;
+    uint64_t column = get_column(x, y, map) & (~0ULL << start);
+    if (!column)
+        return -1;
+    return lowest_bit(column);
+}
+
+// the z where the solid run that reaches down to the bottom of the map
+// starts, or 0 if the column is solid all the way
+int inline get_ground_height(int x, int y, MapData *map)
+{
+    uint64_t open = ~get_column(x, y, map);
+    if (!open)
+        return 0;
+    return highest_bit(open) + 1;
+}
+
+// whether both maps still share the chunk at index, i.e. neither of them
+// changed it since one was copied from the other
+int inline is_chunk_shared(MapData *map, MapData *other, int index)
+{
+    return map->chunks[index] == other->chunks[index];
+}
+
 void inline get_xyz(int pos, int *x, int *y, int *z)
 {
     *x = pos % MAP_Y;
@@ -33,11 +267,17 @@ int inline is_valid_position(int x, int y, int z)
     return x >= 0 && x < 512 && y >= 0 && y < 512 && z >= 0 && z < 64;
 }
 
+// get_solid without the bounds check, for callers that already did it
+int inline get_solid_unchecked(int x, int y, int z, MapData *map)
+{
+    return (get_column(x, y, map) >> z) & 1;
+}
+
 int inline get_solid(int x, int y, int z, MapData *map)
 {
     if (!is_valid_position(x, y, z))
         return 0;
-    return map->geometry[get_pos(x, y, z)];
+    return get_solid_unchecked(x, y, z, map);
 }
 
 int inline get_solid_wrap(int x, int y, int z, MapData *map)
@@ -46,61 +286,53 @@ int inline get_solid_wrap(int x, int y, int z, MapData *map)
         return 0;
     else if (z >= 64)
         return 1;
-    return map->geometry[get_pos(x & 511, y & 511, z)];
+    return get_solid_unchecked(x & 511, y & 511, z, map);
 }
 
 int inline get_color(int x, int y, int z, MapData *map)
 {
-    map_type<int, int>::const_iterator iter = map->colors.find(
-        get_pos(x, y, z));
-    if (iter == map->colors.end())
+    int *color = get_chunk(x, y, map)->find_color(get_column_index(x, y), z);
+    if (color == NULL)
         return 0;
-    return iter->second;
+    return *color;
 }
 
 void inline set_point(int x, int y, int z, MapData *map, bool solid, int color)
 {
-    int i = get_pos(x, y, z);
-    map->geometry[i] = solid;
+    MapChunk *chunk = get_writable_chunk(x, y, map);
+    int column = get_column_index(x, y);
     if (!solid)
-        map->colors.erase(i);
+    {
+        chunk->geometry[column] &= ~(1ULL << z);
+        chunk->erase_color(column, z);
+    }
     else
-        map->colors[i] = color;
+    {
+        chunk->geometry[column] |= 1ULL << z;
+        chunk->set_color(column, z, color);
+    }
 }
 
 void inline set_column_solid(int x, int y, int z_start, int z_end,
                              MapData *map, bool solid)
 {
-    int i = get_pos(x, y, z_start);
-    int i_end = get_pos(x, y, z_end);
-    if (!solid)
-    {
-        while (i <= i_end)
-        {
-            map->geometry[i] = solid;
-            i += MAP_X * MAP_Y;
-        }
-    }
+    if (z_end < z_start)
+        return;
+    MapChunk *chunk = get_writable_chunk(x, y, map);
+    uint64_t bits = (~0ULL >> (63 - z_end + z_start)) << z_start;
+    if (solid)
+        chunk->geometry[get_column_index(x, y)] |= bits;
     else
-    {
-        while (i <= i_end)
-        {
-            map->geometry[i] = solid;
-            i += MAP_X * MAP_Y;
-        }
-    }
+        chunk->geometry[get_column_index(x, y)] &= ~bits;
 }
 
 void inline set_column_color(int x, int y, int z_start, int z_end,
                              MapData *map, int color)
 {
-    int i = get_pos(x, y, z_start);
-    int i_end = get_pos(x, y, z_end);
-    while (i <= i_end)
-    {
-        map->colors[i] = color;
-        i += MAP_X * MAP_Y;
-    }
+    MapChunk *chunk = get_writable_chunk(x, y, map);
+    int column = get_column_index(x, y);
+    for (int z = z_start; z <= z_end; z++)
+        chunk->set_color(column, z, color);
 }
 
 #endif /* VXL_C_H */
@@ -18,8 +18,11 @@
 import math
 import time
 from pyspades.vxl cimport VXLData, MapData
+from pyspades.bytes cimport ByteWriter
 from pyspades.common cimport Vertex3, create_proxy_vector
-from libc.math cimport sqrt, sin, cos, acos, fabs
+from libc.math cimport sqrt, sin, cos, acos, fabs, floor
+from cpython cimport array
+import array
 from pyspades.constants import TORSO, HEAD, ARMS, LEGS, MELEE
 
 cdef extern from "common_c.h":
@@ -39,6 +42,11 @@ cdef extern from "world_c.cpp":
         float x1, float y1, float z1)
     int c_cast_ray "cast_ray" (MapData * map, float x0, float y0, float z0,
         float x1, float y1, float z1, float length, long* x, long* y, long* z)
+    void c_can_see_many "can_see_many" (MapData * map, float x0, float y0,
+        float z0, const float * targets, size_t count,
+        unsigned char * out) nogil
+    void c_cast_rays "cast_rays" (MapData * map, const float * rays,
+        size_t count, float length, unsigned char * hits, int * points) nogil
     size_t cube_line_c "cube_line"(int, int, int, int, int, int, LongVector *)
     void set_globals(MapData * map, float total_time, float dt)
     struct PlayerType:
@@ -70,6 +78,20 @@ cdef inline bint cast_ray(VXLData map, float x1, float y1, float z1,
     float x2, float y2, float z2, float length, long* x, long* y, long* z):
     return c_cast_ray(map.map, x1, y1, z1, x2, y2, z2, length, x, y, z)
 
+# the characters in World.characters are kept in a grid of cells of
+# GRID_CELL_SIZE x GRID_CELL_SIZE blocks over the map, for proximity queries
+DEF GRID_CELL_SIZE = 16
+DEF GRID_CELLS = 512 // GRID_CELL_SIZE
+
+cdef inline int get_grid_cell(float value):
+    # positions outside the map go to the edge cells, so queries still find
+    # them
+    if not value >= 0:
+        return 0
+    if value >= 512:
+        return GRID_CELLS - 1
+    return <int>(value / GRID_CELL_SIZE)
+
 cdef class Object
 cdef class World
 cdef class Grenade
@@ -110,10 +132,20 @@ cdef class Character(Object):
     cdef public:
         Vertex3 position, orientation, velocity
         object fall_callback
+        # the slot of this character in World.characters, or -1
+        int player_id
+        # if set, world updates send zeros instead of this character's
+        # position and orientation
+        bint hidden
+    cdef:
+        # the index of the grid cell this character is in, or -1
+        int grid_cell
 
     def initialize(self, Vertex3 position, Vertex3 orientation,
                    fall_callback = None):
         self.name = 'character'
+        self.player_id = -1
+        self.grid_cell = -1
         self.player = create_player()
         self.fall_callback = fall_callback
         self.position = create_proxy_vector(&self.player.p)
@@ -160,6 +192,8 @@ cdef class Character(Object):
         self.player.p.x = self.player.e.x = x
         self.player.p.y = self.player.e.y = y
         self.player.p.z = self.player.e.z = z
+        if self.grid_cell >= 0:
+            self.world.update_grid_cell(self)
         if reset:
             self.velocity.set(0.0, 0.0, 0.0)
             self.primary_fire = self.secondary_fire = False
@@ -190,6 +224,13 @@ cdef class Character(Object):
             return x, y, z
         return None
 
+    def can_see_many(self, targets):
+        """return if the player can see each of the ``targets``, a buffer of
+        x, y, z floats, like `can_see_many`"""
+        cdef Vertex3 position = self.position
+        return can_see_many(self.world.map, position.x, position.y,
+                            position.z, targets)
+
     def validate_hit(self, Character other, part, float aim_tolerance, float dist_tolerance):
         """check if a given hit is within a given tolerance of hitting another
         player. This is primarily used to prevent players from shooting at
@@ -233,6 +274,10 @@ cdef class Character(Object):
 
     cdef int update(self, double dt) except -1:
         cdef long ret = move_player(self.player)
+        # refresh the cell now, as objects updated after this one, like
+        # exploding grenades, may look for characters near them
+        if self.grid_cell >= 0:
+            self.world.update_grid_cell(self)
         if ret > 0:
             self.fall_callback(ret)
         return 0
@@ -404,9 +449,16 @@ cdef class World(object):
         VXLData map
         list objects
         float time
+        # the Character of each player, indexed by player id, or None
+        list characters
+    cdef:
+        # the characters in each grid cell, by cell index
+        list grid
 
     def __init__(self):
         self.objects = []
+        self.characters = []
+        self.grid = [[] for _ in range(GRID_CELLS * GRID_CELLS)]
         self.time = 0
 
     def update(self, double dt):
@@ -417,17 +469,167 @@ cdef class World(object):
         cdef Object instance
         for instance in self.objects[:]:
             instance.update(dt)
+        # characters may also have been moved through their position
+        # vectors
+        cdef object character
+        for character in self.characters:
+            if character is not None:
+                self.update_grid_cell(character)
+
+    cdef update_grid_cell(self, Character character):
+        """move character to the grid cell of its current position"""
+        cdef int cell = (get_grid_cell(character.player.p.x) +
+                         get_grid_cell(character.player.p.y) * GRID_CELLS)
+        if cell == character.grid_cell:
+            return
+        self.remove_from_grid(character)
+        self.grid[cell].append(character)
+        character.grid_cell = cell
+
+    cdef remove_from_grid(self, Character character):
+        if character.grid_cell >= 0:
+            self.grid[character.grid_cell].remove(character)
+            character.grid_cell = -1
+
+    cpdef list get_characters_in_box(self, float x1, float y1, float z1,
+                                     float x2, float y2, float z2):
+        """return the characters of the players whose position is within the
+        box from (x1, y1, z1) to (x2, y2, z2), inclusive, ordered by player
+        id. Positions are updated as characters move in world updates and by
+        `Character.set_position`"""
+        cdef int cell_x, cell_y
+        cdef Character character
+        cdef Vector * p
+        cdef list found = []
+        for cell_y in range(get_grid_cell(y1), get_grid_cell(y2) + 1):
+            for cell_x in range(get_grid_cell(x1), get_grid_cell(x2) + 1):
+                for character in self.grid[cell_x + cell_y * GRID_CELLS]:
+                    p = &character.player.p
+                    if (x1 <= p.x <= x2 and y1 <= p.y <= y2 and
+                            z1 <= p.z <= z2):
+                        found.append(character)
+        found.sort(key=get_player_id)
+        return found
+
+    cpdef list get_characters_in_radius(self, float x, float y, float z,
+                                        float radius):
+        """return the characters of the players within radius of
+        (x, y, z), ordered by player id"""
+        cdef Character character
+        cdef Vector * p
+        cdef float radius_squared = radius * radius
+        cdef list found = []
+        for character in self.get_characters_in_box(
+                x - radius, y - radius, z - radius,
+                x + radius, y + radius, z + radius):
+            p = &character.player.p
+            if ((p.x - x) ** 2 + (p.y - y) ** 2 +
+                    (p.z - z) ** 2 <= radius_squared):
+                found.append(character)
+        return found
 
     cpdef delete_object(self, Object item):
         self.objects.remove(item)
+        if isinstance(item, Character):
+            self.set_character((<Character>item).player_id, None)
+
+    cpdef set_character(self, int player_id, Character character):
+        """set the Character that is sent in world updates for the player
+        with the given id. Pass None to clear the slot"""
+        if player_id < 0:
+            return
+        cdef Character old
+        if player_id < len(self.characters):
+            old = self.characters[player_id]
+            if old is not None:
+                old.player_id = -1
+                self.remove_from_grid(old)
+        else:
+            self.characters.extend([None] * (player_id + 1 -
+                                             len(self.characters)))
+        self.characters[player_id] = character
+        if character is not None:
+            if character.player_id >= 0:
+                self.characters[character.player_id] = None
+            character.player_id = player_id
+            self.update_grid_cell(character)
+
+    cpdef write_world_update(self, ByteWriter writer, int count):
+        """write the positions and orientations of the first count player
+        slots in the WorldUpdate format. Empty slots and hidden characters
+        are written as zeros"""
+        cdef int i, size = len(self.characters)
+        cdef object item
+        cdef PlayerType * player
+        for i in range(count):
+            item = self.characters[i] if i < size else None
+            if item is None or (<Character>item).hidden:
+                writer.pad(24)
+                continue
+            player = (<Character>item).player
+            writer.writeFloat(player.p.x, False)
+            writer.writeFloat(player.p.y, False)
+            writer.writeFloat(player.p.z, False)
+            writer.writeFloat(player.f.x, False)
+            writer.writeFloat(player.f.y, False)
+            writer.writeFloat(player.f.z, False)
 
     def create_object(self, klass, *arg, **kw):
         new_object = klass(self, *arg, **kw)
         self.objects.append(new_object)
         return new_object
 
+def get_player_id(Character character):
+    return character.player_id
+
 # utility functions
 
+def can_see_many(VXLData map, float x, float y, float z,
+                 const float[::1] targets):
+    """check the line of sight from (x, y, z) to many points at once.
+
+    ``targets`` is a contiguous buffer of floats, e.g. an ``array('f')``, with
+    the x, y, z of every point one after another. Returns an ``array('B')``
+    with 1 for every point that can be seen and 0 otherwise. The rays are
+    traced without the GIL."""
+    cdef size_t count
+    cdef array.array result
+    if targets.shape[0] % 3 != 0:
+        raise ValueError('targets must hold x, y, z for every point')
+    count = targets.shape[0] // 3
+    result = array.clone(array.array('B'), count, zero=False)
+    if count == 0:
+        return result
+    with nogil:
+        c_can_see_many(map.map, x, y, z, &targets[0], count,
+                       result.data.as_uchars)
+    return result
+
+def cast_rays(VXLData map, const float[::1] rays, float length=32.0):
+    """cast many rays of ``length`` blocks at once, like
+    `Character.cast_ray`.
+
+    ``rays`` is a contiguous buffer of floats, e.g. an ``array('f')``, with
+    the origin x, y, z and the direction x, y, z of every ray one after
+    another. The directions don't need to be normalized. Returns
+    ``(hits, points)``, an ``array('B')`` with 1 for every ray that hit a
+    voxel and an ``array('i')`` with the x, y, z of the hit voxels, 0 for the
+    rays that hit nothing. The rays are traced without the GIL."""
+    cdef size_t count
+    cdef array.array hits, points
+    if rays.shape[0] % 6 != 0:
+        raise ValueError('rays must hold an origin and a direction for '
+                         'every ray')
+    count = rays.shape[0] // 6
+    hits = array.clone(array.array('B'), count, zero=False)
+    points = array.clone(array.array('i'), count * 3, zero=False)
+    if count == 0:
+        return hits, points
+    with nogil:
+        c_cast_rays(map.map, &rays[0], count, length, hits.data.as_uchars,
+                    points.data.as_ints)
+    return hits, points
+
 cpdef cube_line(x1, y1, z1, x2, y2, z2):
     """create a cube line from one point to another with the same algorithm as
     the client uses"""
@@ -144,13 +144,13 @@ int clipbox(float x, float y, float z)
 }
 
 //same as isvoxelsolid() but with wrapping
-long isvoxelsolidwrap(long x, long y, long z)
+long isvoxelsolidwrap(MapData *map, long x, long y, long z)
 {
     if (z < 0)
         return 0;
     else if (z >= 64)
         return 1;
-    return get_solid((int)x & VXL_MAX_SIZEM, (int)y & VSIDM, z, global_map);
+    return get_solid((int)x & VXL_MAX_SIZEM, (int)y & VSIDM, z, map);
 }
 
 //same as isvoxelsolid but water is empty
@@ -265,7 +265,7 @@ long can_see(MapData *map, float x0, float y0, float z0, float x1, float y1,
             p.z += i.x;
         }
 
-        if (isvoxelsolidwrap(a.x, a.y, a.z))
+        if (isvoxelsolidwrap(map, a.x, a.y, a.z))
             return 0;
         cnt--;
     }
@@ -371,7 +371,7 @@ long cast_ray(MapData *map, float x0, float y0, float z0, float x1, float y1,
             p.z += i.x;
         }
 
-        if (isvoxelsolidwrap(a.x, a.y, a.z))
+        if (isvoxelsolidwrap(map, a.x, a.y, a.z))
         {
             *x = a.x;
             *y = a.y;
@@ -383,6 +383,38 @@ long cast_ray(MapData *map, float x0, float y0, float z0, float x1, float y1,
     return 0;
 }
 
+// can_see from (x0, y0, z0) to each of the `count` points in `targets`,
+// given as x, y, z floats, writing the results to `out`
+void can_see_many(MapData *map, float x0, float y0, float z0,
+                  const float *targets, size_t count, unsigned char *out)
+{
+    for (size_t n = 0; n < count; n++, targets += 3)
+        out[n] = can_see(map, x0, y0, z0, targets[0], targets[1], targets[2]);
+}
+
+// cast_ray for each of the `count` rays in `rays`, given as the origin and
+// the direction, 6 floats per ray. The directions are normalized. Writes if
+// a voxel was hit to `hits` and its coordinates to `points`, 3 per ray.
+void cast_rays(MapData *map, const float *rays, size_t count, float length,
+               unsigned char *hits, int *points)
+{
+    for (size_t n = 0; n < count; n++, rays += 6, points += 3)
+    {
+        float dx = rays[3], dy = rays[4], dz = rays[5];
+        float size = sqrtf(dx * dx + dy * dy + dz * dz);
+        long x = 0, y = 0, z = 0;
+        hits[n] = 0;
+        if (size > 0.0f)
+        {
+            hits[n] = cast_ray(map, rays[0], rays[1], rays[2], dx / size,
+                               dy / size, dz / size, length, &x, &y, &z);
+        }
+        points[0] = x;
+        points[1] = y;
+        points[2] = z;
+    }
+}
+
 size_t cube_line(int x1, int y1, int z1, int x2, int y2, int z2,
                  LongVector *cube_array)
 {
@@ -0,0 +1,252 @@
+#!/usr/bin/python3
+"""
+usage: loadtest.py [-h] [--host HOST] [--port PORT] [--bots BOTS]
+                   [--duration DURATION] [--connect-rate CONNECT_RATE]
+                   [--move-rate MOVE_RATE] [--shoot-rate SHOOT_RATE]
+                   [--build-rate BUILD_RATE] [--grenade-rate GRENADE_RATE]
+                   [--report-interval REPORT_INTERVAL]
+                   [--status-url STATUS_URL] [--load-map] [--seed SEED]
+
+Load test a server with simulated players
+
+Every bot connects, downloads the map, joins a team and then walks around,
+shoots, builds and digs, and throws grenades at the given rates (per bot and
+second). Every report shows the map downloads, the traffic of all bots and
+the longest gap between two WorldUpdates any bot saw, which grows when the
+server loop lags. With --status-url, the tick timings of the status server
+are shown as well.
+
+All bots connect from the same address, so set max_connections_per_ip to 0
+in the config of the server, and max_players to at least the number of
+bots.
+"""
+
+import argparse
+import asyncio
+import math
+import random
+import time
+
+from twisted.internet import asyncioreactor
+
+asyncioreactor.install(asyncio.get_event_loop())
+
+import aiohttp  # noqa: E402
+
+from pyspades.client import ClientConnection, ClientProtocol  # noqa: E402
+from pyspades.constants import (BLOCK_TOOL, GRENADE_TOOL,  # noqa: E402
+                                SPADE_TOOL, WEAPON_TOOL)
+
+
+def poisson(rate, dt):
+    """return True if an event of rate per second happens within dt"""
+    return rate > 0 and random.random() < 1 - math.exp(-rate * dt)
+
+
+class Bot(ClientConnection):
+    move_rate = 0.5
+    shoot_rate = 0.5
+    build_rate = 0.5
+    grenade_rate = 0.05
+    # how often the position and orientation are sent, like a client
+    position_interval = 1.0
+    orientation_interval = 1 / 10.0
+    # the shortest time between two blocks built or dug, longer than the
+    # tool intervals of the rapid hack detection
+    block_interval = 0.25
+
+    def on_connect(self):
+        ClientConnection.on_connect(self)
+        self.team = self.player_number % 2
+        self.heading = random.uniform(0, 2 * math.pi)
+        self.next_position = 0.0
+        self.next_orientation = 0.0
+        self.shooting = False
+        self.built = []
+        self.last_block = 0.0
+
+    def get_orientation(self):
+        return (math.cos(self.heading), math.sin(self.heading), 0.0)
+
+    def update(self, dt):
+        if not self.alive or self.position is None:
+            return
+        now = time.monotonic()
+        if now >= self.next_orientation:
+            self.next_orientation = now + self.orientation_interval
+            self.send_orientation(*self.get_orientation())
+        if now >= self.next_position:
+            self.next_position = now + self.position_interval
+            self.send_position(*self.position)
+        if poisson(self.move_rate, dt):
+            self.move()
+        if self.shooting or poisson(self.shoot_rate, dt):
+            self.shoot()
+        if (now - self.last_block >= self.block_interval and
+                poisson(self.build_rate, dt)):
+            self.last_block = now
+            self.build()
+        if poisson(self.grenade_rate, dt):
+            self.set_tool(GRENADE_TOOL)
+            x, y, z = self.get_orientation()
+            self.throw_grenade((x, y, -0.5))
+
+    def move(self):
+        self.heading += random.uniform(-1.0, 1.0)
+        walking = random.random() < 0.8
+        self.send_input(up=walking, jump=random.random() < 0.1,
+                        sprint=walking and random.random() < 0.3)
+
+    def shoot(self):
+        # toggle the trigger, so shots come in bursts
+        self.set_tool(WEAPON_TOOL)
+        self.shooting = not self.shooting
+        self.send_weapon_input(primary=self.shooting)
+
+    def build(self):
+        x, y, z = (int(value) for value in self.position)
+        if self.built and random.random() < 0.5:
+            self.set_tool(SPADE_TOOL)
+            self.destroy_block(*self.built.pop())
+            return
+        self.set_tool(BLOCK_TOOL)
+        dx, dy, _ = self.get_orientation()
+        point = (x + round(dx * 2), y + round(dy * 2))
+        if self.map is not None:
+            point += (self.map.get_z(*point) - 1,)
+        else:
+            # the block the bot stands on is at z + 3
+            point += (z + 2,)
+        self.send_block_action(*point)
+        self.built.append(point)
+
+
+class LoadTest:
+    def __init__(self, options):
+        self.options = options
+        self.protocol = ClientProtocol(max_connections=options.bots)
+        self.bots = []
+        self.last_stats = self.protocol.get_stats()
+        self.last_report = time.monotonic()
+
+    def connect_bot(self):
+        options = self.options
+        bot = self.protocol.connect(Bot, options.host, options.port)
+        bot.player_number = len(self.bots)
+        bot.name = 'Bot{}'.format(bot.player_number)
+        bot.load_map = options.load_map
+        bot.move_rate = options.move_rate
+        bot.shoot_rate = options.shoot_rate
+        bot.build_rate = options.build_rate
+        bot.grenade_rate = options.grenade_rate
+        self.bots.append(bot)
+
+    async def run(self):
+        options = self.options
+        end = time.monotonic() + options.duration
+        next_report = time.monotonic() + options.report_interval
+        while time.monotonic() < end and self.protocol.host is not None:
+            if len(self.bots) < options.bots:
+                self.connect_bot()
+                await asyncio.sleep(1 / options.connect_rate)
+            else:
+                await asyncio.sleep(0.1)
+            if time.monotonic() >= next_report:
+                next_report += options.report_interval
+                await self.report()
+        if time.monotonic() - self.last_report >= 1.0:
+            await self.report()
+        for bot in self.bots:
+            if not bot.disconnected:
+                bot.disconnect()
+
+    async def get_tick_stats(self):
+        url = self.options.status_url
+        if url is None:
+            return None
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(url) as response:
+                    return (await response.json())['tick']
+        except (aiohttp.ClientError, KeyError, ValueError) as error:
+            print('  status server: {!r}'.format(error))
+            return None
+
+    async def report(self):
+        now = time.monotonic()
+        elapsed = now - self.last_report
+        self.last_report = now
+        bots = self.bots
+        connected = [bot for bot in bots if bot.connect_time is not None
+                     and not bot.disconnected]
+        map_times = [bot.get_map_time() for bot in bots
+                     if bot.get_map_time() is not None]
+        print('bots: {} started, {} connected, {} joined, {} alive, {} '
+              'disconnected'.format(
+                  len(bots), len(connected), sum(bot.joined for bot in bots),
+                  sum(bot.alive for bot in bots),
+                  sum(bot.disconnected for bot in bots)))
+        if map_times:
+            print('  map transfer: {} done, mean {:.2f} s, max {:.2f} s'
+                  .format(len(map_times), sum(map_times) / len(map_times),
+                          max(map_times)))
+        stats = self.protocol.get_stats()
+        if stats and self.last_stats:
+            received = stats['bytes_received'] - self.last_stats['bytes_received']
+            sent = stats['bytes_sent'] - self.last_stats['bytes_sent']
+            print('  traffic: {:.1f} KiB/s in, {:.1f} KiB/s out, {:.1f} KiB/s '
+                  'in per bot'.format(
+                      received / elapsed / 1024, sent / elapsed / 1024,
+                      received / elapsed / 1024 / max(len(connected), 1)))
+        self.last_stats = stats
+        gaps = [bot.max_world_update_interval for bot in bots]
+        for bot in bots:
+            bot.max_world_update_interval = 0.0
+        print('  longest WorldUpdate gap: {:.0f} ms'.format(
+            max(gaps, default=0.0) * 1000))
+        tick = await self.get_tick_stats()
+        if tick is not None:
+            phases = tick['phases']
+            print('  server tick: p50 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms,'
+                  ' {} overruns'.format(
+                      phases['total']['p50'], phases['total']['p99'],
+                      phases['total']['max'], tick['overruns']))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test a server with simulated players")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=32887)
+    parser.add_argument('--bots', type=int, default=16,
+                        help='number of simulated players')
+    parser.add_argument('--duration', type=float, default=60.0,
+                        help='seconds to run for')
+    parser.add_argument('--connect-rate', type=float, default=4.0,
+                        help='bots connecting per second')
+    parser.add_argument('--move-rate', type=float, default=0.5,
+                        help='changes of direction per bot and second')
+    parser.add_argument('--shoot-rate', type=float, default=0.5,
+                        help='bursts of fire per bot and second')
+    parser.add_argument('--build-rate', type=float, default=0.5,
+                        help='blocks built or dug per bot and second')
+    parser.add_argument('--grenade-rate', type=float, default=0.05,
+                        help='grenades per bot and second')
+    parser.add_argument('--report-interval', type=float, default=5.0,
+                        help='seconds between reports')
+    parser.add_argument('--status-url',
+                        help='JSON url of the status server, e.g. '
+                        'http://127.0.0.1:32886/json')
+    parser.add_argument('--load-map', action='store_true',
+                        help='decompress the map in every bot, to build on '
+                        'the ground')
+    parser.add_argument('--seed', type=int, help='random seed')
+    options = parser.parse_args()
+    if options.seed is not None:
+        random.seed(options.seed)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(LoadTest(options).run())
+
+
+if __name__ == '__main__':
+    main()
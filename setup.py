@@ -40,7 +40,8 @@ if use_linetrace:
 extension_descriptors = [
     Descriptor('pyspades.world',
                sources=['pyspades/world.pyx'],
-               compile_flags=['-std=c++11']),
+               compile_flags=['-std=c++11', '-pthread'],
+               link_flags=['-pthread']),
 
     Descriptor('pyspades.mapmaker',
                sources=['pyspades/mapmaker.pyx'],
@@ -62,7 +63,13 @@ extension_descriptors = [
                sources=['pyspades/packet.pyx']),
 
     Descriptor('pyspades.vxl',
-               sources=['pyspades/vxl.pyx']),
+               sources=['pyspades/vxl.pyx'],
+               compile_flags=['-std=c++11', '-pthread'],
+               link_flags=['-pthread']),
+
+    Descriptor('pyspades.voxelset',
+               sources=['pyspades/voxelset.pyx'],
+               compile_flags=['-std=c++11']),
 ]
 
 extensions: List[Extension] = []
@@ -0,0 +1,64 @@
+"""
+benchmark for looking up addresses in a NetworkDict of bans
+
+Not collected by pytest. Run it from the repository root::
+
+    python -m tests.piqueserver.bench_networkdict
+
+It bans BAN_COUNT random addresses and ranges, like a large subscribed ban
+list, then reports how long building the dict takes and how many lookups per
+second it manages for banned and for unbanned addresses.
+"""
+
+import random
+import time
+
+from piqueserver.networkdict import NetworkDict
+
+BAN_COUNT = 100000
+LOOKUPS = 100000
+
+
+def random_address(rng):
+    return '{}.{}.{}.{}'.format(rng.randrange(1, 224), rng.randrange(256),
+                                rng.randrange(256), rng.randrange(256))
+
+
+def make_bans(rng):
+    bans = []
+    for i in range(BAN_COUNT):
+        ip = random_address(rng)
+        if i % 10 == 0:
+            ip += '/{}'.format(rng.choice((16, 20, 24, 28)))
+        bans.append(['player{}'.format(i), ip, ': griefing', None])
+    return bans
+
+
+def bench_lookups(networkdict, addresses):
+    start = time.perf_counter()
+    for address in addresses:
+        address in networkdict
+    return len(addresses) / (time.perf_counter() - start)
+
+
+def main():
+    rng = random.Random(0)
+    bans = make_bans(rng)
+    networkdict = NetworkDict()
+    start = time.perf_counter()
+    networkdict.read_list(bans)
+    build = time.perf_counter() - start
+
+    banned = [ban[1].partition('/')[0] for ban in rng.sample(bans, LOOKUPS)]
+    unbanned = [random_address(rng) for _ in range(LOOKUPS)]
+    print('{} bans, read_list took {:.0f} ms'.format(
+        len(networkdict), build * 1000))
+    print('{:>10} {:>14}'.format('lookup', 'per second'))
+    print('{:>10} {:>14,.0f}'.format('banned',
+                                     bench_lookups(networkdict, banned)))
+    print('{:>10} {:>14,.0f}'.format('unbanned',
+                                     bench_lookups(networkdict, unbanned)))
+
+
+if __name__ == '__main__':
+    main()
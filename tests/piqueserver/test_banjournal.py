@@ -0,0 +1,88 @@
+"""
+test piqueserver/banjournal.py
+"""
+import json
+import os
+import tempfile
+from unittest.mock import Mock
+
+from twisted.trial import unittest
+
+from piqueserver.banjournal import BanJournal
+from piqueserver.banpublish import PublishServer
+from piqueserver.networkdict import NetworkDict
+
+
+class TestBanJournal(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.filename = os.path.join(self.directory.name, 'bans.txt')
+        with open(self.filename, 'w') as f:
+            json.dump([["GOD", "177.47.27.223", ": esp hacker", None]], f)
+
+    def load(self):
+        journal = BanJournal(self.filename)
+        self.addCleanup(journal.close)
+        bans = NetworkDict()
+        journal.read_bans(bans)
+        journal.replay(bans)
+        return journal, bans
+
+    def test_replay(self):
+        journal, bans = self.load()
+        journal.add("10.0.0.0/8", ("Bob", ": aimbot", 1234.5))
+        journal.remove("177.47.27.223")
+        journal.close()
+        # a record cut short by a crash is skipped
+        with open(journal.journal_filename, 'a') as f:
+            f.write('["add", "Eve"')
+
+        journal, bans = self.load()
+        self.assertEqual(bans.make_list(),
+                         [["Bob", "10.0.0.0/8", ": aimbot", 1234.5]])
+        self.assertEqual(journal.records, 3)
+
+    def test_compact(self):
+        journal, bans = self.load()
+        bans["10.0.0.0/8"] = ("Bob", ": aimbot", None)
+        journal.add("10.0.0.0/8", ("Bob", ": aimbot", None))
+        journal.compact_after = 1
+        self.assertTrue(journal.needs_compaction())
+
+        def check(_):
+            self.assertFalse(os.path.exists(journal.journal_filename))
+            self.assertFalse(os.path.exists(journal.compacting_filename))
+            with open(self.filename) as f:
+                self.assertEqual(json.load(f), bans.make_list())
+            self.assertEqual(journal.records, 0)
+        return journal.compact(bans).addCallback(check)
+
+    def test_interrupted_compaction(self):
+        journal, bans = self.load()
+        journal.add("10.0.0.0/8", ("Bob", ": aimbot", None))
+        journal.close()
+        # the server stopped after the journal was moved aside, but before
+        # the bans file was written
+        os.replace(journal.journal_filename, journal.compacting_filename)
+        journal, bans = self.load()
+        journal.remove("10.0.0.0/8")
+        journal.close()
+        journal, bans = self.load()
+        self.assertEqual(bans.make_list(),
+                         [["GOD", "177.47.27.223", ": esp hacker", None]])
+
+
+class TestPublishServer(unittest.TestCase):
+    def test_incremental(self):
+        protocol = Mock()
+        protocol.bans = NetworkDict()
+        protocol.bans["1.2.3.4"] = ("GOD", ": esp", None)
+        publish = PublishServer(protocol, 0)
+        self.assertEqual(json.loads(publish.json_bans),
+                         [{"ip": "1.2.3.4", "reason": ": esp"}])
+        publish.add("10.0.0.0/8", ": expired", 1)
+        publish.add("10.1.0.0/16", ": aimbot", None)
+        publish.remove("1.2.3.4")
+        self.assertEqual(json.loads(publish.json_bans),
+                         [{"ip": "10.1.0.0/16", "reason": ": aimbot"}])
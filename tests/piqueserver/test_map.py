@@ -0,0 +1,181 @@
+"""
+test piqueserver/map.py
+"""
+import os
+import tempfile
+import textwrap
+from threading import Thread
+
+from twisted.internet.defer import Deferred, ensureDeferred, fail
+from twisted.trial import unittest
+
+from piqueserver.map import (GeneratedMapCache, Map, MapCache, MapNotFound,
+                             RotationInfo)
+from pyspades.vxl import VXLData
+
+GEN_SCRIPT = textwrap.dedent("""
+    from pyspades.vxl import VXLData
+
+    calls = []
+
+    def gen_script(name, seed):
+        calls.append(seed)
+        data = VXLData()
+        data.set_point(seed, seed, 40, (1, 2, 3))
+        return data
+""")
+
+
+class TestMapCache(unittest.TestCase):
+    def setUp(self):
+        self.loading = {}
+        self.loads = []
+
+    def load(self, rot_info):
+        self.loads.append(rot_info.full_name)
+        if rot_info.name == 'missing':
+            return fail(MapNotFound(rot_info.name))
+        d = Deferred()
+        self.loading[rot_info.full_name] = d
+        return d
+
+    def test_hit(self):
+        cache = MapCache(self.load)
+        cache.prefetch(RotationInfo('hallway'))
+        cache.prefetch(RotationInfo('hallway'))
+        self.loading['hallway'].callback('hallway map')
+        result = self.successResultOf(
+            ensureDeferred(cache.get(RotationInfo('hallway'))))
+        self.assertEqual(result, 'hallway map')
+        self.assertEqual(self.loads, ['hallway'])
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+    def test_hit_while_loading(self):
+        cache = MapCache(self.load)
+        cache.prefetch(RotationInfo('hallway'))
+        d = ensureDeferred(cache.get(RotationInfo('hallway')))
+        self.assertNoResult(d)
+        self.loading['hallway'].callback('hallway map')
+        self.assertEqual(self.successResultOf(d), 'hallway map')
+        self.assertEqual(cache.hits, 1)
+
+    def test_miss(self):
+        cache = MapCache(self.load)
+        cache.prefetch(RotationInfo('hallway'))
+        d = ensureDeferred(cache.get(RotationInfo('classicgen #1')))
+        self.loading['classicgen #1'].callback('generated map')
+        self.assertEqual(self.successResultOf(d), 'generated map')
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+    def test_bounded(self):
+        cache = MapCache(self.load, size=1)
+        cache.prefetch(RotationInfo('hallway'))
+        cache.prefetch(RotationInfo('classicgen #1'))
+        self.assertEqual(list(cache.entries), ['classicgen #1'])
+        # the evicted map is loaded again
+        ensureDeferred(cache.get(RotationInfo('hallway')))
+        self.assertEqual(self.loads, ['hallway', 'classicgen #1', 'hallway'])
+
+    def test_disabled(self):
+        cache = MapCache(self.load, size=0)
+        cache.prefetch(RotationInfo('hallway'))
+        self.assertEqual(self.loads, [])
+
+    def test_cancel(self):
+        cache = MapCache(self.load, size=2)
+        cache.prefetch(RotationInfo('hallway'))
+        cache.prefetch(RotationInfo('classicgen #1'))
+        cache.cancel(RotationInfo('hallway'))
+        self.assertEqual(list(cache.entries), ['classicgen #1'])
+        # finishing the cancelled load is ignored
+        self.loading['hallway'].callback('hallway map')
+        cache.cancel()
+        self.assertEqual(list(cache.entries), [])
+
+    def test_failed_prefetch(self):
+        cache = MapCache(self.load)
+        cache.prefetch(RotationInfo('missing'))
+        d = ensureDeferred(cache.get(RotationInfo('missing')))
+        self.failureResultOf(d, MapNotFound)
+        self.assertEqual(self.loads, ['missing', 'missing'])
+        self.assertEqual(cache.misses, 1)
+
+
+class TestGeneratedMapCache(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.maps = os.path.join(directory.name, 'maps')
+        os.mkdir(self.maps)
+        self.script = os.path.join(self.maps, 'gen.txt')
+        with open(self.script, 'w') as fp:
+            fp.write(GEN_SCRIPT)
+        self.cache = GeneratedMapCache(
+            os.path.join(directory.name, 'cache'), 10 * 1024 * 1024)
+
+    def make_map(self, seed):
+        data = VXLData()
+        data.set_point(seed, seed, 40, (1, 2, 3))
+        return data
+
+    def test_store_load(self):
+        filename = self.cache.get_filename(self.script, 'gen', 1)
+        self.assertIsNone(self.cache.load(filename))
+        self.cache.store(filename, self.make_map(1))
+        loaded = self.cache.load(filename)
+        self.assertEqual(loaded.get_color(1, 1, 40), (1, 2, 3))
+
+    def test_key(self):
+        filename = self.cache.get_filename(self.script, 'gen', 1)
+        self.assertNotEqual(
+            filename, self.cache.get_filename(self.script, 'gen', 2))
+        with open(self.script, 'a') as fp:
+            fp.write('# changed\n')
+        self.assertNotEqual(
+            filename, self.cache.get_filename(self.script, 'gen', 1))
+
+    def test_store_threads(self):
+        filename = self.cache.get_filename(self.script, 'gen', 1)
+        threads = [Thread(target=self.cache.store,
+                          args=(filename, self.make_map(1)))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        loaded = self.cache.load(filename)
+        self.assertEqual(loaded.get_color(1, 1, 40), (1, 2, 3))
+        self.assertEqual(os.listdir(self.cache.directory),
+                         [os.path.basename(filename)])
+
+    def test_evict(self):
+        filenames = [self.cache.get_filename(self.script, 'gen', seed)
+                     for seed in range(3)]
+        for seed, filename in enumerate(filenames):
+            self.cache.store(filename, self.make_map(seed))
+            os.utime(filename, (seed, seed))
+        size = os.path.getsize(filenames[0])
+        self.cache.max_size = size * 2
+        # using the oldest map makes the second one the least recently used
+        self.cache.load(filenames[0])
+        self.cache.evict()
+        self.assertEqual([os.path.exists(filename) for filename in filenames],
+                         [True, False, True])
+
+    def test_broken(self):
+        filename = self.cache.get_filename(self.script, 'gen', 1)
+        os.makedirs(self.cache.directory)
+        with open(filename, 'wb') as fp:
+            fp.write(b'broken')
+        self.assertIsNone(self.cache.load(filename))
+        self.assertFalse(os.path.exists(filename))
+
+    def test_map(self):
+        first = Map(RotationInfo('gen #5'), self.maps, self.cache)
+        self.assertEqual(first.info.calls, [5])
+        second = Map(RotationInfo('gen #5'), self.maps, self.cache)
+        self.assertEqual(second.info.calls, [])
+        self.assertEqual(second.name, 'gen #5')
+        self.assertEqual(second.data.get_color(5, 5, 40), (1, 2, 3))
+        # the seed makes the map load the same again, e.g. in a replay
+        self.assertEqual(second.get_rotation_name(), 'gen#5')
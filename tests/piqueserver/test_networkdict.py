@@ -83,3 +83,49 @@ class TestNetworkDict(unittest.TestCase):
                 'GOD', ': esp hacker', 1511717871.435394]
             self.assertEqual((case["within"] in networkdict), True)
             self.assertEqual((case["outside"] in networkdict), False)
+
+    def test_most_specific(self):
+        networkdict = NetworkDict()
+        networkdict["10.0.0.0/8"] = "wide"
+        networkdict["10.1.0.0/16"] = "narrow"
+        self.assertEqual(networkdict["10.1.2.3"], "narrow")
+        self.assertEqual(networkdict["10.2.2.3"], "wide")
+        self.assertEqual(networkdict.get("11.0.0.1"), None)
+
+    def test_remove_supernets(self):
+        networkdict = NetworkDict()
+        networkdict["10.0.0.0/8"] = "wide"
+        networkdict["10.1.0.0/16"] = "narrow"
+        networkdict["10.1.2.3"] = "single"
+        networkdict["10.2.0.0/16"] = "other"
+        removed = networkdict.remove("10.1.2.3")
+        self.assertEqual([(str(network), value) for network, value in removed],
+                         [("10.1.2.3/32", "single"),
+                          ("10.1.0.0/16", "narrow"),
+                          ("10.0.0.0/8", "wide")])
+        self.assertEqual(len(networkdict), 1)
+        self.assertEqual(networkdict["10.2.0.1"], "other")
+        self.assertNotIn("10.1.2.3", networkdict)
+
+    def test_ipv6(self):
+        networkdict = NetworkDict()
+        networkdict["2001:db8::/32"] = "range"
+        networkdict["2001:db8::1"] = "single"
+        self.assertEqual(networkdict["2001:db8::1"], "single")
+        self.assertEqual(networkdict["2001:db8:ffff::1"], "range")
+        self.assertNotIn("2001:db9::1", networkdict)
+        self.assertNotIn("32.1.13.184", networkdict)
+        self.assertEqual(list(networkdict.iteritems()),
+                         [("2001:db8::/32", "range"),
+                          ("2001:db8::1/128", "single")])
+
+    def test_discard_tables(self):
+        networkdict = NetworkDict()
+        networkdict["177.47.27.223"] = "single"
+        networkdict["177.47.27.0/24"] = "range"
+        del networkdict["177.47.27.223"]
+        self.assertEqual(networkdict["177.47.27.223"], "range")
+        self.assertEqual(networkdict.prefixes[4], [24])
+        del networkdict["177.47.27.0/24"]
+        self.assertEqual(networkdict.tables[4], {})
+        self.assertEqual(networkdict.prefixes[4], [])
@@ -2,9 +2,13 @@
 test piqueserver/server.py
 """
 
+from functools import partial
+from types import MethodType
 from twisted.trial import unittest
 from unittest.mock import Mock
 import piqueserver.player
+from piqueserver.server import FeatureProtocol
+from pyspades.voxelset import VoxelSet
 from pyspades.constants import DESTROY_BLOCK, GRENADE_DESTROY
 
 class TestPlayer(unittest.TestCase):
@@ -25,6 +29,8 @@ class TestPlayer(unittest.TestCase):
         self.protocol.global_chat = True
         self.protocol.everyone_is_admin = False
         self.protocol.is_indestructable = Mock(return_value=False)
+        self.protocol.is_region_indestructable = partial(
+            FeatureProtocol.is_region_indestructable, self.protocol)
         self.protocol.map_info = Mock()
         self.protocol.map_info.on_block_destroy = None
         
@@ -63,4 +69,19 @@ class TestPlayer(unittest.TestCase):
             return x == 0 and y == 0 and z == 0
         self.protocol.is_indestructable = Mock(side_effect=is_indestructable)
         result = self.player.on_block_destroy(0, 0, 0, GRENADE_DESTROY)
-        self.assertFalse(result)
\ No newline at end of file
+        self.assertFalse(result)
+
+    def test_on_block_destroy_grenade_user_blocks(self):
+        self.protocol.is_indestructable = MethodType(
+            FeatureProtocol.is_indestructable, self.protocol)
+        self.protocol.map_info.is_indestructable = None
+        self.protocol.user_blocks = VoxelSet(
+            (x, y, z) for x in range(9, 12) for y in range(9, 12)
+            for z in range(9, 12))
+        self.assertIsNone(
+            self.player.on_block_destroy(10, 10, 10, GRENADE_DESTROY))
+        self.assertFalse(
+            self.player.on_block_destroy(11, 10, 10, GRENADE_DESTROY))
+        self.protocol.god_blocks = VoxelSet([(9, 9, 9)])
+        self.assertFalse(
+            self.player.on_block_destroy(10, 10, 10, GRENADE_DESTROY))
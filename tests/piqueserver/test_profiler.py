@@ -0,0 +1,90 @@
+"""
+test piqueserver/profiler.py
+"""
+import os
+import tempfile
+
+from twisted.trial import unittest
+
+from piqueserver.profiler import HookProfiler, get_label
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+clock = FakeClock()
+
+
+class BaseConnection:
+    def on_hit(self):
+        clock.now += 1.0
+        return 'base'
+
+    def not_a_hook(self):
+        return 'plain'
+
+
+def apply_script(connection):
+    class AfkConnection(connection):
+        def on_hit(self):
+            clock.now += 2.0
+            return connection.on_hit(self)
+    AfkConnection.__module__ = 'piqueserver._script_namespace.afk'
+    return AfkConnection
+
+
+class TestHookProfiler(unittest.TestCase):
+    def setUp(self):
+        self.connection_class = apply_script(BaseConnection)
+
+    def test_label(self):
+        self.assertEqual(get_label(self.connection_class, 'on_hit'),
+                         'afk:AfkConnection.on_hit')
+
+    def test_self_time(self):
+        profiler = HookProfiler([self.connection_class], clock=clock)
+        profiler.start()
+        connection = self.connection_class()
+        self.assertEqual(connection.on_hit(), 'base')
+        connection.on_hit()
+        profiler.stop()
+        base = get_label(BaseConnection, 'on_hit')
+        afk = 'afk:AfkConnection.on_hit'
+        self.assertEqual(profiler.stacks, {
+            ('on_hit', afk): [2, 4.0],
+            ('on_hit', afk, base): [2, 2.0],
+        })
+        self.assertEqual(profiler.get_top(1), [(afk, 2, 4.0)])
+        self.assertEqual(profiler.get_folded(), [
+            'on_hit;{} 4000000'.format(afk),
+            'on_hit;{};{} 2000000'.format(afk, base),
+        ])
+
+    def test_restore(self):
+        original = self.connection_class.__dict__['on_hit']
+        profiler = HookProfiler([self.connection_class], clock=clock)
+        profiler.start()
+        self.assertIsNot(self.connection_class.__dict__['on_hit'], original)
+        self.assertIs(BaseConnection.__dict__['not_a_hook'],
+                      BaseConnection.not_a_hook)
+        profiler.stop()
+        self.assertIs(self.connection_class.__dict__['on_hit'], original)
+        self.connection_class().on_hit()
+        self.assertEqual(profiler.stacks, {})
+
+    def test_dump(self):
+        profiler = HookProfiler([self.connection_class], clock=clock)
+        profiler.start()
+        self.connection_class().on_hit()
+        profiler.stop()
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'hooks.folded')
+            profiler.dump(filename)
+            with open(filename) as fp:
+                self.assertEqual(fp.read().splitlines(),
+                                 profiler.get_folded())
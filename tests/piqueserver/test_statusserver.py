@@ -3,6 +3,7 @@ from unittest.mock import Mock, patch
 from aiohttp.test_utils import AioHTTPTestCase, unittest_run_loop
 from aiohttp import web
 import piqueserver.statusserver
+from pyspades.vxl import VXLData
 
 
 class StatusSeverTest(AioHTTPTestCase):
@@ -50,3 +51,48 @@ class StatusSeverTest(AioHTTPTestCase):
             self.assertEqual(resp.status, 200)
             state = await resp.json()
             self.assertEqual(state, state_fixture)
+
+
+class OverviewTest(AioHTTPTestCase):
+    async def get_application(self):
+        self.protocol = Mock()
+        self.protocol.map = VXLData()
+        self.protocol.map_info.name = 'test'
+        self.status_server = piqueserver.statusserver.StatusServer(
+            self.protocol)
+        return self.status_server.create_app()
+
+    @unittest_run_loop
+    async def test_etag(self):
+        resp = await self.client.request("GET", '/overview')
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(resp.content_type, 'image/png')
+        etag = resp.headers['ETag']
+        resp = await self.client.request(
+            "GET", '/overview', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status, 304)
+
+        self.protocol.map.set_point(100, 200, 10, (255, 0, 0))
+        self.status_server.last_update = 0
+        resp = await self.client.request(
+            "GET", '/overview', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status, 200)
+        self.assertNotEqual(resp.headers['ETag'], etag)
+
+    @unittest_run_loop
+    async def test_tiles(self):
+        resp = await self.client.request("GET", '/overview/1/3')
+        self.assertEqual(resp.status, 200)
+        etag = resp.headers['ETag']
+        other = (await self.client.request("GET", '/overview/0/0'))
+        other_etag = other.headers['ETag']
+
+        self.protocol.map.set_point(100, 200, 10, (255, 0, 0))
+        self.status_server.last_update = 0
+        resp = await self.client.request("GET", '/overview/1/3')
+        self.assertNotEqual(resp.headers['ETag'], etag)
+        resp = await self.client.request("GET", '/overview/0/0')
+        self.assertEqual(resp.headers['ETag'], other_etag)
+
+        resp = await self.client.request("GET", '/overview/8/0')
+        self.assertEqual(resp.status, 404)
@@ -0,0 +1,82 @@
+"""
+benchmark for encoding the packets the server sends most often
+
+Not collected by pytest. Run it from the repository root after building the
+extensions in place::
+
+    python -m tests.pyspades.bench_contained
+
+For every packet it reports how many encodes per second each of the encode
+paths manages:
+
+* ``writer``: a new ByteWriter per packet, like ``bytes(loader.generate())``
+* ``encode``: ``loader.encode()``, which reuses one writer
+"""
+
+import time
+
+from pyspades import contained as loaders
+from pyspades.bytes import ByteWriter
+
+ITERATIONS = 200000
+
+
+def make_packets():
+    position_data = loaders.PositionData()
+    position_data.set((256.5, 256.5, 32.5))
+
+    orientation_data = loaders.OrientationData()
+    orientation_data.set((0.5, 0.25, -0.75))
+
+    world_update = loaders.WorldUpdate()
+    world_update.items = [((i * 10.5, i * 3.25, 40.0), (1.0, 0.0, 0.0))
+                          for i in range(32)]
+
+    input_data = loaders.InputData()
+    input_data.player_id = 12
+    input_data.up = input_data.sprint = True
+
+    weapon_input = loaders.WeaponInput()
+    weapon_input.player_id = 12
+    weapon_input.primary = True
+
+    block_action = loaders.BlockAction()
+    block_action.player_id = 12
+    block_action.x, block_action.y, block_action.z = 200, 300, 40
+
+    return [position_data, orientation_data, world_update, input_data,
+            weapon_input, block_action]
+
+
+def bench_writer(packet, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        writer = ByteWriter()
+        packet.write(writer)
+        bytes(writer)
+    return iterations / (time.perf_counter() - start)
+
+
+def bench_encode(packet, iterations):
+    encode = packet.encode
+    start = time.perf_counter()
+    for _ in range(iterations):
+        encode()
+    return iterations / (time.perf_counter() - start)
+
+
+def main():
+    print('{:>16} {:>14} {:>14}'.format('packet', 'writer /s', 'encode /s'))
+    for packet in make_packets():
+        # WorldUpdate is much bigger than the rest, keep the run time sane
+        iterations = ITERATIONS
+        if isinstance(packet, loaders.WorldUpdate):
+            iterations //= 10
+        assert packet.encode() == bytes(packet.generate())
+        print('{:>16} {:>14,.0f} {:>14,.0f}'.format(
+            type(packet).__name__, bench_writer(packet, iterations),
+            bench_encode(packet, iterations)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+benchmark for destroying blocks of large structures
+
+Not collected by pytest. Run it from the repository root after building the
+extensions in place::
+
+    python -m tests.pyspades.bench_destroy
+
+Every case works on a fresh copy of a map with a large bridge: a deck of
+BRIDGE_LENGTH x BRIDGE_WIDTH x BRIDGE_DEPTH blocks high above the ground,
+held up by a pillar at each end.
+
+* ``dig``: destroy a block in the middle of the deck. The deck is still
+  held up, which is only found out after walking to a pillar.
+* ``grenade``: destroy the 3x3x3 blocks around a point in the middle of the
+  deck, with destroy_point for every block.
+* ``grenade batch``: the same with one destroy_points call.
+* ``collapse``: cut through the last pillar, so the whole deck falls.
+"""
+
+import time
+
+from pyspades.vxl import VXLData
+
+BRIDGE_LENGTH = 400
+BRIDGE_WIDTH = 24
+BRIDGE_DEPTH = 4
+BRIDGE_Z = 20
+REPEAT = 5
+
+X1 = 56
+Y1 = 256 - BRIDGE_WIDTH // 2
+X2 = X1 + BRIDGE_LENGTH - 1
+Y2 = Y1 + BRIDGE_WIDTH - 1
+COLOR = 0x7F7F7F
+
+
+def make_map():
+    vxl = VXLData()
+    for x in range(X1, X2 + 1):
+        for y in range(Y1, Y2 + 1):
+            vxl.set_column_fast(x, y, BRIDGE_Z, BRIDGE_Z + BRIDGE_DEPTH - 1,
+                                BRIDGE_Z + BRIDGE_DEPTH - 1, COLOR)
+    for x in (X1, X2):
+        for y in range(Y1, Y1 + 4):
+            vxl.set_column_fast(x, y, BRIDGE_Z + BRIDGE_DEPTH, 63, 63, COLOR)
+    return vxl
+
+
+def grenade_points(x, y, z):
+    return [(x + dx, y + dy, z + dz)
+            for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)]
+
+
+def dig(vxl):
+    return vxl.destroy_point((X1 + X2) // 2, (Y1 + Y2) // 2, BRIDGE_Z)
+
+
+def grenade(vxl):
+    count = 0
+    for point in grenade_points((X1 + X2) // 2, (Y1 + Y2) // 2, BRIDGE_Z + 1):
+        count += vxl.destroy_point(*point)
+    return count
+
+
+def grenade_batch(vxl):
+    count, _ = vxl.destroy_points(
+        grenade_points((X1 + X2) // 2, (Y1 + Y2) // 2, BRIDGE_Z + 1))
+    return count
+
+
+def collapse(vxl):
+    # cut the first pillar, then the second one, which drops the deck
+    count = 0
+    for x in (X1, X2):
+        for y in range(Y1, Y1 + 4):
+            count += vxl.destroy_point(x, y, 40)
+    return count
+
+
+def main():
+    bridge = make_map()
+    print('{:>14} {:>10} {:>10}'.format('case', 'ms', 'removed'))
+    for name, func in (('dig', dig), ('grenade', grenade),
+                       ('grenade batch', grenade_batch),
+                       ('collapse', collapse)):
+        best = None
+        for _ in range(REPEAT):
+            vxl = bridge.copy()
+            start = time.perf_counter()
+            removed = func(vxl)
+            taken = time.perf_counter() - start
+            if best is None or taken < best:
+                best = taken
+        print('{:>14} {:>10.2f} {:>10}'.format(name, best * 1000, removed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+benchmark for the height queries of VXLData
+
+Not collected by pytest. Run it from the repository root after building the
+extensions in place::
+
+    python -m tests.pyspades.bench_heightmap
+
+On a generated ``classicgen`` map it reports how long each query takes for
+the whole map, i.e. for all 512x512 columns:
+
+* ``get_z``: the top solid voxel of every column, e.g. for entity placement
+* ``get_height``: the top of the ground of every column
+* ``count_land``: the land columns, as ServerProtocol.get_random_location does
+* ``get_overview``: the overview image the status server shows
+"""
+
+import time
+
+from pyspades.mapmaker import generate_classic
+
+REPEAT = 3
+
+
+def all_z(vxl):
+    get_z = vxl.get_z
+    for x in range(512):
+        for y in range(512):
+            get_z(x, y)
+
+
+def all_heights(vxl):
+    get_height = vxl.get_height
+    for x in range(512):
+        for y in range(512):
+            get_height(x, y)
+
+
+def count_land(vxl):
+    vxl.count_land(0, 0, 512, 512)
+
+
+def overview(vxl):
+    vxl.get_overview(rgba=True)
+
+
+def main():
+    vxl = generate_classic(1)
+    print('{:>14} {:>10}'.format('query', 'ms'))
+    for name, func in (('get_z', all_z), ('get_height', all_heights),
+                       ('count_land', count_land),
+                       ('get_overview', overview)):
+        best = None
+        for _ in range(REPEAT):
+            start = time.perf_counter()
+            func(vxl)
+            taken = time.perf_counter() - start
+            if best is None or taken < best:
+                best = taken
+        print('{:>14} {:>10.2f}'.format(name, best * 1000))
+
+
+if __name__ == '__main__':
+    main()
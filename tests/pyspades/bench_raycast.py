@@ -0,0 +1,78 @@
+"""
+benchmark for line of sight checks and ray casts
+
+Not collected by pytest. Run it from the repository root after building the
+extensions in place::
+
+    python -m tests.pyspades.bench_raycast
+
+Every case checks the same random points on a generated map, like an
+anti-cheat script validating every shot against every player.
+
+* ``loop``: one `Character.can_see` or `Character.cast_ray` call per point.
+* ``batched``: one `can_see_many` or `cast_rays` call for all points.
+"""
+
+import random
+import time
+from array import array
+
+from pyspades import world
+from pyspades.common import Vertex3
+from pyspades.mapmaker import generate_classic
+
+COUNT = 10000
+REPEAT = 5
+
+
+def best_of(func):
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func()
+        taken = time.perf_counter() - start
+        if best is None or taken < best:
+            best = taken
+    return best
+
+
+def main():
+    rand = random.Random(1234)
+    w = world.World()
+    w.map = generate_classic(1234)
+    character = w.create_object(world.Character, Vertex3(256, 256, 20), None)
+    points = [(rand.uniform(192, 320), rand.uniform(192, 320),
+               rand.uniform(0, 63)) for _ in range(COUNT)]
+    directions = [(rand.uniform(-1, 1), rand.uniform(-1, 1),
+                   rand.uniform(-1, 1)) for _ in range(COUNT)]
+    targets = array('f', [value for point in points for value in point])
+    rays = array('f', [value for direction in directions
+                       for value in (256, 256, 20) + direction])
+
+    def can_see_loop():
+        for point in points:
+            character.can_see(*point)
+
+    def cast_ray_loop():
+        orientation = character.orientation
+        for direction in directions:
+            orientation.set(*direction)
+            character.cast_ray(32.0)
+
+    cases = (
+        ('can_see', 'loop', can_see_loop),
+        ('can_see', 'batched',
+         lambda: world.can_see_many(w.map, 256, 256, 20, targets)),
+        ('cast_ray', 'loop', cast_ray_loop),
+        ('cast_ray', 'batched', lambda: world.cast_rays(w.map, rays, 32.0)),
+    )
+    print('{:>10} {:>10} {:>10} {:>12}'.format('check', 'case', 'ms',
+                                               'us/ray'))
+    for check, name, func in cases:
+        taken = best_of(func)
+        print('{:>10} {:>10} {:>10.2f} {:>12.3f}'.format(
+            check, name, taken * 1000, taken * 1e6 / COUNT))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+benchmark for the VXLData map storage
+
+Not collected by pytest. Run it from the repository root after building the
+extensions in place::
+
+    python -m tests.pyspades.bench_vxl
+
+It generates the bundled ``classicgen`` maps, then reports the resident
+memory each map costs and how long the common map operations take.
+"""
+
+import gc
+import io
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from pyspades.mapmaker import generate_classic
+from pyspades.vxl import VXLData
+
+SEEDS = (1, 2, 3, 4)
+POINT_SAMPLES = 200000
+
+
+def get_rss():
+    """return the resident set size of this process in bytes, or None if it
+    can't be determined on this platform"""
+    try:
+        with open('/proc/self/statm') as fp:
+            pages = int(fp.read().split()[1])
+    except OSError:
+        return None
+    import resource
+    return pages * resource.getpagesize()
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def drain(generator):
+    while generator.get_data(8192) is not None:
+        pass
+
+
+def measure_memory(path):
+    """load the map at path a few times and print the average RSS each copy
+    adds. Runs in a fresh interpreter so freed allocations from other
+    benchmarks don't hide the cost."""
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    gc.collect()
+    before = get_rss()
+    maps = [VXLData(io.BytesIO(data)) for _ in range(4)]
+    gc.collect()
+    after = get_rss()
+    if before is None or after is None:
+        print('None')
+    else:
+        print((after - before) / len(maps))
+
+
+def bench_memory(data):
+    with tempfile.NamedTemporaryFile(suffix='.vxl', delete=False) as fp:
+        fp.write(data)
+    try:
+        output = subprocess.check_output(
+            [sys.executable, '-m', 'tests.pyspades.bench_vxl', '--memory',
+             fp.name])
+    finally:
+        os.unlink(fp.name)
+    output = output.decode().strip()
+    return None if output == 'None' else float(output)
+
+
+def bench_points(vxl):
+    rng = random.Random(0)
+    points = [(rng.randrange(512), rng.randrange(512), rng.randrange(64))
+              for _ in range(POINT_SAMPLES)]
+    get_color = vxl.get_color
+    start = time.perf_counter()
+    for x, y, z in points:
+        get_color(x, y, z)
+    read = time.perf_counter() - start
+    set_point = vxl.set_point
+    color = (0x20, 0x40, 0x60)
+    start = time.perf_counter()
+    for x, y, z in points:
+        set_point(x, y, z, color)
+    write = time.perf_counter() - start
+    return read, write
+
+
+def main():
+    print('{:>6} {:>10} {:>9} {:>9} {:>9} {:>9} {:>10} {:>10}'.format(
+        'seed', 'MiB/map', 'load ms', 'save ms', 'copy ms', 'gen ms',
+        'get Mop/s', 'set Mop/s'))
+    for seed in SEEDS:
+        data = generate_classic(seed).generate()
+        memory = bench_memory(data)
+        load, vxl = timed(VXLData, io.BytesIO(data))
+        save, _ = timed(vxl.generate)
+        copy, _ = timed(vxl.copy)
+        gen, _ = timed(drain, vxl.get_generator())
+        read, write = bench_points(vxl)
+        print('{:>6} {:>10} {:>9.1f} {:>9.1f} {:>9.2f} {:>9.1f} {:>10.2f} '
+              '{:>10.2f}'.format(
+                  seed,
+                  'n/a' if memory is None else '{:.1f}'.format(
+                      memory / 1024 / 1024),
+                  load * 1000, save * 1000, copy * 1000, gen * 1000,
+                  POINT_SAMPLES / read / 1e6, POINT_SAMPLES / write / 1e6))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == '--memory':
+        measure_memory(sys.argv[2])
+    else:
+        main()
@@ -0,0 +1,82 @@
+"""
+benchmark for loading VXL maps
+
+Not collected by pytest. Run it from the repository root after building the
+extensions in place::
+
+    python -m tests.pyspades.bench_vxl_load
+
+Every map is written to a temporary file first.
+
+* ``classicgen``: a generated map, mostly one span per column.
+* ``layers``: a map with several floors, so every column has several spans,
+  like large maps with buildings and caves.
+
+and is loaded
+
+* ``bytes``: from a BytesIO, i.e. from a copy of the whole file, with one
+  thread.
+* ``mmap``: from the file, memory-mapped, with one thread.
+* ``mmap threads``: the same with one thread per core.
+"""
+
+import io
+import os
+import tempfile
+import time
+
+from pyspades.mapmaker import generate_classic
+from pyspades.vxl import VXLData
+
+REPEAT = 5
+
+
+def make_layers():
+    vxl = VXLData()
+    for x in range(512):
+        for y in range(512):
+            for z in (12, 28, 44, 60):
+                vxl.set_column_fast(x, y, z, z, z,
+                                    (x * 7 + y * 3 + z) & 0xFFFFFF)
+    return vxl
+
+
+def load_bytes(filename):
+    with open(filename, 'rb') as fp:
+        return VXLData(io.BytesIO(fp.read()), threads=1)
+
+
+def load_mmap(filename):
+    with open(filename, 'rb') as fp:
+        return VXLData(fp, threads=1)
+
+
+def load_mmap_threads(filename):
+    with open(filename, 'rb') as fp:
+        return VXLData(fp)
+
+
+def main():
+    maps = (('classicgen', generate_classic(1234)), ('layers', make_layers()))
+    print('{:>12} {:>14} {:>10} {:>10}'.format('map', 'case', 'ms', 'MiB'))
+    with tempfile.TemporaryDirectory() as directory:
+        for map_name, vxl in maps:
+            filename = os.path.join(directory, map_name + '.vxl')
+            with open(filename, 'wb') as fp:
+                fp.write(vxl.generate())
+            size = os.path.getsize(filename) / (1024 * 1024)
+            for name, func in (('bytes', load_bytes), ('mmap', load_mmap),
+                               ('mmap threads', load_mmap_threads)):
+                best = None
+                for _ in range(REPEAT):
+                    start = time.perf_counter()
+                    func(filename)
+                    taken = time.perf_counter() - start
+                    if best is None or taken < best:
+                        best = taken
+                print('{:>12} {:>14} {:>10.2f} {:>10.2f}'.format(
+                    map_name, name, best * 1000, size))
+
+
+if __name__ == '__main__':
+    main()
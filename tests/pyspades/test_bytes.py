@@ -79,3 +79,42 @@ class TestByteReader(unittest.TestCase):
             self.assertEqual(reader.readFloat(True), -6.384869180745487e+29)
 
     # TODO: test rest of bytes.pyx, moving on to more useful modules for now
+
+
+class TestByteWriter(unittest.TestCase):
+    """tests for ByteWriter"""
+
+    def test_write(self):
+        writer = ByteWriter()
+        writer.writeByte(-1)
+        writer.writeShort(0x1234)
+        writer.writeInt(0x12345678, True, False)
+        writer.writeString(b"ab", 4)
+        self.assertEqual(bytes(writer),
+                         b"\xFF\x12\x34\x78\x56\x34\x12ab\x00\x00")
+        self.assertEqual(len(writer), 11)
+        self.assertEqual(writer.tell(), 11)
+
+    def test_rewind(self):
+        writer = ByteWriter()
+        writer.write(b"abcd")
+        writer.rewind(3)
+        writer.write(b"X")
+        self.assertEqual(writer.tell(), 2)
+        # rewinding doesn't truncate
+        self.assertEqual(bytes(writer), b"aXcd")
+
+    def test_large(self):
+        writer = ByteWriter()
+        data = bytes(range(256)) * 20
+        writer.write(b"x")
+        writer.write(data)
+        self.assertEqual(bytes(writer), b"x" + data)
+
+    def test_clear(self):
+        writer = ByteWriter()
+        writer.write(b"abcd")
+        writer.clear()
+        writer.write(b"ef")
+        self.assertEqual(bytes(writer), b"ef")
+        self.assertEqual(len(writer), 2)
@@ -0,0 +1,145 @@
+"""
+test pyspades/capture.py
+"""
+import io
+import os
+import tempfile
+from unittest.mock import Mock
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from pyspades import contained as loaders
+from pyspades.bytes import ByteReader
+from pyspades.capture import (CONNECT, DISCONNECT, MAP, RECEIVE, TICK,
+                              Address, CaptureError, CaptureReader,
+                              CaptureReplay, CaptureWriter, Record,
+                              ReplayClock, ReplayHost, scrub_chat_command)
+from pyspades.protocol import BaseConnection, BaseProtocol
+
+
+class TestCaptureWriter(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.capture')
+        os.close(fd)
+        self.addCleanup(os.remove, self.filename)
+
+    @defer.inlineCallbacks
+    def test_roundtrip(self):
+        writer = CaptureWriter(self.filename, 10.0)
+        writer.flush_size = 16
+        peer = Mock(address=Address('127.0.0.1', 1234), eventData=3)
+        writer.tick(10.5)
+        writer.connect(peer)
+        writer.receive(peer, b'abc')
+        # peers that connected before the capture started are left out
+        writer.receive(Mock(), b'def')
+        writer.set_map('classicgen#1')
+        writer.tick(10.75)
+        writer.receive(peer, b'x' * 1000)
+        writer.disconnect(peer)
+        yield writer.close()
+
+        expected = [
+            Record(TICK, 0.5, None, None),
+            Record(CONNECT, 0.5, 1, (Address('127.0.0.1', 1234), 3)),
+            Record(RECEIVE, 0.5, 1, b'abc'),
+            Record(MAP, 0.5, None, 'classicgen#1'),
+            Record(TICK, 0.75, None, None),
+            Record(RECEIVE, 0.75, 1, b'x' * 1000),
+            Record(DISCONNECT, 0.75, 1, None),
+        ]
+        with open(self.filename, 'rb') as f:
+            data = f.read()
+        self.assertEqual(list(CaptureReader(io.BytesIO(data))), expected)
+        # a capture cut short is read up to the last complete record
+        records = list(CaptureReader(io.BytesIO(data[:-20])))
+        self.assertEqual(records, expected[:len(records)])
+        self.assertGreaterEqual(len(records), 4)
+
+        with self.assertRaises(CaptureError):
+            CaptureReader(io.BytesIO(b'not a capture at all'))
+
+    def test_scrub_chat_command(self):
+        chat = loaders.ChatMessage()
+        chat.player_id = 1
+        chat.chat_type = 0
+        chat.value = '/login  secret password'
+        data = scrub_chat_command(chat.encode())
+        scrubbed = loaders.ChatMessage(ByteReader(data[1:]))
+        self.assertEqual((scrubbed.player_id, scrubbed.value), (1, '/login'))
+        # everything else is recorded as it was received
+        chat.value = 'hello'
+        self.assertEqual(scrub_chat_command(chat.encode()), chat.encode())
+        self.assertEqual(scrub_chat_command(b'\x11\x01'), b'\x11\x01')
+        self.assertEqual(scrub_chat_command(b'/login x'), b'/login x')
+
+
+class ReplayConnection(BaseConnection):
+    def on_connect(self):
+        self.protocol.log.append(('connect', self.peer.address.port))
+
+    def loader_received(self, packet):
+        self.protocol.log.append(('receive', packet.data))
+        if packet.data == b'kick':
+            self.disconnect()
+
+    def on_disconnect(self):
+        self.protocol.log.append(('disconnect',))
+
+
+class ReplayProtocol(BaseProtocol):
+    connection_class = ReplayConnection
+
+    def __init__(self, clock):
+        self.host = ReplayHost()
+        self.connections = {}
+        self.clients = {}
+        self.clock = clock
+        self.log = []
+
+    def run_tick(self):
+        self.log.append(('tick', self.clock.seconds()))
+        BaseProtocol.update(self)
+
+
+class MapReplay(CaptureReplay):
+    def on_map(self, name):
+        self.protocol.log.append(('map', name))
+
+
+class TestCaptureReplay(unittest.TestCase):
+    def test_replay(self):
+        reactor = Mock()
+        clock = ReplayClock(reactor, 100.0)
+        protocol = ReplayProtocol(clock)
+        records = [
+            Record(TICK, 0.5, None, None),
+            Record(CONNECT, 0.5, 1, (Address('127.0.0.1', 1234), 3)),
+            Record(RECEIVE, 0.5, 1, b'abc'),
+            Record(MAP, 0.5, None, 'classicgen#1'),
+            Record(TICK, 0.75, None, None),
+            Record(RECEIVE, 0.75, 1, b'kick'),
+            Record(RECEIVE, 0.75, 1, b'lost'),
+            Record(TICK, 1.0, None, None),
+            Record(DISCONNECT, 1.0, 1, None),
+        ]
+        replay = MapReplay(protocol, records, clock)
+        replay.run()
+        self.assertEqual(protocol.log, [
+            ('tick', 100.5),
+            ('connect', 1234),
+            ('receive', b'abc'),
+            ('map', 'classicgen#1'),
+            ('tick', 100.75),
+            ('receive', b'kick'),
+            ('disconnect',),
+            ('tick', 101.0),
+        ])
+        # timers ran before every tick
+        self.assertEqual(reactor.runUntilCurrent.call_count, 3)
+        self.assertEqual(protocol.host.dropped_packets, 1)
+        self.assertEqual(replay.ticks, 3)
+        self.assertEqual(replay.duration, 1.0)
+        self.assertEqual((replay.connects, replay.packets, replay.disconnects),
+                         (1, 3, 1))
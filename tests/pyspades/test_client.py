@@ -0,0 +1,92 @@
+"""
+test pyspades/client.py
+"""
+import zlib
+from unittest.mock import Mock
+
+from twisted.trial import unittest
+
+from pyspades import contained as loaders
+from pyspades.bytes import ByteReader
+from pyspades.client import ClientConnection
+from pyspades.packet import load_client_packet
+from pyspades.vxl import VXLData
+
+
+def make_state_data(player_id):
+    state_data = loaders.StateData()
+    state_data.player_id = player_id
+    state_data.fog_color = (1, 2, 3)
+    state_data.team1_color = (0, 0, 255)
+    state_data.team2_color = (0, 255, 0)
+    state_data.team1_name = 'Blue'
+    state_data.team2_name = 'Green'
+    state_data.state = loaders.CTFState()
+    return state_data
+
+
+class TestClientConnection(unittest.TestCase):
+    def setUp(self):
+        self.sent = []
+        self.peer = Mock()
+        self.peer.send.side_effect = self.record
+        self.connection = ClientConnection(Mock(), self.peer)
+        self.connection.on_connect()
+
+    def record(self, channel, packet):
+        self.sent.append(load_client_packet(ByteReader(packet.data)))
+
+    def receive(self, contained):
+        self.connection.loader_received(Mock(data=contained.encode()))
+
+    def test_handshake(self):
+        self.receive(loaders.HandShakeInit())
+        self.receive(loaders.VersionRequest())
+        handshake_return, version_response = self.sent
+        self.assertEqual(handshake_return.success, 1)
+        self.assertEqual(version_response.client, 'p')
+        self.assertEqual(version_response.os_info, 'pyspades client')
+
+    def test_join(self):
+        vxl = VXLData()
+        vxl.set_point(10, 10, 40, (1, 2, 3))
+        data = zlib.compress(vxl.generate())
+        connection = self.connection
+        connection.load_map = True
+        map_start = loaders.MapStart()
+        map_start.size = len(data)
+        self.receive(map_start)
+        for i in range(0, len(data), 8192):
+            map_chunk = loaders.MapChunk()
+            map_chunk.data = data[i:i + 8192]
+            self.receive(map_chunk)
+        self.receive(make_state_data(3))
+        self.assertEqual(connection.player_id, 3)
+        self.assertEqual(connection.map_bytes, len(data))
+        self.assertEqual(connection.map.get_color(10, 10, 40), (1, 2, 3))
+        self.assertIsNotNone(connection.get_map_time())
+        existing_player, = self.sent
+        self.assertEqual((existing_player.player_id, existing_player.name),
+                         (3, 'Deuce'))
+
+        create_player = loaders.CreatePlayer()
+        create_player.player_id = 3
+        create_player.x, create_player.y, create_player.z = 1.0, 2.0, 3.0
+        create_player.name = 'Deuce'
+        self.receive(create_player)
+        self.assertTrue(connection.joined)
+        self.assertTrue(connection.alive)
+        self.assertEqual(connection.position, (1.0, 2.0, 3.0))
+
+        # the server only sends the slots up to the highest player id
+        world_update = loaders.WorldUpdate()
+        world_update.items = [((0.0, 0.0, 0.0), (1.0, 0.0, 0.0))] * 3 + [
+            ((5.0, 6.0, 7.0), (1.0, 0.0, 0.0))]
+        self.receive(world_update)
+        self.assertEqual(connection.position, (5.0, 6.0, 7.0))
+        self.assertEqual(connection.bad_packets, 0)
+
+        kill_action = loaders.KillAction()
+        kill_action.player_id = 3
+        self.receive(kill_action)
+        self.assertFalse(connection.alive)
@@ -0,0 +1,60 @@
+"""
+test pyspades/interest.py
+"""
+import random
+from unittest.mock import Mock
+
+from twisted.trial import unittest
+
+from pyspades import contained as loaders
+from pyspades.common import Vertex3
+from pyspades.interest import InterestPolicy, GridInterestPolicy
+
+
+def make_player(x, y):
+    player = Mock()
+    player.world_object.position = Vertex3(x, y, 30)
+    return player
+
+
+class TestGridInterestPolicy(unittest.TestCase):
+    def test_default(self):
+        self.assertIsNone(InterestPolicy().get_excluded((0, 0, 0)))
+
+    def test_excluded(self):
+        rng = random.Random(0)
+        players = {i: make_player(rng.uniform(0, 512), rng.uniform(0, 512))
+                   for i in range(32)}
+        protocol = Mock(players=players)
+        policy = GridInterestPolicy(100)
+        policy.update(protocol)
+        for _ in range(50):
+            x, y = rng.uniform(0, 512), rng.uniform(0, 512)
+            expected = {
+                player for player in players.values()
+                if ((player.world_object.position.x - x) ** 2 +
+                    (player.world_object.position.y - y) ** 2) > 100 ** 2}
+            self.assertEqual(policy.get_excluded((x, y, 0)), expected)
+
+    def test_resend(self):
+        near = make_player(10, 10)
+        far = make_player(400, 400)
+        protocol = Mock(players={0: near, 1: far})
+        policy = GridInterestPolicy(128)
+        policy.update(protocol)
+
+        input_data = loaders.InputData()
+        input_data.player_id = 0
+        input_data.up = True
+        policy.remember(near, input_data.encode())
+        # one-off events are not sent again
+        policy.remember(near, loaders.WeaponReload().encode())
+
+        far.world_object.position.set(20, 20, 30)
+        policy.update(protocol)
+        far.send_packet.assert_called_once()
+        self.assertEqual(policy.packets_resent, 1)
+
+        # no resend while staying in range
+        policy.update(protocol)
+        far.send_packet.assert_called_once()
@@ -0,0 +1,124 @@
+"""
+test pyspades/joinbuffer.py
+"""
+from twisted.trial import unittest
+
+from pyspades import contained as loaders
+from pyspades.bytes import ByteReader
+from pyspades.common import get_color, make_color
+from pyspades.constants import BUILD_BLOCK, DESTROY_BLOCK, SPADE_DESTROY
+from pyspades.joinbuffer import JoinBuffer
+from pyspades.vxl import VXLData
+from pyspades.world import cube_line
+
+
+def encode(contained, **values):
+    for name, value in values.items():
+        setattr(contained, name, value)
+    return contained.encode()
+
+
+def set_color(player_id, color):
+    return encode(loaders.SetColor(), player_id=player_id,
+                  value=make_color(*color))
+
+
+def block_action(player_id, point, value=BUILD_BLOCK):
+    x, y, z = point
+    return encode(loaders.BlockAction(), player_id=player_id, x=x, y=y, z=z,
+                  value=value)
+
+
+def apply_edits(map_, packets):
+    """apply the map edits of the encoded packets to map_, like a client"""
+    colors = {}
+    for data in packets:
+        packet_id = data[0]
+        if packet_id == loaders.SetColor.id:
+            contained = loaders.SetColor(ByteReader(data[1:]))
+            colors[contained.player_id] = get_color(contained.value)
+        elif packet_id == loaders.BlockLine.id:
+            contained = loaders.BlockLine(ByteReader(data[1:]))
+            for point in cube_line(contained.x1, contained.y1, contained.z1,
+                                   contained.x2, contained.y2, contained.z2):
+                map_.set_point(*point, colors[contained.player_id])
+        elif packet_id == loaders.BlockAction.id:
+            contained = loaders.BlockAction(ByteReader(data[1:]))
+            point = (contained.x, contained.y, contained.z)
+            if contained.value == BUILD_BLOCK:
+                map_.set_point(*point, colors[contained.player_id])
+            elif contained.value == DESTROY_BLOCK:
+                map_.remove_point(*point)
+            elif contained.value == SPADE_DESTROY:
+                for z in range(contained.z - 1, contained.z + 2):
+                    map_.remove_point(contained.x, contained.y, z)
+
+
+class TestJoinBuffer(unittest.TestCase):
+    def test_state(self):
+        buffer = JoinBuffer()
+        kill = encode(loaders.KillAction(), player_id=1, killer_id=2,
+                      kill_type=0, respawn_time=5)
+        buffer.append(encode(loaders.FogColor(), color=1))
+        buffer.append(set_color(1, (1, 2, 3)))
+        buffer.append(kill)
+        buffer.append(set_color(2, (1, 2, 3)))
+        buffer.append(set_color(1, (4, 5, 6)))
+        fog = encode(loaders.FogColor(), color=2)
+        buffer.append(fog)
+        self.assertEqual(list(buffer), [kill, set_color(2, (1, 2, 3)),
+                                        set_color(1, (4, 5, 6)), fog])
+        self.assertEqual(len(buffer), 4)
+        self.assertEqual(buffer.size, sum(len(data) for data in buffer))
+        # the state of players that left is dropped with them
+        left = encode(loaders.PlayerLeft(), player_id=1)
+        buffer.append(left)
+        self.assertEqual(list(buffer), [kill, set_color(2, (1, 2, 3)), fog,
+                                        left])
+        self.assertEqual(buffer.stats.packets_dropped, 3)
+
+    def test_capture(self):
+        buffer = JoinBuffer()
+        capture = encode(loaders.IntelCapture(), player_id=1, winning=1)
+        pickup = encode(loaders.IntelPickup(), player_id=1)
+        buffer.extend([capture, capture, pickup, capture])
+        self.assertEqual(list(buffer), [capture, pickup, capture])
+
+    def test_map_edits(self):
+        buffer = JoinBuffer()
+        packets = [set_color(1, (1, 2, 3)), block_action(1, (1, 1, 40)),
+                   set_color(1, (4, 5, 6))]
+        buffer.extend(packets)
+        # without a snapshot, edits are kept with the colors they need
+        self.assertEqual(list(buffer), packets)
+        self.assertEqual(buffer.get_map_packets(VXLData()), [])
+        buffer.set_snapshot(VXLData())
+        self.assertIsNone(buffer.snapshot)
+
+    def test_snapshot(self):
+        snapshot = VXLData()
+        for x in range(10, 20):
+            for z in range(40, 50):
+                snapshot.set_point(x, 10, z, (1, 2, 3))
+        map_ = snapshot.copy()
+        buffer = JoinBuffer()
+        buffer.set_snapshot(snapshot)
+        for i in range(100):
+            point = (30, 30, 40)
+            map_.set_point(*point, (i, 0, 0))
+            buffer.append(set_color(1, (i, 0, 0)))
+            buffer.append(block_action(1, point))
+            map_.remove_point(*point)
+            buffer.append(block_action(1, point, DESTROY_BLOCK))
+        for x in range(10, 20):
+            map_.remove_point(x, 10, 40)
+            buffer.append(block_action(1, (x, 10, 40), DESTROY_BLOCK))
+        for y in range(20, 30):
+            map_.set_point(5, y, 40, (7, 8, 9))
+            buffer.append(block_action(1, (5, y, 40)))
+        self.assertEqual(list(buffer), [set_color(1, (99, 0, 0))])
+
+        packets = buffer.get_packets(map_)
+        self.assertLess(len(packets), 20)
+        apply_edits(snapshot, packets)
+        self.assertEqual(snapshot.generate(), map_.generate())
@@ -0,0 +1,141 @@
+"""
+test pyspades/mapedit.py
+"""
+from unittest.mock import Mock
+
+from twisted.trial import unittest
+
+from pyspades import contained as loaders
+from pyspades.bytes import ByteReader
+from pyspades.constants import BUILD_BLOCK, DESTROY_BLOCK, SPADE_DESTROY
+from pyspades.mapedit import MapEditQueue, get_destroy_groups
+from pyspades.vxl import VXLData
+
+
+class TestMapEditQueue(unittest.TestCase):
+    def setUp(self):
+        self.packets = []
+        self.protocol = Mock()
+        self.protocol.map = VXLData()
+        self.protocol.connections = {}
+        self.protocol.broadcast_contained.side_effect = self.record
+        self.queue = MapEditQueue(self.protocol)
+
+    def record(self, contained, save=False):
+        self.assertTrue(save)
+        # the packet id is read by the caller of read
+        self.packets.append(
+            type(contained)(ByteReader(contained.encode()[1:])))
+
+    def add_player(self, in_transit):
+        player = Mock(player_id=len(self.protocol.connections),
+                      saved_loaders=None)
+        player.peer.reliableDataInTransit = in_transit
+        self.protocol.connections[player.player_id] = player
+        return player
+
+    def test_build(self):
+        points = [(x, 10, 40) for x in range(10, 20)] + [(30, 30, 30)]
+        self.protocol.map.set_point(15, 10, 40, (1, 1, 1))
+        d = self.queue.build(points, (1, 2, 3))
+        # nothing is applied before it is sent
+        self.assertFalse(self.protocol.map.get_solid(10, 10, 40))
+        self.queue.update()
+        self.assertEqual(self.successResultOf(d), 10)
+        self.assertEqual(len(self.queue), 0)
+        self.assertEqual([type(packet) for packet in self.packets],
+                         [loaders.SetColor, loaders.BlockLine,
+                          loaders.BlockLine, loaders.BlockAction])
+        line = self.packets[1]
+        self.assertEqual((line.x1, line.x2, line.player_id), (10, 14, 32))
+        self.assertEqual(self.packets[3].value, BUILD_BLOCK)
+        self.assertEqual(self.protocol.map.get_color(19, 10, 40), (1, 2, 3))
+        # the block that was already solid is kept
+        self.assertEqual(self.protocol.map.get_color(15, 10, 40), (1, 1, 1))
+
+    def test_destroy(self):
+        for z in range(40, 45):
+            self.protocol.map.set_point(10, 10, z, (1, 2, 3))
+        d = self.queue.destroy([(10, 10, z) for z in range(40, 45)] +
+                               [(20, 20, 40)])
+        self.queue.update()
+        self.assertEqual(self.successResultOf(d), 5)
+        self.assertEqual([(packet.z, packet.value) for packet in self.packets],
+                         [(41, SPADE_DESTROY), (43, DESTROY_BLOCK),
+                          (44, DESTROY_BLOCK)])
+        self.assertFalse(self.protocol.map.get_solid(10, 10, 42))
+
+    def test_destroy_groups(self):
+        points = [(1, 1, z) for z in (5, 6, 7, 8, 10, 11, 12)] + [(1, 2, 5)]
+        self.assertEqual(get_destroy_groups(points),
+                         [(1, 1, 6, SPADE_DESTROY), (1, 1, 8, DESTROY_BLOCK),
+                          (1, 1, 11, SPADE_DESTROY), (1, 2, 5, DESTROY_BLOCK)])
+
+    def test_paced(self):
+        self.queue.packets_per_tick = 3
+        # a checkerboard can't be built with lines
+        points = [(x, y, 40) for x in range(4) for y in range(4)
+                  if (x + y) % 2]
+        d = self.queue.build(points, (1, 2, 3))
+        self.queue.update()
+        # the SetColor counts as well
+        self.assertEqual(len(self.packets), 3)
+        slow = self.add_player(self.queue.max_in_transit + 1)
+        self.add_player(0)
+        self.queue.update()
+        self.assertEqual(len(self.packets), 3)
+        self.assertEqual(self.queue.paused_ticks, 1)
+        # players downloading the map don't hold the queue back
+        slow.saved_loaders = []
+        self.queue.update()
+        self.assertEqual(len(self.packets), 6)
+        while self.queue:
+            self.queue.update()
+        self.assertEqual(self.successResultOf(d), 8)
+        # and the color is sent again on every tick
+        self.assertEqual(
+            [type(packet) for packet in self.packets].count(loaders.SetColor),
+            4)
+
+    def test_slow_player_skipped(self):
+        self.queue.max_paused_ticks = 2
+        slow = self.add_player(self.queue.max_in_transit + 1)
+        self.add_player(0)
+        d = self.queue.build([(x, x, 40) for x in range(10)], (1, 2, 3))
+        self.queue.update()
+        self.queue.update()
+        self.assertEqual(self.packets, [])
+        self.assertEqual(self.queue.paused_ticks, 2)
+        # a player that stays behind no longer holds everyone back
+        self.queue.update()
+        self.assertEqual(self.successResultOf(d), 10)
+        # but is waited for again once it caught up and falls behind anew
+        slow.peer.reliableDataInTransit = 0
+        self.queue.build([(1, 1, 41)], (1, 2, 3))
+        self.queue.update()
+        slow.peer.reliableDataInTransit = self.queue.max_in_transit + 1
+        d = self.queue.build([(2, 2, 41)], (1, 2, 3))
+        self.queue.update()
+        self.assertNoResult(d)
+
+    def test_unpaced(self):
+        self.queue.packets_per_tick = 1
+        self.add_player(self.queue.max_in_transit + 1)
+        queued = self.queue.build([(1, 1, 40)], (1, 2, 3))
+        d = self.queue.build([(x, x, 40) for x in range(10)], (1, 2, 3),
+                             paced=False)
+        self.assertEqual(self.successResultOf(d), 10)
+        self.assertTrue(self.protocol.map.get_solid(9, 9, 40))
+        self.assertEqual(len(self.packets), 11)
+        self.assertEqual(len(self.queue), 1)
+        self.assertNoResult(queued)
+        self.protocol.update_entities.assert_called_once_with()
+
+    def test_clear(self):
+        first = self.queue.build([(1, 1, 40)], (1, 2, 3), tag='first')
+        second = self.queue.build([(2, 2, 40)], (1, 2, 3))
+        self.queue.clear(tag='first')
+        self.assertEqual(self.successResultOf(first), 0)
+        self.queue.update()
+        self.assertEqual(self.successResultOf(second), 1)
+        self.assertFalse(self.protocol.map.get_solid(1, 1, 40))
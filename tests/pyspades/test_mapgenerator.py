@@ -1,11 +1,61 @@
 """
-test pyspades/protocol.py
+test pyspades/mapgenerator.py
 """
+import zlib
 
 from pyspades import mapgenerator
+from pyspades.vxl import VXLData
 
 from twisted.trial import unittest
 
 class TestMapGenerator(unittest.TestCase):
     def test_dummy(self):
         pass
+
+
+class TestCompressedMap(unittest.TestCase):
+    def test_snapshot(self):
+        vxl = VXLData()
+        vxl.set_point(10, 10, 40, (1, 2, 3))
+        expected = vxl.generate()
+        compressed = mapgenerator.CompressedMap(vxl)
+        # later edits don't show up in the snapshot
+        vxl.set_point(20, 20, 40, (1, 2, 3))
+        self.assertFalse(compressed.ready())
+        compressed.build()
+        self.assertTrue(compressed.ready())
+        self.assertEqual(zlib.decompress(compressed.data), expected)
+
+    def test_reader(self):
+        compressed = mapgenerator.CompressedMap(VXLData())
+        compressed.build()
+        reader = mapgenerator.CompressedMapReader(compressed)
+        self.assertEqual(reader.get_size(), len(compressed.data))
+        data = b''
+        while reader.data_left():
+            data += reader.read(8192)
+        self.assertEqual(data, compressed.data)
+        # the snapshot is kept to compare clients' maps with
+        self.assertIsNotNone(reader.snapshot)
+
+    def test_reader_edits(self):
+        compressed = mapgenerator.CompressedMap(VXLData(), seed=[b'seed'])
+        reader = mapgenerator.CompressedMapReader(compressed, [b'extra'])
+        # nothing to replay if only the seed was recorded
+        self.assertEqual(reader.edits, [])
+
+        compressed.edits.append(b'edit')
+        reader = mapgenerator.CompressedMapReader(compressed, [b'extra'])
+        compressed.edits.append(b'later')
+        self.assertEqual(reader.edits, [b'seed', b'edit', b'extra'])
+
+    def test_needs_snapshot(self):
+        cache = mapgenerator.MapTransferCache()
+        cache.max_edits = 2
+        self.assertFalse(cache.needs_snapshot())
+        cache.current = mapgenerator.CompressedMap(VXLData(), seed=[b'seed'])
+        cache.record(b'one')
+        self.assertEqual(cache.get_edit_count(), 1)
+        self.assertFalse(cache.needs_snapshot())
+        cache.record(b'two')
+        self.assertTrue(cache.needs_snapshot())
@@ -44,8 +44,8 @@ class GrenadeExplosionTest(unittest.TestCase):
         """
         self.mock_protocol = Mock()
         self.mock_protocol.map = Mock()
-        # by default, destroy_point returns 0 => no blocks destroyed
-        self.mock_protocol.map.destroy_point = Mock(return_value=0)
+        # by default, destroy_region returns 0 => no blocks destroyed
+        self.mock_protocol.map.destroy_region = Mock(return_value=(0, []))
 
         # Create the "player" with a name and a non-spectator team
         self.player = player.ServerConnection(self.mock_protocol, Mock())
@@ -53,8 +53,8 @@ class GrenadeExplosionTest(unittest.TestCase):
         self.player.team = Mock(spec=Team)
         self.player.team.spectator = False
         self.player.team.other = Mock()
-        # By default, no other players are returned
-        self.player.team.other.get_players = Mock(return_value=[])
+        # By default, no other players are near the grenade
+        self.mock_protocol.get_players_in_box = Mock(return_value=[])
         self.player.player_id = 1
         self.player.world_object = Mock()  # needed if e.g. on_hit references it
 
@@ -89,7 +89,7 @@ class GrenadeExplosionTest(unittest.TestCase):
         self.player.grenade_exploded(self.mock_grenade)
         # If this function "returns" early, no calls to 'on_hit' or block destruction happen.
         self.player.on_hit.assert_not_called()
-        self.player.protocol.map.destroy_point.assert_not_called()
+        self.player.protocol.map.destroy_region.assert_not_called()
 
     def test_ignore_no_name(self):
         """
@@ -98,7 +98,7 @@ class GrenadeExplosionTest(unittest.TestCase):
         self.player.name = None
         self.player.grenade_exploded(self.mock_grenade)
         self.player.on_hit.assert_not_called()
-        self.player.protocol.map.destroy_point.assert_not_called()
+        self.player.protocol.map.destroy_region.assert_not_called()
 
     def test_ignore_enemy_grenade(self):
         """
@@ -110,7 +110,7 @@ class GrenadeExplosionTest(unittest.TestCase):
 
         self.player.grenade_exploded(self.mock_grenade)
         self.player.on_hit.assert_not_called()
-        self.player.protocol.map.destroy_point.assert_not_called()
+        self.player.protocol.map.destroy_region.assert_not_called()
 
     def test_ignore_out_of_bounds(self):
         """
@@ -121,7 +121,7 @@ class GrenadeExplosionTest(unittest.TestCase):
         self.mock_grenade.position.x = 999
         self.player.grenade_exploded(self.mock_grenade)
         self.player.on_hit.assert_not_called()
-        self.player.protocol.map.destroy_point.assert_not_called()
+        self.player.protocol.map.destroy_region.assert_not_called()
 
     def test_dead_player_skips_damage(self):
         """
@@ -130,7 +130,8 @@ class GrenadeExplosionTest(unittest.TestCase):
         # Suppose we have one "other" player who is dead
         dead_player = Mock()
         dead_player.hp = 0
-        self.player.team.other.get_players.return_value = [dead_player]
+        dead_player.team = self.player.team.other
+        self.mock_protocol.get_players_in_box.return_value = [dead_player]
 
         self.player.grenade_exploded(self.mock_grenade)
         # dead player => skip => no calls to set_hp
@@ -142,7 +143,8 @@ class GrenadeExplosionTest(unittest.TestCase):
         """
         zero_damage_player = Mock()
         zero_damage_player.hp = 100
-        self.player.team.other.get_players.return_value = [zero_damage_player]
+        zero_damage_player.team = self.player.team.other
+        self.mock_protocol.get_players_in_box.return_value = [zero_damage_player]
 
         # force get_damage to return 0
         self.mock_grenade.get_damage.return_value = 0
@@ -162,15 +164,21 @@ class GrenadeExplosionTest(unittest.TestCase):
         """
         living_player = Mock()
         living_player.hp = 100
-        self.player.team.other.get_players.return_value = [living_player]
+        living_player.team = self.player.team.other
+        self.mock_protocol.get_players_in_box.return_value = [living_player]
 
-        # Provide 27 return values for destroy_point (3x3x3 grid)
-        self.mock_protocol.map.destroy_point.side_effect = [1] * 27  # All blocks are destroyed
+        # All blocks of the 3x3x3 grid are destroyed
+        points = [(x, y, z) for x in range(99, 102) for y in range(99, 102)
+                  for z in range(9, 12)]
+        self.mock_protocol.map.destroy_region.return_value = (27, points)
 
         self.player.grenade_exploded(self.mock_grenade)
 
         # We should have destroyed some blocks
+        self.mock_protocol.map.destroy_region.assert_called_once_with(
+            99, 99, 9, 102, 102, 12)
         self.assertEqual(self.player.total_blocks_removed, 27)  # All 27 blocks destroyed
+        self.assertEqual(self.player.on_block_removed.call_count, 27)
         self.player.protocol.broadcast_contained.assert_called()
         self.player.protocol.update_entities.assert_called()
 
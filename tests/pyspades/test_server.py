@@ -2,9 +2,68 @@
 test pyspades/server.py
 """
 
+import time
+from unittest.mock import Mock, patch
+
 from twisted.trial import unittest
 from pyspades import server
+from pyspades.constants import UPDATE_FREQUENCY
+from pyspades.types import TickStats
 
 class BaseConnectionTest(unittest.TestCase):
     def test_test(self):
         pass
+
+
+def make_protocol(behind):
+    protocol = Mock(spec=server.ServerProtocol)
+    protocol.connections = {}
+    protocol.max_catch_up_steps = 5
+    protocol.loop_count = 0
+    protocol.tick_stats = TickStats()
+    protocol.recorder = None
+    protocol.get_time = time.monotonic
+    now = time.monotonic()
+    protocol.world_time = now - behind * UPDATE_FREQUENCY
+    protocol.last_network_update = now
+    return protocol
+
+
+@patch('pyspades.server.BaseProtocol.update')
+class RunTickTest(unittest.TestCase):
+    def test_step(self, _):
+        protocol = make_protocol(1.5)
+        server.ServerProtocol.run_tick(protocol)
+        self.assertEqual(protocol.world.update.call_count, 1)
+        self.assertEqual(protocol.on_world_update.call_count, 1)
+        stats = protocol.tick_stats.get_stats()
+        self.assertEqual(stats['ticks'], 1)
+        self.assertEqual(stats['steps'], 1)
+        self.assertEqual(stats['dropped_steps'], 0)
+        # no network update was due
+        protocol.update_network.assert_not_called()
+        self.assertEqual(len(protocol.tick_stats.timings['network']), 0)
+
+    def test_catch_up_limit(self, _):
+        protocol = make_protocol(100.5)
+        server.ServerProtocol.run_tick(protocol)
+        self.assertEqual(protocol.world.update.call_count, 5)
+        stats = protocol.tick_stats.get_stats()
+        self.assertEqual(stats['steps'], 5)
+        self.assertGreaterEqual(stats['dropped_steps'], 95)
+        # the world time caught up with the clock
+        self.assertLess(time.monotonic() - protocol.world_time,
+                        UPDATE_FREQUENCY)
+
+    def test_no_limit(self, _):
+        protocol = make_protocol(20.5)
+        protocol.max_catch_up_steps = 0
+        server.ServerProtocol.run_tick(protocol)
+        self.assertGreaterEqual(protocol.world.update.call_count, 20)
+        self.assertEqual(protocol.tick_stats.dropped_steps, 0)
+
+    def test_hook_error(self, _):
+        protocol = make_protocol(1.5)
+        protocol.on_world_update.side_effect = ValueError
+        server.ServerProtocol.run_tick(protocol)
+        self.assertEqual(len(protocol.tick_stats.timings['hooks']), 1)
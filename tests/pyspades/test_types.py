@@ -1,4 +1,4 @@
-from pyspades.types import IDPool, AttributeSet
+from pyspades.types import IDPool, AttributeSet, TimingWindow, TickStats
 import unittest
 
 
@@ -30,3 +30,37 @@ class TestAttributeSet(unittest.TestCase):
         self.assertTrue(atset.new)
         atset.new = 0
         self.assertFalse(atset.new)
+
+
+class TestTimingWindow(unittest.TestCase):
+    def test_empty(self):
+        window = TimingWindow()
+        self.assertEqual(window.percentile(50), 0)
+        self.assertEqual(window.get_stats(), {'p50': 0, 'p99': 0, 'max': 0})
+
+    def test_percentiles(self):
+        window = TimingWindow(size=100)
+        for i in range(1, 101):
+            window.add(i / 1000)
+        self.assertEqual(window.percentile(50), 0.05)
+        self.assertEqual(window.percentile(99), 0.099)
+        self.assertEqual(window.percentile(100), 0.1)
+
+    def test_rolling(self):
+        window = TimingWindow(size=10)
+        for _ in range(10):
+            window.add(1.0)
+        for _ in range(10):
+            window.add(0.001)
+        self.assertEqual(len(window), 10)
+        self.assertEqual(window.get_stats()['max'], 1)
+
+
+class TestTickStats(unittest.TestCase):
+    def test_stats(self):
+        stats = TickStats()
+        stats.record('world', 0.002)
+        phases = stats.get_stats()['phases']
+        self.assertEqual(set(phases), set(TickStats.phases))
+        self.assertEqual(phases['world']['p99'], 2)
+        self.assertEqual(phases['enet']['p99'], 0)
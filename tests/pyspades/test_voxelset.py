@@ -0,0 +1,75 @@
+"""
+test pyspades/voxelset.pyx
+"""
+import random
+
+from twisted.trial import unittest
+
+from pyspades.voxelset import VoxelSet, VoxelMap
+
+
+class TestVoxelSet(unittest.TestCase):
+    def test_matches_set(self):
+        rng = random.Random(0)
+        voxels = VoxelSet()
+        reference = set()
+        for _ in range(5000):
+            point = (rng.randrange(512), rng.randrange(512), rng.randrange(64))
+            if rng.random() < 0.3 and reference:
+                point = rng.choice(sorted(reference))
+                voxels.discard(point)
+                reference.discard(point)
+            else:
+                voxels.add(point)
+                reference.add(point)
+        self.assertEqual(len(voxels), len(reference))
+        self.assertEqual(set(voxels), reference)
+        for point in reference:
+            self.assertIn(point, voxels)
+            self.assertTrue(voxels.contains(*point))
+
+    def test_bounds(self):
+        voxels = VoxelSet([(511, 511, 63)])
+        self.assertNotIn((511, 511, 64), voxels)
+        self.assertNotIn((-1, 0, 0), voxels)
+        self.assertNotIn("not a point", voxels)
+        self.assertRaises(ValueError, voxels.add, (0, 0, 64))
+        voxels.discard((512, 0, 0))
+        self.assertRaises(KeyError, voxels.remove, (0, 0, 0))
+
+    def test_count_box(self):
+        voxels = VoxelSet((x, y, z) for x in range(2) for y in range(3)
+                          for z in range(60, 64))
+        self.assertEqual(voxels.count_box(-1, -1, 59, 5, 5, 70), 24)
+        self.assertEqual(voxels.count_box(0, 0, 61, 1, 1, 63), 2)
+        self.assertEqual(voxels.count_box(0, 0, 0, 1, 1, 60), 0)
+        self.assertEqual(voxels.count_box(3, 3, 3, 3, 3, 3), 0)
+
+    def test_memory(self):
+        voxels = VoxelSet([(0, 0, 0), (15, 15, 63)])
+        usage = voxels.get_memory_usage()
+        voxels.add((16, 0, 0))
+        self.assertEqual(voxels.get_memory_usage(), usage * 2)
+        voxels.difference_update([(0, 0, 0), (15, 15, 63), (16, 0, 0)])
+        self.assertEqual(voxels.get_memory_usage(), 0)
+        self.assertEqual(len(voxels), 0)
+
+
+class TestVoxelMap(unittest.TestCase):
+    def test_mapping(self):
+        voxels = VoxelMap()
+        voxels.set_points([(1, 2, 3), (4, 5, 6)], ('builder', 0))
+        voxels[(511, 511, 63)] = ('other', 1)
+        self.assertEqual(len(voxels), 3)
+        self.assertEqual(voxels[(1, 2, 3)], ('builder', 0))
+        self.assertEqual(voxels.get((1, 2, 4)), None)
+        self.assertRaises(KeyError, lambda: voxels[(1, 2, 4)])
+        self.assertEqual(voxels.pop((4, 5, 6)), ('builder', 0))
+        self.assertEqual(voxels.pop_point(4, 5, 6), None)
+        self.assertNotIn((4, 5, 6), voxels)
+        self.assertEqual(sorted(voxels.items()),
+                         [((1, 2, 3), ('builder', 0)),
+                          ((511, 511, 63), ('other', 1))])
+        del voxels[(1, 2, 3)]
+        self.assertEqual(list(voxels), [(511, 511, 63)])
+        self.assertRaises(ValueError, voxels.set_point, 0, 512, 0, None)
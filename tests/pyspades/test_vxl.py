@@ -0,0 +1,287 @@
+"""
+tests for pyspades/vxl.pyx
+"""
+import io
+import os
+import tempfile
+
+from twisted.trial import unittest
+
+from pyspades.vxl import VXLData
+
+
+class TestVXLData(unittest.TestCase):
+    def test_set_get_color(self):
+        vxl = VXLData()
+        vxl.set_point(10, 20, 30, (1, 2, 3))
+        vxl.set_point(10, 20, 5, (4, 5, 6))
+        vxl.set_point(10, 20, 63, (7, 8, 9))
+        self.assertEqual(vxl.get_color(10, 20, 30), (1, 2, 3))
+        self.assertEqual(vxl.get_color(10, 20, 5), (4, 5, 6))
+        self.assertEqual(vxl.get_color(10, 20, 63), (7, 8, 9))
+
+        # overwriting keeps the other colors of the column intact
+        vxl.set_point(10, 20, 30, (10, 11, 12))
+        self.assertEqual(vxl.get_color(10, 20, 30), (10, 11, 12))
+        self.assertEqual(vxl.get_color(10, 20, 5), (4, 5, 6))
+
+    def test_remove_point(self):
+        vxl = VXLData()
+        for z in range(10, 20):
+            vxl.set_point(511, 511, z, (z, z, z))
+        vxl.remove_point(511, 511, 15)
+        self.assertEqual(vxl.get_color(511, 511, 15), None)
+        self.assertFalse(vxl.get_solid(511, 511, 15))
+        for z in (10, 14, 16, 19):
+            self.assertEqual(vxl.get_color(511, 511, z), (z, z, z))
+
+    def test_copy_is_independent(self):
+        vxl = VXLData()
+        vxl.set_point(100, 100, 40, (1, 2, 3))
+        copy = vxl.copy()
+        vxl.set_point(100, 100, 40, (4, 5, 6))
+        vxl.remove_point(100, 100, 40)
+        self.assertEqual(copy.get_color(100, 100, 40), (1, 2, 3))
+
+    def test_changed_chunks(self):
+        vxl = VXLData()
+        copy = vxl.copy()
+        self.assertEqual(vxl.get_changed_chunks(copy), [])
+        vxl.set_point(100, 200, 40, (1, 2, 3))
+        copy.set_point(511, 0, 40, (1, 2, 3))
+        self.assertEqual(vxl.get_changed_chunks(copy), [(496, 0), (96, 192)])
+        self.assertEqual(len(vxl.get_changed_chunks(VXLData())), 1024)
+
+    def test_diff(self):
+        vxl = VXLData()
+        for z in range(40, 63):
+            vxl.set_point(10, 10, z, (1, 2, 3))
+        other = vxl.copy()
+        self.assertEqual([list(edits) for edits in vxl.diff(other)],
+                         [[], [], []])
+        # a removed voxel, a block of filled voxels with its inside, and a
+        # recolored voxel
+        other.remove_point(10, 10, 40)
+        for x in range(20, 23):
+            for y in range(20, 23):
+                for z in range(60, 63):
+                    other.set_point(x, y, z, (4, 5, 6))
+        other.set_point(10, 10, 41, (7, 8, 9))
+        removals, fills, surface = vxl.diff(other)
+        self.assertEqual(list(removals), [10, 10, 40, 10, 10, 41])
+        self.assertEqual(list(fills), [21, 21, 61])
+        self.assertEqual(len(surface), 4 * 27)
+        self.assertEqual(list(surface[:8]), [10, 10, 41, 0x070809,
+                                             20, 20, 60, 0x040506])
+        # the region is exclusive
+        self.assertEqual([len(edits) for edits in vxl.diff(other, 0, 0, 20,
+                                                           20)],
+                         [6, 0, 4])
+
+        # applying the edits turns one map into the other
+        for i in range(0, len(removals), 3):
+            vxl.remove_point(*removals[i:i + 3])
+        for i in range(0, len(fills), 3):
+            vxl.set_point(*fills[i:i + 3], (0, 0, 0))
+        for i in range(0, len(surface), 4):
+            color = surface[i + 3]
+            vxl.set_point(*surface[i:i + 3], ((color >> 16) & 0xFF,
+                                              (color >> 8) & 0xFF,
+                                              color & 0xFF))
+        self.assertEqual([list(edits) for edits in vxl.diff(other)],
+                         [[], [], []])
+
+        # voxels beside the edges of the map count as open, as in is_surface,
+        # so the edges are on the surface
+        other = vxl.copy()
+        for x in (0, 1):
+            for y in (0, 1):
+                for z in range(60, 63):
+                    other.set_point(x, y, z, (4, 5, 6))
+        removals, fills, surface = vxl.diff(other)
+        self.assertEqual(list(fills), [])
+        self.assertEqual(len(surface), 4 * 12)
+        self.assertTrue(other.is_surface(0, 0, 61))
+
+    def test_overview_region(self):
+        vxl = VXLData()
+        vxl.set_point(100, 200, 40, (0x11, 0x22, 0x33))
+        region = vxl.get_overview(x1=96, y1=192, x2=112, y2=208)
+        self.assertEqual(len(region), 16 * 16 * 4)
+        index = (8 * 16 + 4) * 4
+        self.assertEqual(region[index:index + 4], b'\x33\x22\x11\xff')
+        full = vxl.get_overview()
+        for row in range(16):
+            start = ((192 + row) * 512 + 96) * 4
+            self.assertEqual(full[start:start + 64],
+                             region[row * 64:(row + 1) * 64])
+
+    def test_generate_roundtrip(self):
+        vxl = VXLData()
+        for x in range(0, 512, 7):
+            for y in range(0, 512, 11):
+                vxl.set_column_fast(x, y, 40, 63, 45, x | (y << 8))
+        data = vxl.generate()
+        loaded = VXLData(io.BytesIO(data))
+        self.assertEqual(loaded.generate(), data)
+        self.assertEqual(loaded.get_color(7, 11, 40),
+                         vxl.get_color(7, 11, 40))
+
+    def make_caves(self):
+        vxl = VXLData()
+        for x in range(0, 512, 3):
+            for y in range(0, 512, 5):
+                vxl.set_column_fast(x, y, 20, 63, 22, x | (y << 8))
+                vxl.set_column_fast(x, y, 5, 10, 10, 0x123456)
+                vxl.remove_point(x, y, 40)
+        return vxl
+
+    def test_load_file(self):
+        data = self.make_caves().generate()
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'caves.vxl')
+            with open(filename, 'wb') as fp:
+                fp.write(data)
+            with open(filename, 'rb') as fp:
+                loaded = VXLData(fp)
+        self.assertEqual(loaded.generate(), data)
+        for threads in (1, 3):
+            loaded = VXLData(io.BytesIO(data), threads=threads)
+            self.assertEqual(loaded.generate(), data)
+        self.assertEqual(loaded.get_color(3, 5, 10), (0x12, 0x34, 0x56))
+        self.assertEqual(loaded.get_color(3, 5, 40), None)
+        self.assertTrue(loaded.get_solid(3, 5, 30))
+
+        loaded.load_vxl(memoryview(data))
+        self.assertEqual(loaded.generate(), data)
+        loaded.load_vxl()
+        self.assertFalse(loaded.get_solid(3, 5, 30))
+
+    def test_load_invalid(self):
+        data = self.make_caves().generate()
+        self.assertRaises(ValueError, VXLData, io.BytesIO(data[:-100]))
+        self.assertRaises(ValueError, VXLData, io.BytesIO(b''))
+        vxl = VXLData()
+        vxl.set_point(1, 2, 3, (1, 2, 3))
+        self.assertRaises(ValueError, vxl.load_vxl, data[:len(data) // 2])
+        self.assertEqual(vxl.get_color(1, 2, 3), (1, 2, 3))
+
+    def test_load_bad_spans(self):
+        data = self.make_caves().generate()
+        # spans in front of the first column whose top colors end before
+        # they start, or don't fit in the span
+        for span in (b'\x02\x0a\x03\x00', b'\x02\x00\x05\x00',
+                     b'\x02\x00\x01\x00'):
+            bad = span + b'\x00' * 4 + data
+            for threads in (1, 3):
+                self.assertRaises(ValueError, VXLData, io.BytesIO(bad),
+                                  threads=threads)
+
+    def test_generation(self):
+        vxl = VXLData()
+        generation = vxl.generation
+        vxl.set_point(1, 2, 3, (1, 2, 3))
+        self.assertNotEqual(vxl.generation, generation)
+
+    def test_generator_reads_snapshot(self):
+        vxl = VXLData()
+        vxl.set_column_fast(0, 0, 30, 63, 35, 0x123456)
+        expected = b''.join(iter(vxl.get_generator().get_data, None))
+
+        generator = vxl.get_generator()
+        vxl.destroy_point(0, 0, 30)
+        vxl.set_point(0, 0, 20, (1, 2, 3))
+        vxl.set_point(300, 300, 20, (1, 2, 3))
+        data = b''.join(iter(generator.get_data, None))
+        self.assertEqual(data, expected)
+        self.assertNotEqual(vxl.generate(), expected)
+
+    def make_bridge(self):
+        vxl = VXLData()
+        for x in range(100, 140):
+            for y in range(100, 104):
+                vxl.set_column_fast(x, y, 30, 31, 31, 0x123456)
+        for x in (100, 139):
+            vxl.set_column_fast(x, 100, 32, 63, 63, 0x654321)
+        return vxl
+
+    def test_destroy_point(self):
+        vxl = self.make_bridge()
+        # still held up by the other pillar
+        self.assertEqual(vxl.destroy_point(100, 100, 40), 1)
+        self.assertTrue(vxl.get_solid(120, 102, 30))
+        self.assertEqual(vxl.check_node(120, 102, 30), 0)
+        # the deck and what is left of both pillars fall
+        self.assertEqual(vxl.destroy_point(139, 100, 40),
+                         1 + 40 * 4 * 2 + 8 + 8)
+        self.assertFalse(vxl.get_solid(120, 102, 30))
+        self.assertEqual(vxl.get_color(120, 102, 30), None)
+        self.assertTrue(vxl.get_solid(100, 100, 41))
+
+    def test_destroy_points(self):
+        points = [(x, y, z) for x in (99, 100, 101) for y in (100, 101, 102)
+                  for z in (33, 34, 35)]
+        points += [(139, 100, 50), (139, 100, 50), (0, 0, 70)]
+        single = self.make_bridge()
+        count = sum(single.destroy_point(*point) for point in points)
+        batch = self.make_bridge()
+        batch_count, removed = batch.destroy_points(points)
+        self.assertEqual(batch_count, count)
+        self.assertEqual(removed, [(100, 100, 33), (100, 100, 34),
+                                   (100, 100, 35), (139, 100, 50)])
+        self.assertEqual(batch.generate(), single.generate())
+
+    def test_destroy_region(self):
+        single = self.make_bridge()
+        count = 0
+        removed = []
+        for x in range(99, 102):
+            for y in range(99, 102):
+                for z in range(30, 33):
+                    point_count = single.destroy_point(x, y, z)
+                    if point_count:
+                        count += point_count
+                        removed.append((x, y, z))
+        region = self.make_bridge()
+        self.assertEqual(region.destroy_region(99, 99, 30, 102, 102, 33),
+                         (count, removed))
+        self.assertEqual(region.generate(), single.generate())
+        self.assertEqual(region.destroy_region(5, 5, 5, 5, 6, 6), (0, []))
+
+    def test_height_queries(self):
+        vxl = VXLData()
+        # an overhang over a hill: solid at 10-11 and 40-63
+        vxl.set_column_fast(7, 9, 40, 63, 63, 0x112233)
+        vxl.set_column_fast(7, 9, 10, 11, 11, 0x445566)
+        # a pillar from the bottom all the way up
+        vxl.set_column_fast(8, 9, 0, 63, 63, 0x778899)
+
+        def scan_z(x, y, start=0):
+            for z in range(start, 64):
+                if vxl.get_solid(x, y, z):
+                    return z
+            return 0
+
+        def scan_height(x, y):
+            for z in range(63, -1, -1):
+                if not vxl.get_solid(x, y, z):
+                    return z + 1
+            return 0
+
+        for x, y in ((7, 9), (8, 9), (0, 0), (-1, 5), (512, 0)):
+            for start in (-5, 0, 10, 12, 40, 63, 64):
+                self.assertEqual(vxl.get_z(x, y, start), scan_z(x, y, start))
+            self.assertEqual(vxl.get_height(x, y), scan_height(x, y))
+
+        # 11 is still held up by the pillar next to it
+        vxl.destroy_point(7, 9, 10)
+        self.assertEqual(vxl.get_z(7, 9), 11)
+        vxl.remove_point(7, 9, 11)
+        self.assertEqual(vxl.get_z(7, 9), 40)
+        self.assertEqual(vxl.count_land(-10, -10, 600, 600), 2)
+        self.assertEqual(vxl.count_land(8, 0, 9, 512), 1)
+
+        overview = vxl.get_overview()
+        self.assertEqual(len(overview), 512 * 512 * 4)
+        index = (9 * 512 + 7) * 4
+        self.assertEqual(overview[index:index + 4], b'\x33\x22\x11\xff')
@@ -27,3 +27,135 @@ class WorldTest(unittest.TestCase):
                        (18, 17, 11), (18, 17, 12), (19, 17, 12), (19, 18, 12),
                        (20, 18, 12), (20, 19, 12), (21, 19, 12)]
         self.assertEqual(line, line_should)
+
+    def test_world_update(self):
+        from pyspades import contained as loaders
+        from pyspades.common import Vertex3
+
+        w = world.World()
+        first = w.create_object(world.Character, Vertex3(1, 2, 3), None)
+        second = w.create_object(world.Character, Vertex3(4, 5, 6), None)
+        first.orientation.set(1, 0, 0)
+        second.orientation.set(0, 1, 0)
+        w.set_character(0, first)
+        w.set_character(2, second)
+
+        expected = loaders.WorldUpdate()
+        expected.items = [((1, 2, 3), (1, 0, 0)), ((0, 0, 0), (0, 0, 0)),
+                          ((4, 5, 6), (0, 1, 0)), ((0, 0, 0), (0, 0, 0))]
+        world_update = loaders.WorldUpdate()
+        world_update.world = w
+        world_update.count = 4
+        self.assertEqual(world_update.encode(), expected.encode())
+
+        # hidden and deleted characters are sent as zeros
+        first.hidden = True
+        second.delete()
+        expected.items = [((0, 0, 0), (0, 0, 0))] * 4
+        self.assertEqual(world_update.encode(), expected.encode())
+        self.assertEqual(second.player_id, -1)
+
+    def test_spatial_queries(self):
+        from pyspades.common import Vertex3
+        from pyspades.vxl import VXLData
+
+        w = world.World()
+        w.map = VXLData()
+        characters = []
+        for player_id, position in enumerate([(10, 10, 30), (20, 10, 30),
+                                              (200, 300, 30), (-5, 600, 30)]):
+            character = w.create_object(world.Character, Vertex3(*position),
+                                        None)
+            w.set_character(player_id, character)
+            characters.append(character)
+        first, second, far, outside = characters
+
+        self.assertEqual(w.get_characters_in_radius(10, 10, 30, 5), [first])
+        self.assertEqual(w.get_characters_in_radius(15, 10, 30, 5),
+                         [first, second])
+        self.assertEqual(w.get_characters_in_box(0, 0, 0, 512, 512, 63),
+                         [first, second, far])
+        self.assertEqual(w.get_characters_in_box(-10, 590, 0, 0, 610, 63),
+                         [outside])
+        self.assertEqual(w.get_characters_in_box(0, 0, 31, 512, 512, 63), [])
+
+        # moving a character updates its cell right away
+        second.set_position(201, 301, 30)
+        self.assertEqual(w.get_characters_in_radius(200, 300, 30, 2),
+                         [second, far])
+        # and moving it through its position vector on the next update
+        second.position.set(100, 100, 30)
+        w.update(0.0)
+        self.assertEqual(w.get_characters_in_radius(100, 100, 30, 1),
+                         [second])
+
+        second.delete()
+        self.assertEqual(w.get_characters_in_radius(100, 100, 30, 1), [])
+        w.set_character(0, None)
+        self.assertEqual(w.get_characters_in_radius(10, 10, 30, 5), [])
+
+    def test_spatial_queries_during_update(self):
+        from pyspades.common import Vertex3
+        from pyspades.vxl import VXLData
+
+        w = world.World()
+        w.map = VXLData()
+        character = w.create_object(world.Character, Vertex3(15.9, 10, 30),
+                                    None)
+        w.set_character(0, character)
+        # moves the character into the next cell during the update
+        character.velocity.set(5, 0, 0)
+        found = []
+
+        def exploded(grenade):
+            x, y, z = character.position.get()
+            found.append(w.get_characters_in_radius(x, y, z, 0.5))
+        w.create_object(world.Grenade, 0.0, Vertex3(16, 10, 30), None,
+                        Vertex3(0, 0, 0), exploded)
+        w.update(1 / 60.0)
+        self.assertGreater(character.position.x, 16)
+        self.assertEqual(found, [[character]])
+
+    def test_batched_rays(self):
+        from array import array
+        from pyspades.common import Vertex3
+        from pyspades.vxl import VXLData
+
+        w = world.World()
+        w.map = VXLData()
+        # a wall at x = 20 from z = 20 down to the ground
+        for y in range(0, 64):
+            for z in range(20, 63):
+                w.map.set_point(20, y, z, (255, 0, 0))
+        character = w.create_object(world.Character, Vertex3(10, 10, 30),
+                                    None)
+        points = [(15, 10, 30), (30, 10, 30), (30, 10, 10), (10, 30, 30),
+                  (25, 40, 5)]
+        targets = array('f', [value for point in points for value in point])
+        expected = [int(character.can_see(*point)) for point in points]
+        self.assertEqual(expected, [1, 0, 1, 1, 1])
+        self.assertEqual(list(world.can_see_many(w.map, 10, 10, 30, targets)),
+                         expected)
+        self.assertEqual(list(character.can_see_many(targets)), expected)
+        self.assertEqual(len(world.can_see_many(w.map, 0, 0, 0, array('f'))),
+                         0)
+        with self.assertRaises(ValueError):
+            world.can_see_many(w.map, 0, 0, 0, array('f', [1, 2]))
+
+        directions = [(1, 0, 0), (-1, 0, 0), (0, 0, 2), (3, 0, 0)]
+        expected = []
+        for direction in directions:
+            character.orientation.set(*direction)
+            expected.append(character.cast_ray(32.0))
+        self.assertEqual(expected, [(20, 10, 30), None, None, (20, 10, 30)])
+        rays = array('f', [value for direction in directions
+                           for value in (10, 10, 30) + direction])
+        hits, coords = world.cast_rays(w.map, rays, 32.0)
+        self.assertEqual(
+            [tuple(coords[i * 3:i * 3 + 3]) if hit else None
+             for i, hit in enumerate(hits)], expected)
+        # too short to reach the wall
+        hits, coords = world.cast_rays(w.map, rays[:6], 5.0)
+        self.assertEqual(list(hits), [0])
+        with self.assertRaises(ValueError):
+            world.cast_rays(w.map, array('f', [1, 2, 3]))